@@ -110,11 +110,31 @@ migrate_opts = [
                      'False - not keep volume_storage'),
     cfg.StrOpt('speed_limit', default='10MB',
                help='speed limit for glance to glance'),
+    cfg.IntOpt('image_workers', default=1,
+               help='Number of images copied simultaneously by glance to '
+                    'glance migration, speed_limit is shared between them'),
+    cfg.IntOpt('boot_workers', default=1,
+               help='Number of VMs created simultaneously on destination, '
+                    'all of them are waited for together'),
+    cfg.IntOpt('instance_read_workers', default=1,
+               help='Number of compute hosts instances info is read from '
+                    'simultaneously'),
+    cfg.IntOpt('objstorage_workers', default=1,
+               help='Number of objects (or segments of large object) copied '
+                    'simultaneously by object storage migration'),
+    cfg.IntOpt('swift_segment_size', default=1024,
+               help='Objects larger than this size in MB are copied to '
+                    'destination object storage as static large objects '
+                    'with segments of this size, 0 - never'),
     cfg.StrOpt('file_compression', default='dd',
-               help='gzip - use GZIP when file transferring via ssh, '
-                    ' - no compression, directly via dd'),
-    cfg.IntOpt('level_compression', default='7',
-               help='level compression for gzip'),
+               help='Compression of data transferred via ssh: dd - no '
+                    'compression, gzip, pigz, lz4, zstd, xz, or auto - '
+                    'codec giving the best throughput for a sample of '
+                    'transferred data'),
+    cfg.IntOpt('level_compression',
+               help='level compression for the codec, clamped into the '
+                    'levels supported by the codec, default level of the '
+                    'codec if not set'),
     cfg.StrOpt('ssh_transfer_port', default='9990',
                help='interval ports for ssh tunnel'),
     cfg.StrOpt('port', default='9990',
@@ -139,6 +159,56 @@ migrate_opts = [
                help='Time wait if except Performing error'),
     cfg.IntOpt('ssh_chunk_size', default=100,
                help='Size of one chunk to transfer via SSH'),
+    cfg.IntOpt('ssh_chunks_in_flight', default=4,
+               help='Number of chunks of a file transferred via SSH '
+                    'simultaneously'),
+    cfg.StrOpt('transfer_manifest_dir', default='transfer_manifests',
+               help='Directory with manifests of chunks of files already '
+                    'transferred to destination, used to resume interrupted '
+                    'transfers. Transfers are not resumed if empty'),
+    cfg.BoolOpt('resumable_file_transfer', default=False,
+                help='Copy files with SSHFileToFile driver by chunks of '
+                     'ssh_chunk_size, so that interrupted transfer is '
+                     'resumed'),
+    cfg.BoolOpt('sparse_file_transfer', default=False,
+                help='Copy only allocated extents of files found with '
+                     '"qemu-img map" and keep holes on destination'),
+    cfg.IntOpt('rbd_import_sparse_size', default=0,
+               help='Size in bytes of zero runs "rbd import" does not write '
+                    'to Ceph when file is copied to Ceph, 0 - do not pass '
+                    'the option, it is supported since Ceph Luminous'),
+    cfg.IntOpt('ssh_transfer_streams', default=1,
+               help='Number of ssh streams a file is copied with by '
+                    'SSHFileToFile driver, each of them copies its own '
+                    'range of the file'),
+    cfg.BoolOpt('delta_file_transfer', default=False,
+                help='Copy files with SSHFileToFile driver comparing MD5 of '
+                     'blocks of source and destination files and sending '
+                     'only blocks which differ'),
+    cfg.IntOpt('delta_block_size', default=4,
+               help='Size of a block in MB compared by delta file transfer'),
+    cfg.IntOpt('instance_workers', default=1,
+               help='Number of instances migrated simultaneously'),
+    cfg.IntOpt('instance_workers_per_host', default=2,
+               help='Number of instances from the same source compute host '
+                    'migrated simultaneously, 0 - unlimited'),
+    cfg.IntOpt('instance_workers_per_storage', default=0,
+               help='Number of instances with disks on the same storage '
+                    'backend migrated simultaneously, 0 - unlimited'),
+    cfg.IntOpt('cinder_db_chunk_size', default=1000,
+               help='Number of rows of cinder DB tables read and written '
+                    'to destination at once by database migration '
+                    'strategy'),
+    cfg.IntOpt('transfer_workers', default=1,
+               help='Number of volumes or disk files copied simultaneously'),
+    cfg.IntOpt('transfer_workers_per_host', default=2,
+               help='Number of volumes or disk files copied simultaneously '
+                    'from or to the same host, 0 - unlimited'),
+    cfg.IntOpt('transfer_workers_per_backend', default=0,
+               help='Number of volumes of the same volume type copied '
+                    'simultaneously, 0 - unlimited'),
+    cfg.BoolOpt('transfer_largest_first', default=False,
+                help='Start copying the largest volumes first'),
     cfg.StrOpt('group_file_path', default="vm_groups.yaml",
                help='Path to file with the groups of VMs'),
     cfg.StrOpt('scenario', default='scenario/migrate.yaml',
@@ -164,9 +234,18 @@ migrate_opts = [
                 help="Uses low-level DB requests if set to True, "
                 "may be incompatible with more recent versions of "
                 "Keystone. Tested on grizzly, icehouse and juno."),
+    cfg.IntOpt('identity_cache_ttl', default=600,
+               help='Number of seconds Keystone tenants, users and roles are '
+                    'cached for, 0 - for the whole migration'),
     cfg.IntOpt('ssh_connection_attempts', default=3,
                help='Number of times CloudFerry will attempt to connect when '
                     'connecting to a new server via SSH.'),
+    cfg.IntOpt('ssh_control_persist', default=300,
+               help='Number of seconds SSH connections opened from the cloud '
+                    'controller to compute nodes are kept open after the '
+                    'last command (OpenSSH ControlPersist), so that following '
+                    'commands reuse them instead of connecting again. 0 '
+                    'disables connection sharing.'),
     cfg.BoolOpt('ignore_empty_images',
                 help='Ignore images with size 0 and exclude them from '
                      'migration process', default=False),
@@ -202,6 +281,19 @@ src_mysql_opts = [
                help='port for mysql connection'),
     cfg.StrOpt('db_connection', default='mysql+mysqlconnector',
                help='driver for connection'),
+    cfg.IntOpt('db_pool_size', default=5,
+               help='number of connections kept open in the connection '
+                    'pool of each database'),
+    cfg.IntOpt('db_max_overflow', default=10,
+               help='number of connections which may be opened above '
+                    '`db_pool_size` under load'),
+    cfg.IntOpt('db_pool_timeout', default=30,
+               help='seconds to wait for a free connection from the pool'),
+    cfg.IntOpt('db_pool_recycle', default=3600,
+               help='seconds after which pooled connections are reopened, '
+                    'should be lower than MySQL `wait_timeout`'),
+    cfg.BoolOpt('db_pool_pre_ping', default=True,
+                help='check pooled connections for liveness before use'),
 ]
 
 
@@ -372,6 +464,19 @@ dst_mysql_opts = [
                help='port for mysql connection'),
     cfg.StrOpt('db_connection', default='mysql+mysqlconnector',
                help='driver for connection'),
+    cfg.IntOpt('db_pool_size', default=5,
+               help='number of connections kept open in the connection '
+                    'pool of each database'),
+    cfg.IntOpt('db_max_overflow', default=10,
+               help='number of connections which may be opened above '
+                    '`db_pool_size` under load'),
+    cfg.IntOpt('db_pool_timeout', default=30,
+               help='seconds to wait for a free connection from the pool'),
+    cfg.IntOpt('db_pool_recycle', default=3600,
+               help='seconds after which pooled connections are reopened, '
+                    'should be lower than MySQL `wait_timeout`'),
+    cfg.BoolOpt('db_pool_pre_ping', default=True,
+                help='check pooled connections for liveness before use'),
 ]
 
 dst_rabbit = cfg.OptGroup(name='dst_rabbit',
@@ -578,7 +683,15 @@ condense_opts = [
                 help=("Stores interim data required for the condensation "
                       "process to run in files defined in `flavors_file`, "
                       "`nodes_file`, and `group_file` config options.")),
-    cfg.IntOpt('precision', default=85)]
+    cfg.IntOpt('precision', default=85),
+    cfg.IntOpt('ram_granularity', default=1,
+               help=("Number of reduced ram units joined into one by "
+                     "knapsack solvers. Values bigger than 1 make "
+                     "condensation faster but less precise.")),
+    cfg.IntOpt('max_knapsack_size', default=0,
+               help=("Maximum number of cells in the knapsack table of one "
+                     "node, greedy filling is used for bigger nodes. "
+                     "0 means no limit."))]
 
 database = cfg.OptGroup(name="database",
                         title="options for database")
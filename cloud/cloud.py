@@ -14,6 +14,7 @@
 
 
 import copy
+from cloudferrylib.base import clients
 from cloudferrylib.utils import utils
 from cloudferrylib.utils import mysql_connector
 from cloudferrylib.utils import rbd_util
@@ -31,6 +32,7 @@ class Cloud(object):
         self.resources = resources
         self.position = position
         self.config = config
+        self.clients = clients.ClientRegistry()
 
         self.cloud_config = self.make_cloud_config(self.config, self.position)
         self.init_resources(self.cloud_config)
@@ -90,8 +90,11 @@ class Grouping(object):
     def _group_nested_network(self, instances_list=None):
         groups = {}
 
-        networks_list = self.network.get_networks_list()
-        subnets_list = self.network.get_subnets_list()
+        networks_list = {net['id']: net
+                         for net in self.network.get_networks_list()}
+        subnets_list = neutron.SubnetTree()
+        for subnet in self.network.get_subnets_list():
+            subnets_list.add(subnet)
 
         search_list = (instances_list if instances_list else
                        self.compute.get_instances_list(
@@ -16,7 +16,7 @@
 import cloud
 import cloud_ferry
 from cloudferrylib.base.action import copy_var, rename_info, \
-    merge, is_end_iter, get_info_iter
+    merge, parallel_iter
 from cloudferrylib.os.actions import identity_transporter
 from cloudferrylib.scheduler import scheduler
 from cloudferrylib.scheduler import namespace
@@ -56,6 +56,7 @@ from cloudferrylib.os.actions import transport_ephemeral
 from cloudferrylib.os.actions import is_not_transport_image
 from cloudferrylib.os.actions import is_not_merge_diff
 from cloudferrylib.os.actions import stop_vm
+from cloudferrylib.utils import mysql_connector
 from cloudferrylib.utils import utils as utl
 from cloudferrylib.os.actions import transport_compute_resources
 from cloudferrylib.os.actions import task_transfer
@@ -129,7 +130,10 @@ class OS2OSFerry(cloud_ferry.CloudFerry):
                                  for k, v in scenario.get_net().items()}
         scheduler_migr = scheduler.Scheduler(namespace=namespace_scheduler,
                                              **process_migration)
-        scheduler_migr.start()
+        try:
+            scheduler_migr.start()
+        finally:
+            mysql_connector.dispose_engines()
 
     def process_migrate(self):
         check_environment = self.check_environment()
@@ -168,10 +172,6 @@ class OS2OSFerry(cloud_ferry.CloudFerry):
         name_result = 'info_result'
         name_backup = 'info_backup'
         name_iter = 'info_iter'
-        save_result = self.save_result(name_data,
-                                       name_result,
-                                       name_result,
-                                       'instances')
         trans_one_inst = self.migrate_process_instance()
         init_iteration_instance = self.init_iteration_instance(name_data,
                                                                name_backup,
@@ -184,12 +184,15 @@ class OS2OSFerry(cloud_ferry.CloudFerry):
             get_info_instances.GetInfoInstances(self.init,
                                                 cloud='src_cloud')
         act_cleanup_images = cleanup_images.CleanupImages(self.init)
-        get_next_instance = get_info_iter.GetInfoIter(self.init)
+        transport_instances = parallel_iter.ParallelIter(self.init,
+                                                         name_iter,
+                                                         name_data,
+                                                         name_result,
+                                                         net=trans_one_inst)
         check_for_instance = check_instances.CheckInstances(self.init)
         rename_info_iter = rename_info.RenameInfo(self.init,
                                                   name_result,
                                                   name_data)
-        is_instances = is_end_iter.IsEndIter(self.init)
 
         transport_instances_and_dependency_resources = \
             act_get_filter >> \
@@ -197,10 +200,7 @@ class OS2OSFerry(cloud_ferry.CloudFerry):
             init_iteration_instance >> \
             act_check_needed_compute_resources >> \
             (check_for_instance | rename_info_iter) >> \
-            get_next_instance >> \
-            trans_one_inst >> \
-            save_result >> \
-            (is_instances | get_next_instance) >>\
+            transport_instances >> \
             rename_info_iter >> \
             act_cleanup_images
         return transport_instances_and_dependency_resources
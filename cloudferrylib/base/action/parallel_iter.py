@@ -0,0 +1,189 @@
+# Copyright (c) 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the License);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an AS IS BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and#
+# limitations under the License.
+
+
+import collections
+import copy
+import Queue
+import threading
+
+from cloudferrylib.base.action import action
+from cloudferrylib.scheduler import cursor
+from cloudferrylib.scheduler import namespace
+from cloudferrylib.scheduler import scheduler
+from cloudferrylib.utils import utils as utl
+
+
+LOG = utl.get_log(__name__)
+
+UNLIMITED = 0
+POLL_INTERVAL = 1
+
+
+def copy_net(net):
+    """Makes shallow copies of all the elements of a net keeping links
+    between them, so the copy can be processed independently of the
+    original (conditional tasks keep chosen path in their state)."""
+
+    copies = {}
+
+    def copy_element(elem):
+        if elem is None:
+            return None
+        if id(elem) in copies:
+            return copies[id(elem)]
+        elem_copy = copy.copy(elem)
+        copies[id(elem)] = elem_copy
+        elem_copy.prev_element = copy_element(elem.prev_element)
+        elem_copy.next_element = [copy_element(e) for e in elem.next_element]
+        elem_copy.parall_elem = [copy_element(e) for e in elem.parall_elem]
+        return elem_copy
+
+    return copy_element(net)
+
+
+class ParallelIter(action.Action):
+    """Runs sub-chain for each object of the iterated info, the same way as
+    `GetInfoIter` >> sub-chain >> `Merge` >> `IsEndIter` loop does, but
+    processes up to `migrate.instance_workers` objects at once.
+
+    Number of objects processed simultaneously on the same compute host and
+    the same storage backend is limited with
+    `migrate.instance_workers_per_host` and
+    `migrate.instance_workers_per_storage` options. Result of each object is
+    merged into :arg result_name: info.
+
+    Sub-chain is set with `set_net`, in a scenario file it is described as
+    nested list of the task.
+    """
+
+    def __init__(self, init, iter_info_name='info_iter', info_name='info',
+                 result_name='info_result',
+                 resource_name=utl.INSTANCES_TYPE, net=None):
+        self.iter_info_name = iter_info_name
+        self.info_name = info_name
+        self.result_name = result_name
+        self.resource_name = resource_name
+        self.net = net
+        super(ParallelIter, self).__init__(init)
+
+    def set_net(self, net):
+        self.net = net
+
+    def run(self, **kwargs):
+        iter_info = kwargs[self.iter_info_name]
+        result = kwargs[self.result_name]
+        objs = iter_info[self.resource_name]
+
+        workers = max(self.cfg.migrate.instance_workers, 1)
+        if workers > 1:
+            # workers run remote commands with their own fabric settings
+            with utl.thread_local_fabric_env():
+                self._run_workers(objs, result, kwargs, workers)
+        else:
+            self._run_workers(objs, result, kwargs, workers)
+
+        return {
+            self.iter_info_name: iter_info,
+            self.result_name: result
+        }
+
+    def _run_workers(self, objs, result, kwargs, workers):
+        per_host = self.cfg.migrate.instance_workers_per_host
+        per_storage = self.cfg.migrate.instance_workers_per_storage
+
+        pending = collections.deque(objs.keys())
+        running = {}
+        host_usage = collections.defaultdict(int)
+        storage_usage = collections.defaultdict(int)
+        finished = Queue.Queue()
+        error = None
+
+        def can_start(obj_id):
+            host = self.get_host(objs[obj_id])
+            storage = self.get_storage(objs[obj_id])
+            return ((per_host == UNLIMITED or host_usage[host] < per_host) and
+                    (per_storage == UNLIMITED or
+                     storage_usage[storage] < per_storage))
+
+        while pending or running:
+            if error is None:
+                for obj_id in list(pending):
+                    if len(running) >= workers:
+                        break
+                    # limits are not applied when nothing is running, so
+                    # zero or misconfigured limits do not stall migration
+                    if running and not can_start(obj_id):
+                        continue
+                    pending.remove(obj_id)
+                    obj = objs.pop(obj_id)
+                    running[obj_id] = obj
+                    host_usage[self.get_host(obj)] += 1
+                    storage_usage[self.get_storage(obj)] += 1
+                    self._start(obj_id, obj, kwargs, finished,
+                                in_thread=workers > 1)
+            elif not running:
+                break
+
+            try:
+                obj_id, obj_info, exc = finished.get(timeout=POLL_INTERVAL)
+            except Queue.Empty:
+                continue
+
+            obj = running.pop(obj_id)
+            host_usage[self.get_host(obj)] -= 1
+            storage_usage[self.get_storage(obj)] -= 1
+            if exc is not None:
+                LOG.error("Failed to process %s '%s'", self.resource_name,
+                          obj_id)
+                error = error or exc
+            else:
+                result[self.resource_name].update(
+                    obj_info[self.resource_name])
+
+        if error is not None:
+            raise error
+
+    def _start(self, obj_id, obj, kwargs, finished, in_thread):
+        variables = dict(kwargs)
+        variables[self.info_name] = {self.resource_name: {obj_id: obj}}
+        if in_thread:
+            thread = threading.Thread(target=self._process,
+                                      args=(obj_id, variables, finished))
+            thread.daemon = True
+            thread.start()
+        else:
+            self._process(obj_id, variables, finished)
+
+    def _process(self, obj_id, variables, finished):
+        LOG.info("Processing %s '%s'", self.resource_name, obj_id)
+        ns = namespace.Namespace(variables)
+        sched = scheduler.BaseScheduler(namespace=ns)
+        sched.process_chain(cursor.Cursor(copy_net(self.net)),
+                            "%s %s" % (self.resource_name, obj_id))
+        if sched.status_error == scheduler.ERROR:
+            finished.put((obj_id, None, sched.exception))
+        else:
+            finished.put((obj_id, ns.vars[self.info_name], None))
+
+    @staticmethod
+    def get_host(obj):
+        return obj[utl.INSTANCE_BODY].get('host')
+
+    def get_storage(self, obj):
+        """Returns storage backend which keeps disks of an instance."""
+
+        if obj[utl.INSTANCE_BODY].get('boot_mode') == utl.BOOT_FROM_VOLUME:
+            return utl.STORAGE_RESOURCE
+        return self.cfg.src_compute.backend
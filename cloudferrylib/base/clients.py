@@ -16,6 +16,12 @@
 Keeps logic for Openstack Clients used in CF
 """
 
+import threading
+
+from cloudferrylib.utils import utils
+
+LOG = utils.get_log(__name__)
+
 
 def os_cli_cmd(config, client, *args):
     """
@@ -48,3 +54,54 @@ def os_cli_cmd(config, client, *args):
     )
 
     return cmd
+
+
+class ClientRegistry(object):
+    """Keeps one authenticated Openstack client per service, tenant and user.
+
+    Creating a client usually means authenticating in keystone, so resources
+    must take clients from the registry instead of building them on every
+    API call. Cached clients keep their token and HTTP session between calls
+    and renew the token themselves when it is about to expire.
+
+    Client which depends on a token obtained elsewhere (e.g. glance client
+    built from keystone token) is registered with that token and gets
+    rebuilt as soon as the token changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clients = {}
+
+    def get(self, service, tenant, user, factory, token=None):
+        """Returns cached client or creates new one with :arg factory:
+
+        :arg service: service type (compute, identity, image, etc)
+        :arg tenant: tenant name client is scoped to
+        :arg user: user name client is authenticated with
+        :arg factory: callable without arguments returning new client
+        :arg token: auth token client is built with, if client does not
+        authenticate itself
+        """
+
+        key = (service, tenant, user)
+        with self._lock:
+            cached = self._clients.get(key)
+            if cached is not None and cached[1] == token:
+                return cached[0]
+            LOG.debug("Creating %s client for user '%s' in tenant '%s'",
+                      service, user, tenant)
+            client = factory()
+            self._clients[key] = (client, token)
+            return client
+
+    def invalidate(self, service=None, tenant=None, user=None):
+        """Forgets clients matching all of the arguments given. Must be
+        called when tokens get revoked, e.g. on user role changes."""
+
+        with self._lock:
+            for key in self._clients.keys():
+                if all(expected is None or expected == actual
+                       for expected, actual in zip((service, tenant, user),
+                                                   key)):
+                    del self._clients[key]
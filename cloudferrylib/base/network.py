@@ -30,6 +30,9 @@ class Network(resource.Resource):
     def create_port(self, net_id, mac, ip, tenant_id, keep_ip, sg_ids=None):
         raise NotImplemented("it's base class")
 
+    def create_ports(self, tenant_id, ports):
+        raise NotImplemented("it's base class")
+
     def delete_port(self, port_id):
         raise NotImplemented("it's base class")
 
@@ -38,3 +41,6 @@ class Network(resource.Resource):
 
     def get_security_groups(self):
         raise NotImplemented("it's base class")
+
+    def get_security_group_ids(self, tenant_id, names):
+        raise NotImplemented("it's base class")
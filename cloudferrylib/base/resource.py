@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and#
 # limitations under the License.
 
+import threading
 import time
 from cloudferrylib.utils import proxy_client
 from cloudferrylib.utils import timeout_exception
@@ -20,7 +21,119 @@ from cloudferrylib.utils import utils
 LOG = utils.get_log(__name__)
 
 
+class StatusWatch(object):
+    """Pending wait for resource :res_id to get one of :statuses, resolved by
+    StatusWatcher. :callback is called with the watch once it is resolved."""
+
+    def __init__(self, res_id, statuses, timeout, callback=None):
+        self.res_id = res_id
+        self.statuses = statuses
+        self.remaining = timeout
+        self.callback = callback
+        self.status = None
+        self.reached = False
+        self.done = threading.Event()
+
+    def resolve(self, status, reached):
+        self.status = status
+        self.reached = reached
+        self.done.set()
+        if self.callback is not None:
+            self.callback(self)
+
+    def result(self):
+        """Returns status of the resource once it is resolved, raises
+        TimeoutException if it has not got expected status in time."""
+
+        self.done.wait()
+        if not self.reached:
+            raise timeout_exception.TimeoutException(
+                self.status and self.status.lower(),
+                '|'.join(self.statuses), "Timeout exp")
+        return self.status
+
+
+class StatusWatcher(object):
+    """Waits for statuses of many resources at once: statuses of all pending
+    watches are requested with one :get_statuses call per poll, so that
+    threads waiting for different resources share the polls.
+
+    Poll interval starts with :min_interval seconds and doubles up to
+    :max_interval while nothing changes, it is reset once a watch is added or
+    resolved. Timeouts are counted in the intervals slept."""
+
+    def __init__(self, get_statuses, min_interval=1, max_interval=32):
+        self.get_statuses = get_statuses
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._watches = []
+        self._added = False
+
+    def watch(self, res_id, wait_status, timeout=60, callback=None):
+        """Returns StatusWatch for resource :res_id to get :wait_status,
+        which is a status or list of statuses."""
+
+        if isinstance(wait_status, basestring):
+            wait_status = [wait_status]
+        watch = StatusWatch(res_id, [s.lower() for s in wait_status],
+                            timeout, callback)
+        with self._lock:
+            self._watches.append(watch)
+            self._added = True
+        return watch
+
+    def wait(self, watches):
+        """Blocks until all :watches are resolved, returns list of their
+        statuses. One of waiting threads polls statuses for all of them,
+        others wait to be resolved or to take over the polling."""
+
+        for watch in watches:
+            while not watch.done.is_set():
+                if self._poll_lock.acquire(False):
+                    try:
+                        self._poll(watch)
+                    finally:
+                        self._poll_lock.release()
+                else:
+                    watch.done.wait(self.min_interval)
+        return [watch.result() for watch in watches]
+
+    def _poll(self, watch):
+        interval = self.min_interval
+        while True:
+            with self._lock:
+                pending = list(self._watches)
+            statuses = self.get_statuses(
+                sorted(set(w.res_id for w in pending)))
+            resolved = []
+            for w in pending:
+                status = statuses.get(w.res_id)
+                if status is not None and status.lower() in w.statuses:
+                    resolved.append((w, status, True))
+                elif w.remaining <= 0:
+                    resolved.append((w, status, False))
+            with self._lock:
+                for w, _, _ in resolved:
+                    self._watches.remove(w)
+                added, self._added = self._added, False
+            for w, status, reached in resolved:
+                w.resolve(status, reached)
+            if watch.done.is_set():
+                return
+            if resolved or added:
+                interval = self.min_interval
+            else:
+                interval = min(interval * 2, self.max_interval)
+            time.sleep(interval)
+            for w in pending:
+                w.remaining -= interval
+
+
 class Resource(object):
+    _watcher_lock = threading.Lock()
+
     def __init__(self):
         pass
 
@@ -46,7 +159,47 @@ class Resource(object):
         filtering feature."""
         return []
 
+    @property
+    def status_watcher(self):
+        """StatusWatcher shared by all waits for statuses of the resource."""
+
+        with Resource._watcher_lock:
+            if getattr(self, '_status_watcher', None) is None:
+                self._status_watcher = StatusWatcher(self.get_statuses)
+        return self._status_watcher
+
+    def get_statuses(self, res_ids):
+        """Returns dict of statuses of :res_ids by ID. Resources able to get
+        statuses of many objects with one request override it."""
+
+        return {res_id: self.get_status(res_id) for res_id in res_ids}
+
+    def wait_for_statuses(self, res_ids, wait_status, timeout=60):
+        """Waits for all of :res_ids to get :wait_status at once, raises
+        TimeoutException if any of them has not got it in :timeout
+        seconds."""
+
+        watcher = self.status_watcher
+        return watcher.wait([watcher.watch(res_id, wait_status, timeout)
+                             for res_id in res_ids])
+
+    def try_wait_for_statuses(self, res_ids, wait_status, timeout=60):
+        watcher = self.status_watcher
+        watches = [watcher.watch(res_id, wait_status, timeout)
+                   for res_id in res_ids]
+        try:
+            watcher.wait(watches)
+        except timeout_exception.TimeoutException:
+            for watch in watches:
+                if not watch.reached:
+                    LOG.warning("Resource '%s' has not changed status to "
+                                "'%s'(%s)", watch.res_id, wait_status,
+                                watch.status)
+
     def wait_for_status(self, res_id, get_status, wait_status, timeout=60):
+        if get_status == self.get_status:
+            self.wait_for_statuses([res_id], wait_status, timeout)
+            return
         delay = 1
         while delay < timeout:
             if get_status(res_id).lower() == wait_status.lower():
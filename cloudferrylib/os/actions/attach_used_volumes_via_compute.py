@@ -24,6 +24,7 @@ class AttachVolumesCompute(action.Action):
         info = copy.deepcopy(info)
         compute_res = self.cloud.resources[utl.COMPUTE_RESOURCE]
         storage_res = self.cloud.resources[utl.STORAGE_RESOURCE]
+        attached = []
         for instance in info[utl.INSTANCES_TYPE].itervalues():
             if not instance[utl.META_INFO].get(utl.VOLUME_BODY):
                 continue
@@ -31,7 +32,6 @@ class AttachVolumesCompute(action.Action):
                 if storage_res.get_status(
                         vol['volume']['id']) != 'in-use':
                     compute_res.attach_volume_to_instance(instance, vol)
-                    storage_res.wait_for_status(vol['volume']['id'],
-                                                storage_res.get_status,
-                                                'in-use')
+                    attached.append(vol['volume']['id'])
+        storage_res.wait_for_statuses(attached, 'in-use')
         return {}
@@ -21,6 +21,18 @@ import jsondate
 NAMESPACE_CINDER_CONST = "cinder_database"
 
 
+def mark_volumes_detached(volumes):
+    """Volumes are attached to the new instances later, so attached ones
+    are written to destination as available."""
+
+    for volume in volumes:
+        if volume['status'] == 'in-use':
+            volume['mountpoint'] = None
+            volume['status'] = 'available'
+            volume['instance_uuid'] = None
+            volume['attach_status'] = 'detached'
+
+
 class CinderDatabaseInteraction(action.Action):
     __metaclass__ = abc.ABCMeta
 
@@ -54,11 +66,23 @@ class WriteVolumesDb(CinderDatabaseInteraction):
                 "Cannot read attribute {attribute} from namespace".format(
                     attribute=NAMESPACE_CINDER_CONST))
         data = jsondate.loads(data_from_namespace)
-        # mark attached volumes as available
-        for volume in data['volumes']:
-            if volume['status'] == 'in-use':
-                volume['mountpoint'] = None
-                volume['status'] = 'available'
-                volume['instance_uuid'] = None
-                volume['attach_status'] = 'detached'
+        mark_volumes_detached(data['volumes'])
         self.get_resource().deploy(jsondate.dumps(data))
+
+
+class TransportVolumesDb(action.Action):
+    """Copies cinder DB from source to destination page by page, unlike
+    GetVolumesDb and WriteVolumesDb which pass the whole DB through the
+    namespace."""
+
+    def run(self, *args, **kwargs):
+        search_opts = kwargs.get('search_opts_tenant', {})
+        src_storage = self.src_cloud.resources[utils.STORAGE_RESOURCE]
+        dst_storage = self.dst_cloud.resources[utils.STORAGE_RESOURCE]
+
+        def transform(table, rows):
+            if table == 'volumes':
+                mark_volumes_detached(rows)
+
+        src_storage.copy_tables(dst_storage, transform, **search_opts)
+        return {}
@@ -44,6 +44,7 @@ class ConvertVolumeToImage(converter.Converter):
         if not require_methods(['upload_volume_to_image'], resource_storage):
             raise RuntimeError("No require methods")
         images_from_volumes = {}
+        uploaded = {}
         for volume_id, volume in volumes_info[utl.VOLUMES_TYPE].iteritems():
             vol = volume['volume']
             LOG.debug(
@@ -54,9 +55,10 @@ class ConvertVolumeToImage(converter.Converter):
                 vol['id'], force=True, image_name=vol['id'],
                 container_format=self.container_format,
                 disk_format=self.disk_format)
-            resource_image.wait_for_status(image_id,
-                                           resource_image.get_status,
-                                           ACTIVE)
+            uploaded[image_id] = volume
+        resource_image.wait_for_statuses(uploaded.keys(), ACTIVE)
+        for image_id, volume in uploaded.iteritems():
+            vol = volume['volume']
             resource_image.patch_image(resource_image.get_backend(), image_id)
             image_vol = resource_image.get_image_by_id_converted(image_id)
             img_new = {
@@ -29,6 +29,6 @@ class CopyFromObjectToObject(transporter.Transporter):
         if not objstorage_info:
             action_get_obj = get_info_objects.GetInfoObjects(self.init,
                                                              self.src_cloud)
-            objstorage_info = action_get_obj.run()
+            objstorage_info = action_get_obj.run()['objstorage_info']
         dst_objstorage.deploy(objstorage_info)
         return {}
@@ -37,14 +37,16 @@ class DeployVolumes(action.Action):
                 }
         }
         volumes = storage_info_new[utl.VOLUMES_TYPE]
+        new_volumes = (volume_resource.read_info(ids=set(new_ids))
+                       if new_ids else {utl.VOLUMES_TYPE: {}})
         for new_id, old_id in new_ids.iteritems():
-            volume = volume_resource.read_info(id=new_id)
-            volume[utl.VOLUMES_TYPE][new_id][OLD_ID] = old_id
-            volume[utl.VOLUMES_TYPE][new_id]['snapshots'] = \
+            volume = new_volumes[utl.VOLUMES_TYPE][new_id]
+            volume[OLD_ID] = old_id
+            volume['snapshots'] = \
                 storage_info[utl.VOLUMES_TYPE][old_id]['snapshots']
-            volume[utl.VOLUMES_TYPE][new_id][utl.META_INFO] = \
+            volume[utl.META_INFO] = \
                 storage_info[utl.VOLUMES_TYPE][old_id][utl.META_INFO]
-            volumes.update(volume[utl.VOLUMES_TYPE])
+            volumes[new_id] = volume
         return {
             'storage_info': storage_info_new
         }
@@ -26,6 +26,7 @@ class DetachVolumesCompute(action.Action):
         info = copy.deepcopy(info)
         compute_resource = self.cloud.resources[utils.COMPUTE_RESOURCE]
         storage_resource = self.cloud.resources[utils.STORAGE_RESOURCE]
+        detached = []
         for instance in info[utils.INSTANCES_TYPE].itervalues():
             LOG.debug("Detaching volumes for instance %s [%s]" %
                       (instance['instance']['name'],
@@ -40,6 +41,6 @@ class DetachVolumesCompute(action.Action):
                     compute_resource.detach_volume(instance['instance']['id'],
                                                    vol['id'])
                     LOG.debug("Detach volume %s" % vol['id'])
-                    storage_resource.wait_for_status(
-                        vol['id'], storage_resource.get_status, 'available')
+                    detached.append(vol['id'])
+        storage_resource.wait_for_statuses(detached, 'available')
         return {}
@@ -13,8 +13,8 @@
 # limitations under the License.
 
 
+import collections
 import copy
-from neutronclient.common import exceptions as neutronclient_exceptions
 
 from cloudferrylib.base.action import action
 from cloudferrylib.utils import utils as utl
@@ -27,7 +27,7 @@ class PrepareNetworks(action.Action):
 
     Process:
      - For each port on source create port with the same IP and MAC on
-       destination
+       destination, ports of a tenant are created with bulk requests
 
     Requirements:
      - Networks and subnets must be deployed on destination
@@ -55,8 +55,9 @@ class PrepareNetworks(action.Action):
             if snet['tenant_name'] in tenants:
                 network_resource.reset_subnet_dhcp(snet['id'], False)
 
+        # ports are created in bulk for all interfaces of a tenant
+        tenants_interfaces = collections.OrderedDict()
         for (id_inst, inst) in instances.iteritems():
-            params = []
             networks_info = inst[utl.INSTANCE_BODY][utl.INTERFACES]
             security_groups = inst[utl.INSTANCE_BODY]['security_groups']
             tenant_name = inst[utl.INSTANCE_BODY]['tenant_name']
@@ -68,19 +69,25 @@ class PrepareNetworks(action.Action):
                                                                src_net['mac'])
                 if port_id:
                     network_resource.delete_port(port_id)
-                sg_ids = []
-                for sg in network_resource.get_security_groups():
-                    if sg['tenant_id'] == tenant_id:
-                        if sg['name'] in security_groups:
-                            sg_ids.append(sg['id'])
-                try:
-                    port = network_resource.create_port(dst_net['id'],
-                                                        src_net['mac'],
-                                                        src_net['ip'],
-                                                        tenant_id,
-                                                        keep_ip,
-                                                        sg_ids)
-                except neutronclient_exceptions.IpAddressInUseClient:
+                sg_ids = network_resource.get_security_group_ids(
+                    tenant_id, security_groups)
+                tenants_interfaces.setdefault(tenant_id, []).append(
+                    (id_inst, src_net, dst_net, sg_ids))
+            instances[id_inst][utl.INSTANCE_BODY]['nics'] = []
+
+        dst_floatingips_map = None
+        for tenant_id, interfaces in tenants_interfaces.iteritems():
+            ports = network_resource.create_ports(
+                tenant_id,
+                [{'net_id': dst_net['id'],
+                  'mac': src_net['mac'],
+                  'ip': src_net['ip'],
+                  'keep_ip': keep_ip,
+                  'sg_ids': sg_ids}
+                 for _, src_net, dst_net, sg_ids in interfaces])
+            for (id_inst, src_net, dst_net, _), port in zip(interfaces,
+                                                            ports):
+                if port is None:
                     LOG.warning("IP address '%s' on destination net '%s (%s)' "
                                 "already exists!",
                                 src_net['ip'], dst_net['name'], dst_net['id'])
@@ -88,13 +95,13 @@ class PrepareNetworks(action.Action):
                 fip = None
                 src_fip = src_net['floatingip']
                 if src_fip:
-                    dst_flotingips = network_resource.get_floatingips()
-                    dst_flotingips_map = {
-                        fl_ip['floating_ip_address']: fl_ip['id']
-                        for fl_ip in dst_flotingips
-                    }
+                    if dst_floatingips_map is None:
+                        dst_floatingips_map = {
+                            fl_ip['floating_ip_address']: fl_ip['id']
+                            for fl_ip in network_resource.get_floatingips()
+                        }
                     # floating IP may be filtered and not exist on dest
-                    dst_floatingip_id = dst_flotingips_map.get(src_fip)
+                    dst_floatingip_id = dst_floatingips_map.get(src_fip)
                     if dst_floatingip_id is None:
                         LOG.warning("Floating IP '%s' is not available on "
                                     "destination, make sure floating IPs "
@@ -102,10 +109,10 @@ class PrepareNetworks(action.Action):
                     else:
                         fip = {'dst_floatingip_id': dst_floatingip_id,
                                'dst_port_id': port['id']}
-                params.append({'net-id': dst_net['id'],
-                               'port-id': port['id'],
-                               'floatingip': fip})
-            instances[id_inst][utl.INSTANCE_BODY]['nics'] = params
+                instances[id_inst][utl.INSTANCE_BODY]['nics'].append(
+                    {'net-id': dst_net['id'],
+                     'port-id': port['id'],
+                     'floatingip': fip})
         info_compute[utl.INSTANCES_TYPE] = instances
 
         # Reset DHCP to the original settings
@@ -13,11 +13,31 @@
 # limitations under the License.
 
 
+import collections
+import Queue
+import threading
+
 from cloudferrylib.base.action import action
 from cloudferrylib.utils import utils as utl
 
 
+LOG = utl.get_log(__name__)
+
+UNLIMITED = 0
+
+
 class TaskTransfer(action.Action):
+    """Copies data of each object of the input info with the transfer driver,
+    up to `migrate.transfer_workers` objects at once.
+
+    Number of objects copied simultaneously from or to the same host and of
+    the same volume type (storage backend) is limited with
+    `migrate.transfer_workers_per_host` and
+    `migrate.transfer_workers_per_backend` options. With
+    `migrate.transfer_largest_first` set the largest objects are started
+    first, so that the long copies do not end up last.
+    """
+
     def __init__(self, init, driver,
                  input_info='info',
                  resource_name=utl.VOLUMES_TYPE,
@@ -32,10 +52,82 @@ class TaskTransfer(action.Action):
 
     def run(self, **kwargs):
         info = kwargs[self.input_info]
-        data_for_trans = info[self.resource_name]
+        data_for_trans = [item[self.resource_root_name]
+                          for item in info[self.resource_name].itervalues()]
+        if self.cfg.migrate.transfer_largest_first:
+            data_for_trans.sort(key=lambda data: data.get('size') or 0,
+                                reverse=True)
 
-        for item in data_for_trans.itervalues():
-            data = item[self.resource_root_name]
-            self.driver.transfer(data)
+        workers = max(self.cfg.migrate.transfer_workers, 1)
+        if workers > 1:
+            # drivers run remote commands with their own fabric settings
+            with utl.thread_local_fabric_env():
+                self._transfer_all(data_for_trans, workers)
+        else:
+            for data in data_for_trans:
+                self.driver.transfer(data)
 
         return {}
+
+    def _transfer_all(self, data_for_trans, workers):
+        pending = collections.deque(data_for_trans)
+        running = 0
+        usage = collections.defaultdict(int)
+        finished = Queue.Queue()
+        error = None
+
+        def can_start(data):
+            return all(limit == UNLIMITED or usage[key] < limit
+                       for key, limit in self.get_limits(data))
+
+        while pending or running:
+            if error is None:
+                for data in list(pending):
+                    if running >= workers:
+                        break
+                    # limits are not applied when nothing is running, so
+                    # zero or misconfigured limits do not stall migration
+                    if running and not can_start(data):
+                        continue
+                    pending.remove(data)
+                    running += 1
+                    for key, _ in self.get_limits(data):
+                        usage[key] += 1
+                    thread = threading.Thread(target=self._transfer,
+                                              args=(data, finished))
+                    thread.daemon = True
+                    thread.start()
+            elif not running:
+                break
+
+            data, exc = finished.get()
+            running -= 1
+            for key, _ in self.get_limits(data):
+                usage[key] -= 1
+            if exc is not None:
+                LOG.error("Failed to transfer %s '%s'", self.resource_name,
+                          data.get('id'))
+                error = error or exc
+
+        if error is not None:
+            raise error
+
+    def _transfer(self, data, finished):
+        try:
+            self.driver.transfer(data)
+        except Exception as e:
+            finished.put((data, e))
+        else:
+            finished.put((data, None))
+
+    def get_limits(self, data):
+        """Returns list of (key, limit) pairs, objects sharing a key are
+        copied no more than limit at once."""
+
+        per_host = self.cfg.migrate.transfer_workers_per_host
+        limits = [(('src', data.get(utl.HOST_SRC)), per_host),
+                  (('dst', data.get(utl.HOST_DST)), per_host)]
+        if data.get('volume_type'):
+            limits.append((('backend', data['volume_type']),
+                           self.cfg.migrate.transfer_workers_per_backend))
+        return limits
@@ -53,24 +53,22 @@ class TransportInstance(action.Action):
 
     def run(self, info=None, **kwargs):
         info = copy.deepcopy(info)
-        new_info = {
+        instances = {
             utl.INSTANCES_TYPE: {
             }
         }
 
-        # Get next one instance
         for instance_id, instance in info[utl.INSTANCES_TYPE].iteritems():
-            instance = self._replace_user_ids(instance)
+            instances[utl.INSTANCES_TYPE][instance_id] = \
+                self._replace_user_ids(instance)
 
-            one_instance = {
-                utl.INSTANCES_TYPE: {
-                    instance_id: instance
-                }
+        if not instances[utl.INSTANCES_TYPE]:
+            return {
+                'info': instances
             }
-            one_instance = self.deploy_instance(self.dst_cloud, one_instance)
 
-            new_info[utl.INSTANCES_TYPE].update(
-                one_instance[utl.INSTANCES_TYPE])
+        # all instances are booted at once and waited for together
+        new_info = self.deploy_instance(self.dst_cloud, instances)
 
         return {
             'info': new_info
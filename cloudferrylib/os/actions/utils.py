@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and#
 # limitations under the License.
 
+from cloudferrylib.utils import cmd_cfg
+from cloudferrylib.utils import compression
 from cloudferrylib.utils import utils
 from fabric.api import run, settings, env
 import copy
@@ -35,18 +37,14 @@ def transfer_file_to_file(src_cloud,
                   connection_attempts=env.connection_attempts):
         with utils.forward_agent(cfg_migrate.key_filename):
             with utils.up_ssh_tunnel(host_dst, ssh_ip_dst, ssh_ip_src) as port:
-                if cfg_migrate.file_compression == "dd":
-                    run(("ssh -oStrictHostKeyChecking=no %s 'dd bs=1M " +
-                         "if=%s' | ssh -oStrictHostKeyChecking=no " +
-                         "-p %s localhost 'dd bs=1M of=%s'") %
-                        (host_src, path_src, port, path_dst))
-                elif cfg_migrate.file_compression == "gzip":
-                    run(("ssh -oStrictHostKeyChecking=no " +
-                         "%s 'gzip -%s -c %s' " +
-                         "| ssh -oStrictHostKeyChecking=no -p %s localhost " +
-                         "'gunzip | dd bs=1M of=%s'") %
-                        (host_src, cfg_migrate.level_compression,
-                         path_src, port, path_dst))
+                codec = compression.configured_codec(cfg_migrate)
+                src_cmd = codec.pipe_compress(
+                    cmd_cfg.dd_cmd_if('1M', path_src),
+                    cfg_migrate.level_compression)
+                dst_cmd = codec.pipe_decompress(
+                    cmd_cfg.dd_cmd_of('1M', path_dst))
+                run(str(cmd_cfg.ssh_cmd(host_src, src_cmd) >>
+                        cmd_cfg.ssh_cmd_port(port, 'localhost', dst_cmd)))
 
 
 def delete_file_from_rbd(ssh_ip, file_path):
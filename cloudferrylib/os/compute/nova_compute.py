@@ -13,9 +13,13 @@
 # limitations under the License.
 
 
+import collections
 import copy
+import datetime
+from multiprocessing import pool
 import random
 import pprint
+import time
 
 from novaclient.v1_1 import client as nova_client
 from novaclient import exceptions as nova_exc
@@ -49,6 +53,7 @@ SUSPENDED = 'SUSPENDED'
 PAUSED = 'PAUSED'
 SHELVED = 'SHELVED'
 SHELVED_OFFLOADED = 'SHELVED_OFFLOADED'
+ERROR = 'ERROR'
 
 ALLOWED_VM_STATUSES = [ACTIVE, STOPPED, SHUTOFF, RESIZED, SUSPENDED,
                        PAUSED, SHELVED, SHELVED_OFFLOADED, VERIFY_RESIZE]
@@ -91,12 +96,165 @@ class RandomSchedulerVmDeployer(object):
                 LOG.debug("Failed to boot VM '%s', rescheduling on node '%s'",
                           instance['name'], node)
 
+        self._fail(instance)
+
+    def deploy_all(self, requests, timeout=60, poll_interval=2):
+        """Boots VMs for :requests, list of (instance, create_params,
+        client_conf) tuples, `[migrate] boot_workers` at once and waits for
+        all of them with one servers list request per :poll_interval seconds.
+        VMs which fail or do not become active within :timeout seconds are
+        deleted and rescheduled on random compute hosts without blocking the
+        others. Returns IDs of created VMs in the order of :requests."""
+
+        compute_hosts = self.nc.get_compute_hosts()
+        random.seed()
+        hosts = []
+        for _ in requests:
+            hosts.append(random.sample(compute_hosts, len(compute_hosts)))
+        new_ids = [None] * len(requests)
+        booting = {}
+        since = datetime.datetime.utcnow().isoformat()
+        to_boot = range(len(requests))
+        while to_boot or booting:
+            deadline = time.time() + timeout
+            for i, vm_id in zip(to_boot, self._boot(requests, to_boot)):
+                booting[vm_id] = (i, deadline)
+            to_boot = []
+            time.sleep(poll_interval)
+            statuses = self.nc.get_changed_statuses(since)
+            for vm_id, (i, deadline) in booting.items():
+                status = statuses.get(vm_id, '').upper()
+                if status == ACTIVE:
+                    new_ids[i] = vm_id
+                elif status == ERROR or time.time() > deadline:
+                    instance, create_params, _ = requests[i]
+                    if not hosts[i]:
+                        self._fail(instance)
+                    self.nc.delete_vm_by_id(vm_id)
+                    node = hosts[i].pop()
+                    create_params['availability_zone'] = ':'.join(
+                        [instance['availability_zone'], node])
+                    LOG.debug("Failed to boot VM '%s', rescheduling on node "
+                              "'%s'", instance['name'], node)
+                    to_boot.append(i)
+                else:
+                    continue
+                del booting[vm_id]
+        return new_ids
+
+    def _boot(self, requests, indexes):
+        workers = max(min(self.nc.config.migrate.boot_workers,
+                          len(indexes)), 1)
+
+        def boot(i):
+            _, create_params, client_conf = requests[i]
+            return self.nc.boot_instance(create_params, client_conf)
+
+        if workers == 1:
+            return [boot(i) for i in indexes]
+        boot_pool = pool.ThreadPool(workers)
+        try:
+            return boot_pool.map(boot, indexes)
+        finally:
+            boot_pool.close()
+            boot_pool.join()
+
+    @staticmethod
+    def _fail(instance):
         message = ("Unable to schedule VM '{vm}' on any of available compute "
                    "nodes.").format(vm=instance['name'])
         LOG.error(message)
         raise DestinationCloudNotOperational(message)
 
 
+class InstanceInfoBatch(object):
+    """Information about a set of instances needed to convert them, read in
+    bulk: tenant names and flavors are looked up once, flavor details and
+    volume attachments are read from Nova DB with a query per IN_QUERY_SIZE
+    instances, and block devices of all instances of a compute host are
+    listed with one remote command, `[migrate] instance_read_workers` hosts
+    at once."""
+
+    IN_QUERY_SIZE = 1000
+
+    def __init__(self, compute_res, instances_list):
+        self.compute = compute_res
+        self.config = compute_res.config
+        self.cloud = compute_res.cloud
+        self.get_tenant_name = compute_res.identity.get_tenants_func()
+        self.flavors = {}
+        self.flav_details = {}
+        self.volumes = collections.defaultdict(list)
+        self.block_info = {}
+        self.ext_ips = {}
+
+        for instance in instances_list:
+            flavor_id = instance.flavor['id']
+            if flavor_id not in self.flavors:
+                self.flavors[flavor_id] = compute_res.get_flavor_from_id(
+                    flavor_id, include_deleted=True)
+
+        instance_ids = [instance.id for instance in instances_list]
+        for i in xrange(0, len(instance_ids), self.IN_QUERY_SIZE):
+            self._read(instance_ids[i:i + self.IN_QUERY_SIZE])
+
+        by_host = collections.defaultdict(list)
+        for instance in instances_list:
+            by_host[instance_host(instance)].append(instance)
+        self._read_hosts(by_host.items())
+
+    def _read(self, instance_ids):
+        id_list = ",".join(" '{0}' ".format(i) for i in instance_ids)
+        connector = self.compute.mysql_connector
+        for row in connector.execute(
+                "SELECT uuid, vcpus, memory_mb, root_gb, ephemeral_gb "
+                "FROM nova.instances "
+                "WHERE uuid IN ({id_list}) "
+                "AND NOT vm_state = 'deleted';".format(id_list=id_list)):
+            self.flav_details[row['uuid']] = {
+                'vcpus': row['vcpus'],
+                'memory_mb': row['memory_mb'],
+                'root_gb': row['root_gb'],
+                'ephemeral_gb': row['ephemeral_gb']}
+        for row in connector.execute(
+                "SELECT instance_uuid, volume_id, device_name "
+                "FROM nova.block_device_mapping "
+                "WHERE instance_uuid IN ({id_list}) AND deleted = 0 "
+                "AND volume_id IS NOT NULL ORDER BY id;".format(
+                    id_list=id_list)):
+            self.volumes[row['instance_uuid']].append(
+                {'id': row['volume_id'], 'device': row['device_name']})
+
+    def _read_hosts(self, hosts):
+        workers = max(min(self.config.migrate.instance_read_workers,
+                          len(hosts)), 1)
+        if workers == 1:
+            for host in hosts:
+                self._read_host(host)
+            return
+        with utl.thread_local_fabric_env():
+            read_pool = pool.ThreadPool(workers)
+            try:
+                read_pool.map(self._read_host, hosts)
+            finally:
+                read_pool.close()
+                read_pool.join()
+
+    def _read_host(self, host_instances):
+        host, instances_list = host_instances
+        init_host = self.cloud.getIpSsh()
+        ssh_user = self.config.cloud.ssh_user
+        if self.config.migrate.direct_compute_transfer:
+            self.ext_ips[host] = utl.get_ext_ip(self.config.cloud.ext_cidr,
+                                                init_host, host, ssh_user)
+        self.block_info.update(utl.get_libvirt_block_info_batch(
+            [instance_libvirt_name(instance) for instance in instances_list],
+            init_host,
+            host,
+            ssh_user,
+            self.config.cloud.ssh_sudo_password))
+
+
 class NovaCompute(compute.Compute):
     """The main class for working with Openstack Nova Compute Service. """
 
@@ -110,7 +268,15 @@ class NovaCompute(compute.Compute):
 
     @property
     def nova_client(self):
-        return self.proxy(self.get_client(), self.config)
+        return self.proxy(self.get_cached_client(self.config), self.config)
+
+    def get_cached_client(self, params):
+        """Returns nova client shared by all users of the same credentials."""
+
+        return self.cloud.clients.get('compute',
+                                      params.cloud.tenant,
+                                      params.cloud.user,
+                                      lambda: self.get_client(params))
 
     def get_client(self, params=None):
         """Getting nova client. """
@@ -234,67 +400,59 @@ class NovaCompute(compute.Compute):
 
         info = {'instances': {}}
 
-        for instance in self.get_instances_list(search_opts=search_opts):
-            if instance.status in ALLOWED_VM_STATUSES:
-                if (self.cloud.position == 'dst' or
-                        (self.cloud.position == 'src' and
-                            self.filter_tenant_id is not None and
-                            self.filter_tenant_id == instance.tenant_id) or
-                        (self.cloud.position == 'src' and
-                            self.filter_tenant_id is None)):
-                    info['instances'][instance.id] = self.convert(instance,
-                                                                  self.config,
-                                                                  self.cloud)
+        instances_list = [
+            instance
+            for instance in self.get_instances_list(search_opts=search_opts)
+            if instance.status in ALLOWED_VM_STATUSES and
+            (self.cloud.position == 'dst' or
+             self.filter_tenant_id is None or
+             self.filter_tenant_id == instance.tenant_id)]
+        batch = InstanceInfoBatch(self, instances_list)
+        for instance in instances_list:
+            info['instances'][instance.id] = self.convert_instance(
+                instance, self.config, self.cloud, batch)
 
         return info
 
     @staticmethod
-    def convert_instance(instance, cfg, cloud):
-        identity_res = cloud.resources[utl.IDENTITY_RESOURCE]
+    def convert_instance(instance, cfg, cloud, batch=None):
+        """Converts nova server :instance to internal representation.
+
+        :param batch:   InstanceInfoBatch holding the instance.
+        """
+
         compute_res = cloud.resources[utl.COMPUTE_RESOURCE]
+        if batch is None:
+            batch = InstanceInfoBatch(compute_res, [instance])
 
         instance_name = instance_libvirt_name(instance)
         instance_node = instance_host(instance)
 
-        get_tenant_name = identity_res.get_tenants_func()
-
         security_groups = []
         for security_group in getattr(instance, 'security_groups', []):
             security_groups.append(security_group['name'])
 
         interfaces = compute_res.get_networks(instance)
 
-        volumes = [{'id': v.id,
+        volumes = [{'id': v['id'],
                     'num_device': i,
-                    'device': v.device} for i, v in enumerate(
-                        compute_res.nova_client.volumes.get_server_volumes(
-                            instance.id))]
+                    'device': v['device']}
+                   for i, v in enumerate(batch.volumes[instance.id])]
 
-        is_ephemeral = compute_res.get_flavor_from_id(
-            instance.flavor['id'], include_deleted=True).ephemeral > 0
+        flavor = batch.flavors[instance.flavor['id']]
+        is_ephemeral = flavor.ephemeral > 0
 
         is_ceph = cfg.compute.backend.lower() == utl.CEPH
         direct_transfer = cfg.migrate.direct_compute_transfer
 
-        ssh_user = cfg.cloud.ssh_user
-
         if direct_transfer:
-            ext_cidr = cfg.cloud.ext_cidr
-            host = utl.get_ext_ip(ext_cidr,
-                                  cloud.getIpSsh(),
-                                  instance_node,
-                                  ssh_user)
+            host = batch.ext_ips[instance_node]
         elif is_ceph:
             host = cfg.compute.host_eph_drv
         else:
             host = instance_node
 
-        instance_block_info = utl.get_libvirt_block_info(
-            instance_name,
-            cloud.getIpSsh(),
-            instance_node,
-            ssh_user,
-            cfg.cloud.ssh_sudo_password)
+        instance_block_info = batch.block_info[instance_name]
 
         ephemeral_path = {
             'path_src': None,
@@ -322,17 +480,14 @@ class NovaCompute(compute.Compute):
                 instance,
                 instance_block_info,
                 is_ceph_ephemeral=is_ceph)
-        flav_details = instances.get_flav_details(compute_res.mysql_connector,
-                                                  instance.id)
-        flav_name = compute_res.get_flavor_from_id(instance.flavor['id'],
-                                                   include_deleted=True).name
-        flav_details.update({'name': flav_name})
+        flav_details = dict(batch.flav_details.get(instance.id, {}),
+                            name=flavor.name)
 
         inst = {'instance': {'name': instance.name,
                              'instance_name': instance_name,
                              'id': instance.id,
                              'tenant_id': instance.tenant_id,
-                             'tenant_name': get_tenant_name(
+                             'tenant_name': batch.get_tenant_name(
                                  instance.tenant_id),
                              'status': instance.status,
                              'flavor_id': instance.flavor['id'],
@@ -350,7 +505,7 @@ class NovaCompute(compute.Compute):
                              'boot_volume': copy.deepcopy(
                                  volumes[0]) if volumes else None,
                              'interfaces': interfaces,
-                             'host': instance_host,
+                             'host': instance_node,
                              'is_ephemeral': is_ephemeral,
                              'volumes': volumes,
                              'user_id': instance.user_id
@@ -566,16 +721,29 @@ class NovaCompute(compute.Compute):
         with keystone.AddAdminUserToNonAdminTenant(
                 self.identity.keystone_client,
                 conf.cloud.user,
-                conf.cloud.tenant):
-            nclient = self.get_client(conf)
+                conf.cloud.tenant,
+                client_registry=self.cloud.clients,
+                keystone_factory=lambda: self.identity.keystone_client):
+            nclient = self.get_cached_client(conf)
             new_id = self.create_instance(nclient, **create_params)
             self.wait_for_status(new_id, self.get_status, 'active')
         return new_id
 
-    def _deploy_instances(self, info_compute):
-        new_ids = {}
+    def boot_instance(self, create_params, conf):
+        """Creates VM in the tenant of :conf, does not wait for it to
+        boot."""
 
-        client_conf = copy.deepcopy(self.config)
+        with keystone.AddAdminUserToNonAdminTenant(
+                self.identity.keystone_client,
+                conf.cloud.user,
+                conf.cloud.tenant,
+                client_registry=self.cloud.clients,
+                keystone_factory=lambda: self.identity.keystone_client):
+            nclient = self.get_cached_client(conf)
+            return self.create_instance(nclient, **create_params)
+
+    def _deploy_instances(self, info_compute):
+        requests = []
 
         for _instance in info_compute['instances'].itervalues():
             instance = _instance['instance']
@@ -598,14 +766,13 @@ class NovaCompute(compute.Compute):
                 }]
                 create_params['image'] = None
 
+            client_conf = copy.deepcopy(self.config)
             client_conf.cloud.tenant = instance['tenant_name']
+            requests.append((instance, create_params, client_conf))
 
-            new_id = RandomSchedulerVmDeployer(self).deploy(instance,
-                                                            create_params,
-                                                            client_conf)
-
-            new_ids[new_id] = instance['id']
-        return new_ids
+        new_ids = RandomSchedulerVmDeployer(self).deploy_all(requests)
+        return {new_id: instance['id']
+                for new_id, (instance, _, _) in zip(new_ids, requests)}
 
     def create_instance(self, nclient, **kwargs):
         # do not provide key pair as boot argument, it will be updated with the
@@ -818,6 +985,28 @@ class NovaCompute(compute.Compute):
     def get_status(self, res_id):
         return self.nova_client.servers.get(res_id).status
 
+    def get_statuses(self, res_ids):
+        """Gets statuses of many VMs with one servers list request."""
+
+        if len(res_ids) < 2:
+            return super(NovaCompute, self).get_statuses(res_ids)
+        statuses = {server.id: server.status
+                    for server in self.nova_client.servers.list(
+                        detailed=True, search_opts={'all_tenants': True})}
+        return {res_id: (statuses[res_id] if res_id in statuses
+                         else self.get_status(res_id))
+                for res_id in res_ids}
+
+    def get_changed_statuses(self, changes_since):
+        """Returns dict of statuses of all VMs changed since :changes_since
+        timestamp by VM ID."""
+
+        return {server.id: server.status
+                for server in self.nova_client.servers.list(
+                    detailed=True,
+                    search_opts={'all_tenants': True,
+                                 'changes-since': changes_since})}
+
     def get_networks(self, instance):
         networks = []
         func_mac_address = self.get_func_mac_address(instance)
@@ -15,6 +15,9 @@
 
 import pika
 import ast
+import collections
+import re
+import threading
 
 import keystoneclient
 from keystoneclient import exceptions as ks_exceptions
@@ -22,7 +25,7 @@ from keystoneclient.v2_0 import client as keystone_client
 
 import cfglib
 from cloudferrylib.base import identity
-from cloudferrylib.utils.cache import Cached
+from cloudferrylib.utils import cache
 from cloudferrylib.utils.utils import GeneratorPassword
 from cloudferrylib.utils.utils import Postman
 from cloudferrylib.utils.utils import Templater
@@ -40,21 +43,33 @@ class AddAdminUserToNonAdminTenant(object):
     happens. Otherwise admin user is added to a tenant on block entrance, and
     removed on exit.
 
-    When this class is in use, make sure *all* your openstack clients generate
-    new auth token on *each* openstack API call, because when user gets added
-    to a tenant as a member, all it's tokens get revoked.
+    Blocks entered for the same tenant and user at once (e.g. by parallel
+    instance workers) share the role assignment: role is added by the first
+    block entered and removed by the last one left.
+
+    When user gets added to a tenant as a member, all it's tokens get
+    revoked, so all cached clients of admin user are dropped from
+    :arg client_registry: on each role change, and keystone client is taken
+    from :arg keystone_factory: again if it is given.
 
     Usage:
      with AddAdminUserToNonAdminTenant():
         your_operation_from_admin_user()
     """
 
-    def __init__(self, keystone, admin_user, tenant, member_role='admin'):
+    _lock = threading.Lock()
+    # number of blocks using role assignment, by (tenant, user, role) IDs
+    _assignments = collections.defaultdict(int)
+
+    def __init__(self, keystone, admin_user, tenant, member_role='admin',
+                 client_registry=None, keystone_factory=None):
         """
         :tenant: can be either tenant name or tenant ID
         """
 
         self.keystone = keystone
+        self.client_registry = client_registry
+        self.keystone_factory = keystone_factory
         try:
             self.tenant = self.keystone.tenants.find(name=tenant)
         except keystoneclient.exceptions.NotFound:
@@ -63,33 +78,61 @@ class AddAdminUserToNonAdminTenant(object):
         self.role = self.keystone.roles.find(name=member_role)
         self.already_member = False
 
-    def __enter__(self):
-        roles = self.keystone.roles.roles_for_user(user=self.user,
-                                                   tenant=self.tenant)
+    @property
+    def _key(self):
+        return self.tenant.id, self.user.id, self.role.id
 
-        for role in roles:
-            if role.name == self.role.name:
-                # do nothing if user is already member of a tenant
-                self.already_member = True
+    def __enter__(self):
+        with self._lock:
+            if self._assignments.get(self._key):
+                self._assignments[self._key] += 1
                 return
-        LOG.debug("Adding %s user to tenant %s as %s",
-                  self.user.name, self.tenant.name, self.role.name)
-        self.keystone.roles.add_user_role(user=self.user,
-                                          role=self.role,
-                                          tenant=self.tenant)
+
+            roles = self.keystone.roles.roles_for_user(user=self.user,
+                                                       tenant=self.tenant)
+
+            for role in roles:
+                if role.name == self.role.name:
+                    # do nothing if user is already member of a tenant
+                    self.already_member = True
+                    return
+            LOG.debug("Adding %s user to tenant %s as %s",
+                      self.user.name, self.tenant.name, self.role.name)
+            self.keystone.roles.add_user_role(user=self.user,
+                                              role=self.role,
+                                              tenant=self.tenant)
+            self._assignments[self._key] = 1
+            self._invalidate_clients()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if not self.already_member:
+        if self.already_member:
+            return
+        with self._lock:
+            self._assignments[self._key] -= 1
+            if self._assignments[self._key] > 0:
+                return
+            del self._assignments[self._key]
             LOG.debug("Removing %s user from tenant %s",
                       self.user.name, self.tenant.name)
             self.keystone.roles.remove_user_role(user=self.user,
                                                  role=self.role,
                                                  tenant=self.tenant)
+            self._invalidate_clients()
+
+    def _invalidate_clients(self):
+        if self.client_registry is not None:
+            self.client_registry.invalidate(user=self.user.name)
+        if self.keystone_factory is not None:
+            self.keystone = self.keystone_factory()
 
 
-@Cached(getter='get_tenants_list', modifier='create_tenant')
 class KeystoneIdentity(identity.Identity):
-    """The main class for working with OpenStack Keystone Identity Service."""
+    """The main class for working with OpenStack Keystone Identity Service.
+
+    Tenants, users and roles are listed once and kept in identity maps for
+    `[migrate] identity_cache_ttl` seconds, so that lookups by id or name
+    don't call Keystone API.
+    """
 
     def __init__(self, config, cloud):
         super(KeystoneIdentity, self).__init__()
@@ -105,10 +148,39 @@ class KeystoneIdentity(identity.Identity):
         self.mysql_connector = cloud.mysql_connector('keystone')
         self.templater = Templater()
         self.generator = GeneratorPassword()
+        ttl = self.config.migrate.identity_cache_ttl
+        self.tenants = self._identity_map('tenants', ttl)
+        self.users = self._identity_map('users', ttl)
+        self.roles = self._identity_map('roles', ttl)
+        self._tenants_list = None
+
+    def _identity_map(self, manager, ttl):
+        """IdentityMap of Keystone objects of :manager, which reads object
+        missing in it with single API request."""
+
+        def fetch(**kwargs):
+            # raw client, so that missing object is not retried
+            ks_manager = getattr(self.keystone_client.client, manager)
+            try:
+                if 'id' in kwargs:
+                    return ks_manager.get(kwargs['id'])
+                return ks_manager.find(**kwargs)
+            except (ks_exceptions.NotFound, ks_exceptions.NoUniqueMatch):
+                return None
+
+        return cache.IdentityMap(
+            lambda: getattr(self.keystone_client, manager).list(), ttl,
+            fetch=lambda obj_id: fetch(id=obj_id),
+            fetch_by_name=lambda name: fetch(name=name))
 
     @property
     def keystone_client(self):
-        return self.proxy(self.get_client(), self.config)
+        return self.proxy(
+            self.cloud.clients.get('identity',
+                                   self.config.cloud.tenant,
+                                   self.config.cloud.user,
+                                   self.get_client),
+            self.config)
 
     @staticmethod
     def convert(identity_obj, cfg):
@@ -145,10 +217,8 @@ class KeystoneIdentity(identity.Identity):
         return None
 
     def has_tenants_by_id_cached(self):
-        tenants = set([t.id for t in self.keystone_client.tenants.list()])
-
         def func(tenant_id):
-            return tenant_id in tenants
+            return self.tenants.get(tenant_id) is not None
 
         return func
 
@@ -209,17 +279,17 @@ class KeystoneIdentity(identity.Identity):
         LOG.info("Done")
 
     def get_client(self):
-        """ Getting keystone client using authentication with admin auth token.
+        """ Getting keystone client authenticated with admin credentials.
+
+        Client always talks to `config.cloud.auth_url` and renews the token
+        by itself when it is about to expire.
 
         :return: OpenStack Keystone Client instance
         """
 
-        auth_ref = self._get_client_by_creds().auth_ref
-
-        return keystone_client.Client(auth_ref=auth_ref,
-                                      endpoint=self.config.cloud.auth_url,
-                                      cacert=self.config.cloud.cacert,
-                                      insecure=self.config.cloud.insecure)
+        client = self._get_client_by_creds()
+        client.management_url = self.config.cloud.auth_url.rstrip('/')
+        return client
 
     def _get_client_by_creds(self):
         """Authenticating with a user name and password.
@@ -269,55 +339,80 @@ class KeystoneIdentity(identity.Identity):
 
         return func
 
+    @staticmethod
+    def _find(identity_map, **kwargs):
+        """Returns object from :identity_map, which asks Keystone API if it's
+        missing, raises NotFound if there is no such object."""
+
+        if 'id' in kwargs:
+            obj = identity_map.get(kwargs['id'])
+        else:
+            obj = identity_map.find(kwargs['name'])
+        if obj is None:
+            raise ks_exceptions.NotFound(
+                "No object matching %s" % kwargs)
+        return obj
+
     def get_tenant_id_by_name(self, name):
         """ Getting tenant ID by name from keystone. """
 
-        return self.keystone_client.tenants.find(name=name).id
+        return self._find(self.tenants, name=name).id
 
     def get_tenant_by_name(self, tenant_name):
         """ Getting tenant by name from keystone. """
 
-        for tenant in self.get_tenants_list():
-            if tenant.name == tenant_name:
-                return tenant
+        if self._tenant_filtering_enabled():
+            for tenant in self.get_tenants_list():
+                if tenant.name == tenant_name:
+                    return tenant
+            return None
+        return self.tenants.find(tenant_name)
 
     def try_get_tenant_by_id(self, tenant_id, default=None):
         """Returns `keystoneclient.tenants.Tenant` object based on tenant ID
         provided. If not found - returns :arg default: tenant. If
         :arg default: is not specified - returns `config.cloud.tenant`"""
 
-        tenants = self.keystone_client.tenants
-        try:
-            return tenants.get(tenant_id)
-        except ks_exceptions.NotFound:
-            if default is None:
-                return tenants.find(name=self.config.cloud.tenant)
-            else:
-                return tenants.find(id=default)
+        tenant = self.tenants.get(tenant_id)
+        if tenant is not None:
+            return tenant
+        if default is None:
+            return self._find(self.tenants, name=self.config.cloud.tenant)
+        else:
+            return self._find(self.tenants, id=default)
 
     def try_get_tenant_name_by_id(self, tenant_id, default=None):
         """ Same as `get_tenant_by_id` but returns `default` in case tenant
         ID is not present """
-        try:
-            return self.keystone_client.tenants.get(tenant_id).name
-        except keystoneclient.exceptions.NotFound:
+        tenant = self.tenants.get(tenant_id)
+        if tenant is None:
             LOG.warning("Tenant '%s' not found, returning default value = "
                         "'%s'", tenant_id, default)
             return default
+        return tenant.name
 
     def get_services_list(self):
         """ Getting list of available services from keystone. """
 
         return self.keystone_client.services.list()
 
+    def _tenant_filtering_enabled(self):
+        return self.filter_tenant_id and self.cloud.position == 'src'
+
     def get_tenants_list(self):
         """ Getting list of tenants from keystone. """
+
+        self.tenants.list()
+        key = (self.tenants.generation, self.filter_tenant_id)
+        if self._tenants_list is None or self._tenants_list[0] != key:
+            self._tenants_list = (key, self._read_tenants_list())
+        return list(self._tenants_list[1])
+
+    def _read_tenants_list(self):
         result = []
-        ks_tenants = self.keystone_client.tenants
-        filtering_enabled = (self.filter_tenant_id and
-                             self.cloud.position == 'src')
-        if filtering_enabled:
-            result.append(ks_tenants.find(id=self.filter_tenant_id))
+        if self._tenant_filtering_enabled():
+            result.append(self._find(self.tenants,
+                                     id=self.filter_tenant_id))
 
             resources_with_public_objects = [
                 self.cloud.resources[utl.IMAGE_RESOURCE],
@@ -335,7 +430,7 @@ class KeystoneIdentity(identity.Identity):
                 if tenant.id not in result:
                     result.append(tenant)
         else:
-            result = ks_tenants.list()
+            result = self.tenants.list()
         LOG.info("List of tenants: %s", ", ".join([t.name for t in result]))
         return result
 
@@ -343,41 +438,40 @@ class KeystoneIdentity(identity.Identity):
         """ Getting list of users from keystone. """
 
         if self.filter_tenant_id:
-            tenant_id = self.filter_tenant_id
-        else:
-            tenant_id = None
-        return self.keystone_client.users.list(tenant_id=tenant_id)
+            return self.keystone_client.users.list(
+                tenant_id=self.filter_tenant_id)
+        return self.users.list()
 
     def get_roles_list(self):
         """ Getting list of available roles from keystone. """
 
-        return self.keystone_client.roles.list()
+        return self.roles.list()
 
     def try_get_username_by_id(self, user_id, default=None):
-        try:
-            return self.keystone_client.users.get(user_id).name
-        except keystoneclient.exceptions.NotFound:
+        user = self.users.get(user_id)
+        if user is None:
             return default
+        return user.name
 
     def try_get_user_by_id(self, user_id, default=None):
+        user = self.users.get(user_id)
+        if user is not None:
+            return user
         if default is None:
             admin_usr = \
                 self.try_get_user_by_name(username=self.config.cloud.user)
             default = admin_usr.id
-        try:
-            return self.keystone_client.users.find(id=user_id)
-        except keystoneclient.exceptions.NotFound:
-            LOG.warning("User '%s' has not been found, returning default "
-                        "value = '%s'", user_id, default)
-            return self.keystone_client.users.find(id=default)
+        LOG.warning("User '%s' has not been found, returning default "
+                    "value = '%s'", user_id, default)
+        return self._find(self.users, id=default)
 
     def try_get_user_by_name(self, username, default=None):
-        try:
-            return self.keystone_client.users.find(name=username)
-        except keystoneclient.exceptions.NotFound:
-            LOG.warning("User '%s' has not been found, returning default "
-                        "value = '%s'", username, default)
-            return self.keystone_client.users.find(name=default)
+        user = self.users.find(username)
+        if user is not None:
+            return user
+        LOG.warning("User '%s' has not been found, returning default "
+                    "value = '%s'", username, default)
+        return self._find(self.users, name=default)
 
     def roles_for_user(self, user_id, tenant_id):
         """ Getting list of user roles for tenant """
@@ -387,39 +481,50 @@ class KeystoneIdentity(identity.Identity):
     def create_role(self, role_name):
         """ Create new role in keystone. """
 
-        return self.keystone_client.roles.create(role_name)
+        role = self.keystone_client.roles.create(role_name)
+        self.roles.add(role)
+        return role
 
     def delete_tenant(self, tenant):
-        return self.keystone_client.tenants.delete(tenant)
+        result = self.keystone_client.tenants.delete(tenant)
+        self.tenants.remove(getattr(tenant, 'id', tenant))
+        return result
 
     def create_tenant(self, tenant_name, description=None, enabled=True):
         """ Create new tenant in keystone. """
 
         try:
-            return self.keystone_client.tenants.create(tenant_name=tenant_name,
-                                                       description=description,
-                                                       enabled=enabled)
+            tenant = self.keystone_client.tenants.create(
+                tenant_name=tenant_name,
+                description=description,
+                enabled=enabled)
         except ks_exceptions.Conflict:
-            return self.keystone_client.tenants.find(name=tenant_name)
+            tenant = self.keystone_client.tenants.find(name=tenant_name)
+        self.tenants.add(tenant)
+        return tenant
 
     def create_user(self, name, password=None, email=None, tenant_id=None,
                     enabled=True):
         """ Create new user in keystone. """
 
-        return self.keystone_client.users.create(name=name,
+        user = self.keystone_client.users.create(name=name,
                                                  password=password,
                                                  email=email,
                                                  tenant_id=tenant_id,
                                                  enabled=enabled)
+        self.users.add(user)
+        return user
 
     def update_tenant(self, tenant_id, tenant_name=None, description=None,
                       enabled=None):
         """Update a tenant with a new name and description."""
 
-        return self.keystone_client.tenants.update(tenant_id,
-                                                   tenant_name=tenant_name,
-                                                   description=description,
-                                                   enabled=enabled)
+        tenant = self.keystone_client.tenants.update(tenant_id,
+                                                     tenant_name=tenant_name,
+                                                     description=description,
+                                                     enabled=enabled)
+        self.tenants.invalidate()
+        return tenant
 
     def update_user(self, user, **kwargs):
         """Update user data.
@@ -427,10 +532,15 @@ class KeystoneIdentity(identity.Identity):
         Supported arguments include ``name``, ``email``, and ``enabled``.
         """
 
-        return self.keystone_client.users.update(user, **kwargs)
+        updated = self.keystone_client.users.update(user, **kwargs)
+        if 'name' in kwargs:
+            self.users.invalidate()
+        return updated
 
     def get_auth_token_from_user(self):
-        self.keystone_client.authenticate()
+        """Returns admin token, the token is renewed by keystone client when
+        it is about to expire."""
+
         return self.keystone_client.auth_token
 
     def _deploy_tenants(self, tenants):
@@ -535,14 +645,44 @@ class KeystoneIdentity(identity.Identity):
         LOG.info("Role deployment done.")
 
     def _get_user_passwords(self):
+        users = {user.id: user.name for user in self.get_users_list()}
         info = {}
-        for user in self.get_users_list():
-            for password in self.mysql_connector.execute(
-                    "SELECT password FROM user WHERE id = :user_id",
-                    user_id=user.id):
-                info[user.name] = password[0]
+        for user_id, password in self.mysql_connector.execute(
+                "SELECT id, password FROM user"):
+            if user_id in users:
+                info[users[user_id]] = password
         return info
 
+    def _get_role_assignments_by_v3(self):
+        """Returns {user_id: {tenant_id: [role_id]}} of all users read with
+        single Keystone v3 `role_assignments` request, None if v3 API is not
+        available."""
+
+        url = re.sub(r'/v2\.0$', '', self.config.cloud.auth_url.rstrip('/'))
+        # raw client, so that missing v3 API is not retried
+        client = self.keystone_client.client
+        try:
+            _, body = client.request(url + '/v3/role_assignments', 'GET',
+                                     authenticated=True)
+            assignments = body['role_assignments']
+        except (ks_exceptions.ClientException, KeyError, TypeError,
+                ValueError) as e:
+            LOG.info("Keystone v3 role assignments are not available, "
+                     "roles are read for every user and tenant: %s", e)
+            return None
+
+        all_roles = collections.defaultdict(
+            lambda: collections.defaultdict(list))
+        for assignment in assignments:
+            user = assignment.get('user')
+            project = assignment.get('scope', {}).get('project')
+            if user is None or project is None:
+                # group and domain assignments are not migrated
+                continue
+            all_roles[user['id']][project['id']].append(
+                assignment['role']['id'])
+        return all_roles
+
     def _get_user_tenants_roles(self, tenant_list=None, user_list=None):
         if tenant_list is None:
             tenant_list = []
@@ -585,6 +725,12 @@ class KeystoneIdentity(identity.Identity):
 
     def _get_user_roles_cached(self):
         all_roles = {}
+        assignments = None
+        if not self.config.migrate.optimize_user_role_fetch:
+            assignments = self._get_role_assignments_by_v3()
+        if assignments is not None:
+            return lambda user_id, tenant_id: (
+                assignments.get(user_id, {}).get(tenant_id, []))
         if self.config.migrate.optimize_user_role_fetch:
             res = self._get_roles_sql_request()
             for user_id, tenant_id, roles_field in res:
@@ -625,6 +771,22 @@ class KeystoneIdentity(identity.Identity):
     def _get_user_tenants_roles_by_api(self, tenant_list, user_list):
         user_tenants_roles = {u.name: {t.name: [] for t in tenant_list}
                               for u in user_list}
+        assignments = self._get_role_assignments_by_v3()
+        if assignments is not None:
+            tenant_ids = {tenant.id: tenant.name for tenant in tenant_list}
+            user_ids = {user.id: user.name for user in user_list}
+            roles = {r.id: r for r in self.get_roles_list()}
+            for user_id, tenants_roles in assignments.iteritems():
+                for tenant_id, roles_ids in tenants_roles.iteritems():
+                    # skip filtered tenants and users
+                    if user_id not in user_ids or tenant_id not in tenant_ids:
+                        continue
+                    user_tenants_roles[user_ids[user_id]][
+                        tenant_ids[tenant_id]] = [
+                            {'role': {'name': roles[r].name, 'id': r}}
+                            for r in roles_ids if r in roles]
+            return user_tenants_roles
+
         for user in user_list:
             user_tenants_roles[user.name] = {}
             for tenant in tenant_list:
@@ -77,15 +77,15 @@ def image_id_filter(filtered_images):
 def member_filter(glance_client, filtered_tenant_id):
     """Filters images which are shared between multiple tenants using image
     membership feature (see `glance help member-list`)"""
-    members_present = len(glance_client.image_members.list(
-        member=filtered_tenant_id)) > 0
+    shared_image_ids = set(
+        member.image_id for member in glance_client.image_members.list(
+            member=filtered_tenant_id))
     return lambda i: (
         i.is_public or
         _tenant_filtering_disabled(filtered_tenant_id) or
-        not members_present or
+        not shared_image_ids or
         _tenant_filtering_enabled(filtered_tenant_id) and
-        i.owner in glance_client.image_members.list(image=i,
-                                                    member=filtered_tenant_id))
+        i.id in shared_image_ids)
 
 
 def datetime_filter(filtered_tenant_id, date):
@@ -13,10 +13,13 @@
 # limitations under the License.
 
 
+import collections
 import copy
 import json
 import re
+import threading
 from itertools import ifilter
+from multiprocessing import pool
 
 from fabric.api import run
 from fabric.api import settings
@@ -39,6 +42,158 @@ from cloudferrylib.utils import remote_runner
 LOG = utl.get_log(__name__)
 
 
+class ImageCatalog(object):
+    """Images of the cloud indexed by id, name, checksum and (checksum,
+    name), so that lookups don't list all Glance images every time.
+
+    Images are listed with :list_images on the first lookup. Images created
+    or deleted through GlanceImage are added to or removed from the catalog,
+    `invalidate` drops it, so that the next lookup lists images again.
+    `reload_for` lists images again at most once per missing key until the
+    catalog is invalidated.
+    """
+
+    def __init__(self, list_images):
+        self.list_images = list_images
+        self.lock = threading.RLock()
+        self.by_id = None
+        self.by_name = None
+        self.by_checksum = None
+        self.by_checksum_name = None
+        self.misses = set()
+
+    def _load(self):
+        if self.by_id is not None:
+            return
+        self.by_id = collections.OrderedDict()
+        self.by_name = collections.defaultdict(list)
+        self.by_checksum = collections.defaultdict(list)
+        self.by_checksum_name = collections.defaultdict(list)
+        for glance_image in self.list_images():
+            self._index(glance_image)
+
+    def _index(self, glance_image):
+        self._unindex(glance_image.id)
+        self.by_id[glance_image.id] = glance_image
+        self.by_name[glance_image.name].append(glance_image)
+        self.by_checksum[glance_image.checksum].append(glance_image)
+        self.by_checksum_name[
+            (glance_image.checksum, glance_image.name)].append(glance_image)
+
+    def _unindex(self, image_id):
+        glance_image = self.by_id.pop(image_id, None)
+        if glance_image is None:
+            return
+        for index, key in (
+                (self.by_name, glance_image.name),
+                (self.by_checksum, glance_image.checksum),
+                (self.by_checksum_name,
+                 (glance_image.checksum, glance_image.name))):
+            index[key].remove(glance_image)
+            if not index[key]:
+                del index[key]
+
+    def invalidate(self):
+        with self.lock:
+            self.by_id = None
+            self.misses.clear()
+
+    def reload_for(self, key):
+        """Drops the catalog because :key was not found in it, returns False
+        if the catalog was already reloaded for :key."""
+
+        with self.lock:
+            if key in self.misses:
+                return False
+            self.misses.add(key)
+            self.by_id = None
+            return True
+
+    def add(self, glance_image):
+        with self.lock:
+            if self.by_id is not None:
+                self._index(glance_image)
+
+    def remove(self, image_id):
+        with self.lock:
+            if self.by_id is not None:
+                self._unindex(image_id)
+
+    def list(self):
+        with self.lock:
+            self._load()
+            return self.by_id.values()
+
+    def get_by_id(self, image_id):
+        with self.lock:
+            self._load()
+            return self.by_id.get(image_id)
+
+    def get_by_name(self, name):
+        """Returns the first image with :name in Glance listing order."""
+
+        with self.lock:
+            self._load()
+            return next(iter(self.by_name.get(name, [])), None)
+
+    def get_by_checksum(self, checksum):
+        with self.lock:
+            self._load()
+            return list(self.by_checksum.get(checksum, []))
+
+    def get_by_checksum_and_name(self, checksum, name):
+        with self.lock:
+            self._load()
+            return next(iter(self.by_checksum_name.get((checksum, name), [])),
+                        None)
+
+
+class ImageInfoBatch(object):
+    """Locations and members of a set of images read from Glance DB with a
+    query per IN_QUERY_SIZE images, plus names of the tenants and users they
+    refer to, each looked up once."""
+
+    IN_QUERY_SIZE = 1000
+
+    def __init__(self, glance, image_ids):
+        self.glance = glance
+        self.locations = collections.defaultdict(list)
+        self.members = collections.defaultdict(dict)
+        self.tenant_names = {}
+        self.users = {}
+        image_ids = list(image_ids)
+        for i in xrange(0, len(image_ids), self.IN_QUERY_SIZE):
+            self._read(image_ids[i:i + self.IN_QUERY_SIZE])
+
+    def _read(self, image_ids):
+        id_list = ",".join(" '{0}' ".format(i) for i in image_ids)
+        connector = self.glance.mysql_connector
+        for image_id, value in connector.execute(
+                "SELECT image_id, value FROM image_locations "
+                "WHERE image_id IN ({id_list}) AND deleted=\"0\";".format(
+                    id_list=id_list)):
+            self.locations[image_id].append(value)
+        for image_id, member, can_share in connector.execute(
+                "SELECT image_id, member, can_share FROM image_members "
+                "WHERE image_id IN ({id_list}) AND deleted=\"0\";".format(
+                    id_list=id_list)):
+            self.members[image_id][member] = bool(can_share)
+
+    def tenant_name(self, tenant_id, default):
+        if tenant_id not in self.tenant_names:
+            self.tenant_names[tenant_id] = (
+                self.glance.identity_client.try_get_tenant_name_by_id(
+                    tenant_id, default=default))
+        return self.tenant_names[tenant_id]
+
+    def user(self, user_id):
+        if user_id not in self.users:
+            self.users[user_id] = (
+                self.glance.identity_client.try_get_user_by_id(
+                    user_id=user_id))
+        return self.users[user_id]
+
+
 class GlanceImage(image.Image):
 
     """
@@ -58,6 +213,7 @@ class GlanceImage(image.Image):
         self.runner = remote_runner.RemoteRunner(self.host,
                                                  self.config.cloud.ssh_user)
         self._image_filter = None
+        self.catalog = ImageCatalog(self.get_image_list)
         super(GlanceImage, self).__init__(config)
 
     def get_image_filter(self):
@@ -73,7 +229,14 @@ class GlanceImage(image.Image):
 
     @property
     def glance_client(self):
-        return self.proxy(self.get_client(), self.config)
+        return self.proxy(
+            self.cloud.clients.get(
+                'image',
+                self.config.cloud.tenant,
+                self.config.cloud.user,
+                self.get_client,
+                token=self.identity_client.get_auth_token_from_user()),
+            self.config)
 
     def get_client(self):
         """ Getting glance client """
@@ -119,37 +282,72 @@ class GlanceImage(image.Image):
         return images
 
     def create_image(self, **kwargs):
-        return self.glance_client.images.create(**kwargs)
+        created_image = self.glance_client.images.create(**kwargs)
+        self.catalog.add(created_image)
+        return created_image
 
     def delete_image(self, image_id):
         self.glance_client.images.delete(image_id)
+        self.catalog.remove(image_id)
+
+    def _lookup(self, find, key):
+        """Looks image up in the catalog, the catalog is reloaded once for
+        missing :key, since image might be created bypassing GlanceImage
+        (e.g. instance snapshot)."""
+
+        result = find()
+        if not result and self.catalog.reload_for(key):
+            result = find()
+        return result
+
+    def _refresh(self, glance_image):
+        if glance_image.status == 'deleted':
+            self.catalog.remove(glance_image.id)
+        else:
+            self.catalog.add(glance_image)
+        return glance_image
+
+    def _get_from_glance(self, image_id):
+        """Reads single image missing in the catalog from Glance and adds it
+        to the catalog. Returns None if there is no such image or it is
+        filtered out."""
+
+        try:
+            # raw client, so that missing image is not retried
+            glance_image = self.glance_client.client.images.get(image_id)
+        except glance_exceptions.HTTPNotFound:
+            return None
+        if glance_image.status == 'deleted':
+            return None
+        if self.cloud.position == 'src':
+            for f in self.get_image_filter().get_filters():
+                if not f(glance_image):
+                    return None
+        return self._refresh(glance_image)
 
     def get_image_by_id(self, image_id):
-        for glance_image in self.get_image_list():
-            if glance_image.id == image_id:
-                return glance_image
+        return (self.catalog.get_by_id(image_id) or
+                self._get_from_glance(image_id))
 
     def get_image_by_name(self, image_name):
-        for glance_image in self.get_image_list():
-            if glance_image.name == image_name:
-                return glance_image
+        return self._lookup(lambda: self.catalog.get_by_name(image_name),
+                            ('name', image_name))
 
     def get_img_id_list_by_checksum(self, checksum):
-        l = []
-        for glance_image in self.get_image_list():
-            if glance_image.checksum == checksum:
-                l.append(glance_image.id)
-        return l
+        return [glance_image.id for glance_image in self._lookup(
+            lambda: self.catalog.get_by_checksum(checksum),
+            ('checksum', checksum))]
 
     def get_image(self, im):
         """ Get image by id or name. """
 
-        for glance_image in self.get_image_list():
-            if im in (glance_image.name, glance_image.id):
-                return glance_image
+        return (self.catalog.get_by_id(im) or
+                self.catalog.get_by_name(im) or
+                self._get_from_glance(im) or
+                self.get_image_by_name(im))
 
     def get_image_status(self, image_id):
-        return self.get_image_by_id(image_id).status
+        return self._refresh(self.glance_client.images.get(image_id)).status
 
     def get_ref_image(self, image_id):
         try:
@@ -158,17 +356,20 @@ class GlanceImage(image.Image):
             raise exception.ImageDownloadError
 
     def get_image_checksum(self, image_id):
-        return self.get_image_by_id(image_id).checksum
+        return self._refresh(
+            self.glance_client.images.get(image_id)).checksum
 
-    def convert(self, glance_image, cloud):
+    def convert(self, glance_image, cloud, batch=None):
         """Convert OpenStack Glance image object to CloudFerry object.
 
         :param glance_image:    Direct OS Glance image object to convert,
         :param cloud:           Cloud object.
+        :param batch:           ImageInfoBatch holding the image.
         """
 
+        if batch is None:
+            batch = ImageInfoBatch(self, [glance_image.id])
         resource = cloud.resources[utl.IMAGE_RESOURCE]
-        keystone = cloud.resources["identity"]
         gl_image = {
             k: w for k, w in glance_image.to_dict().items(
             ) if k in CREATE_PARAMS}
@@ -178,17 +379,18 @@ class GlanceImage(image.Image):
         # at this point we write name of owner of this tenant
         # to map it to different tenant id on destination
         gl_image.update(
-            {'owner_name': keystone.try_get_tenant_name_by_id(
-                glance_image.owner, default=cloud.cloud_config.cloud.tenant)})
+            {'owner_name': batch.tenant_name(
+                glance_image.owner, cloud.cloud_config.cloud.tenant)})
         gl_image.update({
-            "members": self.get_members({gl_image['id']: {'image': gl_image}})
+            "members": self.get_members({gl_image['id']: {'image': gl_image}},
+                                        batch)
         })
 
         if resource.is_snapshot(glance_image):
             # for snapshots we need to write snapshot username to namespace
             # to map it later to new user id
             user_id = gl_image["properties"].get("user_id")
-            usr = keystone.try_get_user_by_id(user_id=user_id)
+            usr = batch.user(user_id)
             gl_image["properties"]["user_name"] = usr.name
         return gl_image
 
@@ -200,20 +402,22 @@ class GlanceImage(image.Image):
     def get_tags(self):
         return {}
 
-    def get_members(self, images):
+    def get_members(self, images, batch=None):
         # members structure {image_id: {tenant_name: can_share}}
+        if batch is None:
+            batch = ImageInfoBatch(self, images.keys())
         result = {}
         for img in images:
             if images[img]['image']['is_public']:
                 # public images cannot have members
                 continue
-            for entry in self.glance_client.image_members.list(image=img):
+            for member_id, can_share in batch.members[img].iteritems():
                 if img not in result:
                     result[img] = {}
 
-                tenant_name = self.identity_client.try_get_tenant_name_by_id(
-                    entry.member_id, default=self.config.cloud.tenant)
-                result[img][tenant_name] = entry.can_share
+                tenant_name = batch.tenant_name(member_id,
+                                                self.config.cloud.tenant)
+                result[img][tenant_name] = can_share
         return result
 
     def create_member(self, image_id, tenant_name, can_share):
@@ -226,10 +430,15 @@ class GlanceImage(image.Image):
 
     def _convert_images_with_metadata(self, image_list_metadata):
         info = {'images': {}}
-        for (im, meta) in image_list_metadata:
-            glance_image = self.get_image(im)
-            if glance_image:
-                info = self.make_image_info(glance_image, info)
+        found = [(self.get_image(im), meta)
+                 for (im, meta) in image_list_metadata]
+        found = [(glance_image, meta) for glance_image, meta in found
+                 if glance_image]
+        batch = ImageInfoBatch(
+            self, set(glance_image.id for glance_image, _ in found))
+        for glance_image, meta in found:
+            info = self.make_image_info(glance_image, info, batch)
+            if glance_image.id in info['images']:
                 info['images'][glance_image.id]['meta'] = meta
         return info
 
@@ -241,12 +450,16 @@ class GlanceImage(image.Image):
 
         info = {'images': {}}
 
-        for glance_image in self.get_image_list():
-            info = self.make_image_info(glance_image, info)
+        self.catalog.invalidate()
+        glance_images = self.catalog.list()
+        batch = ImageInfoBatch(self, [i.id for i in glance_images
+                                      if i.status == "active"])
+        for glance_image in glance_images:
+            info = self.make_image_info(glance_image, info, batch)
 
         info.update({
             "tags": self.get_tags(),
-            "members": self.get_members(info['images'])
+            "members": self.get_members(info['images'], batch)
         })
 
         LOG.info("Read images: %s",
@@ -261,23 +474,21 @@ class GlanceImage(image.Image):
         i = self.get_image_by_id(image_id)
         return self.make_image_info(i, info)
 
-    def make_image_info(self, glance_image, info):
+    def make_image_info(self, glance_image, info, batch=None):
         if glance_image:
             if glance_image.status == "active":
                 LOG.debug("Image '%s' status is active.", glance_image.name)
-                gl_image = self.convert(glance_image, self.cloud)
+                if batch is None:
+                    batch = ImageInfoBatch(self, [glance_image.id])
+                gl_image = self.convert(glance_image, self.cloud, batch)
 
-                command = ("SELECT value FROM image_locations "
-                           "WHERE image_id=\"{}\" AND deleted=\"0\";"
-                           .format(glance_image.id))
-                res = self.mysql_connector.execute(command)
                 img_loc = None
-                for row in res:
-                    if img_loc is not None:
-                        LOG.warning("ignoring multi locations for image {}"
-                                    .format(glance_image.name))
-                        break
-                    img_loc = row[0]
+                locations = batch.locations[glance_image.id]
+                if locations:
+                    img_loc = locations[0]
+                if len(locations) > 1:
+                    LOG.warning("ignoring multi locations for image {}"
+                                .format(glance_image.name))
 
                 info['images'][glance_image.id] = {
                     'image': gl_image,
@@ -303,13 +514,13 @@ class GlanceImage(image.Image):
         info = copy.deepcopy(info)
         new_info = {'images': {}}
         created_images = []
+        uploads = []
         delete_container_format, delete_disk_format = [], []
         empty_image_list = {}
 
         # List for obsolete/broken images IDs, that will not be migrated
         obsolete_images_ids_list = []
-        dst_img_checksums = {x.checksum: x for x in self.get_image_list()}
-        dst_img_names = [x.name for x in self.get_image_list()]
+        self.catalog.invalidate()
 
         for image_id_src, gl_image in info['images'].iteritems():
             img = gl_image['image']
@@ -318,12 +529,11 @@ class GlanceImage(image.Image):
                 name_current = img['name']
                 meta = gl_image['meta']
                 same_image_on_destination = (
-                    checksum_current in dst_img_checksums and
-                    name_current in dst_img_names)
+                    self.catalog.get_by_checksum_and_name(checksum_current,
+                                                          name_current))
 
                 if same_image_on_destination:
-                    created_images.append(
-                        (dst_img_checksums[checksum_current], meta))
+                    created_images.append((same_image_on_destination, meta))
                     LOG.info("Image '%s' is already present on destination, "
                              "skipping", img['name'])
                     continue
@@ -379,58 +589,28 @@ class GlanceImage(image.Image):
                             "image information has no original source URL")
                     continue
 
-                LOG.debug("Creating image '{image}' ({image_id})".format(
-                    image=img["name"],
-                    image_id=img['id']))
-                # we can face situation when image has no
-                # disk_format and container_format properties
-                # this situation appears, when image was created
-                # with option --copy-from
-                # glance-client cannot create image without this
-                # properties, we need to create them artificially
-                # and then - delete from database
-
-                try:
-                    data_proxy = file_like_proxy.FileLikeProxy(
-                        img, self.config['migrate']['speed_limit'])
-
-                    created_image = self.create_image(
-                        name=img['name'],
-                        container_format=(img['container_format'] or "bare"),
-                        disk_format=(img['disk_format'] or "qcow2"),
-                        is_public=img['is_public'],
-                        protected=img['protected'],
-                        owner=img['owner'],
-                        size=img['size'],
-                        properties=img['properties'],
-                        data=data_proxy)
-
-                    image_members = img['members'].get(img['id'], {})
-                    for tenant_name, can_share in image_members.iteritems():
-                        LOG.debug("deploying image member for image '%s' "
-                                  "tenant '%s'", img['id'], img['owner'])
-                        self.create_member(
-                            created_image.id, tenant_name, can_share)
-
-                    LOG.debug("new image ID {}".format(created_image.id))
-                    created_images.append((created_image, meta))
-                except exception.ImageDownloadError:
-                    LOG.warning("Unable to reach image's data due to "
-                                "Glance HTTPInternalServerError. Skipping "
-                                "image: (id = %s)", img["id"])
-                    obsolete_images_ids_list.append(img["id"])
-                    continue
-
-                if not img["container_format"]:
-                    delete_container_format.append(created_image.id)
-                if not img["disk_format"]:
-                    delete_disk_format.append(created_image.id)
+                # image data is copied by upload workers below, keep its
+                # place, so that result does not depend on their order
+                uploads.append((len(created_images), img, meta))
+                created_images.append(None)
             elif img['resource'] is None:
                 recreated_image = utl.ext_dict(name=img["name"])
                 created_images.append((recreated_image, gl_image['meta']))
             elif not img:
                 empty_image_list[image_id_src] = gl_image
 
+        uploaded = self.upload_images([img for _, img, _ in uploads])
+        for (position, img, meta), created_image in zip(uploads, uploaded):
+            if created_image is None:
+                obsolete_images_ids_list.append(img["id"])
+                continue
+            created_images[position] = (created_image, meta)
+            if not img["container_format"]:
+                delete_container_format.append(created_image.id)
+            if not img["disk_format"]:
+                delete_disk_format.append(created_image.id)
+        created_images = [c for c in created_images if c is not None]
+
         # Remove obsolete/broken images from info
         for img_id in obsolete_images_ids_list:
             info['images'].pop(img_id)
@@ -447,6 +627,111 @@ class GlanceImage(image.Image):
         LOG.info("Glance images deployment finished.")
         return new_info
 
+    def upload_images(self, images):
+        """Copies :images with `[migrate] image_workers` workers, returns
+        list of created images in the same order, None for the images which
+        data is not available on source.
+
+        `[migrate] speed_limit` is shared between the workers, so that it
+        limits total speed. Images with the same name and owner are uploaded
+        by the same worker one by one, so that cleanup after failed upload
+        can't delete image being uploaded by another worker.
+        """
+
+        groups = collections.OrderedDict()
+        for index, img in enumerate(images):
+            groups.setdefault((img['name'], img['owner']), []).append(
+                (index, img))
+        workers = max(min(self.config.migrate.image_workers, len(groups)), 1)
+        speed_limit = file_like_proxy.TokenBucket(
+            file_like_proxy.parse_speed_limit(
+                self.config.migrate.speed_limit))
+
+        def upload(group):
+            return [(index, self.upload_image(img, speed_limit))
+                    for index, img in group]
+
+        if workers == 1:
+            uploaded = [upload(group) for group in groups.values()]
+        else:
+            upload_pool = pool.ThreadPool(workers)
+            try:
+                uploaded = upload_pool.map(upload, groups.values())
+            finally:
+                upload_pool.close()
+                upload_pool.join()
+        created = [None] * len(images)
+        for group in uploaded:
+            for index, created_image in group:
+                created[index] = created_image
+        return created
+
+    def upload_image(self, img, speed_limit):
+        """Creates image with data of source image :img, retries `[migrate]
+        retry` times if upload fails."""
+
+        LOG.debug("Creating image '{image}' ({image_id})".format(
+            image=img["name"],
+            image_id=img['id']))
+        # we can face situation when image has no
+        # disk_format and container_format properties
+        # this situation appears, when image was created
+        # with option --copy-from
+        # glance-client cannot create image without this
+        # properties, we need to create them artificially
+        # and then - delete from database
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                data_proxy = file_like_proxy.FileLikeProxy(
+                    img, None, speed_limit)
+
+                created_image = self.create_image(
+                    name=img['name'],
+                    container_format=(img['container_format'] or "bare"),
+                    disk_format=(img['disk_format'] or "qcow2"),
+                    is_public=img['is_public'],
+                    protected=img['protected'],
+                    owner=img['owner'],
+                    size=img['size'],
+                    properties=img['properties'],
+                    data=data_proxy)
+                break
+            except exception.ImageDownloadError:
+                LOG.warning("Unable to reach image's data due to "
+                            "Glance HTTPInternalServerError. Skipping "
+                            "image: (id = %s)", img["id"])
+                return None
+            except Exception as e:
+                if attempt > self.config.migrate.retry:
+                    raise
+                LOG.warning("Failed to upload image '%s' (%s), attempt %d: "
+                            "%s. Retrying", img['name'], img['id'], attempt,
+                            e)
+                self.delete_partial_images(img)
+
+        image_members = img['members'].get(img['id'], {})
+        for tenant_name, can_share in image_members.iteritems():
+            LOG.debug("deploying image member for image '%s' "
+                      "tenant '%s'", img['id'], img['owner'])
+            self.create_member(created_image.id, tenant_name, can_share)
+
+        LOG.debug("new image ID {}".format(created_image.id))
+        return created_image
+
+    def delete_partial_images(self, img):
+        """Deletes images left by failed upload of :img, those are images
+        with the same name and owner which are missing in the catalog."""
+
+        for glance_image in self.glance_client.images.list(
+                filters={'name': img['name'], 'is_public': None}):
+            if (glance_image.owner == img['owner'] and
+                    self.catalog.get_by_id(glance_image.id) is None):
+                LOG.info("Deleting image '%s' (%s) left by failed upload",
+                         glance_image.name, glance_image.id)
+                self.delete_image(glance_image.id)
+
     def delete_fields(self, field, list_of_ids):
         if not list_of_ids:
             return
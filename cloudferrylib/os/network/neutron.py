@@ -11,7 +11,9 @@
 # implied.
 # See the License for the specific language governing permissions and#
 # limitations under the License.
+import collections
 import pprint
+import threading
 
 import ipaddr
 import netaddr
@@ -25,6 +27,214 @@ from cloudferrylib.utils import utils as utl
 
 LOG = utl.get_log(__name__)
 DEFAULT_SECGR = 'default'
+# Maximum number of ports created with single bulk request
+PORTS_BULK_SIZE = 100
+
+
+class SubnetTree(object):
+    """Subnets indexed by CIDR to look up subnets containing an IP address.
+
+    Subnets are grouped by IP version and prefix length and keyed by network
+    address, so that lookup masks the address with each prefix length in use
+    instead of checking every subnet.
+    """
+
+    def __init__(self):
+        self.prefixes = collections.defaultdict(dict)
+        self.count = 0
+
+    def add(self, subnet):
+        try:
+            cidr = ipaddr.IPNetwork(subnet['cidr'])
+        except ValueError:
+            LOG.warning("Subnet '%s' has invalid CIDR '%s', skipping",
+                        subnet.get('id'), subnet['cidr'])
+            return
+        self.prefixes[(cidr.version, cidr.prefixlen)].setdefault(
+            int(cidr.network), []).append((self.count, subnet))
+        self.count += 1
+
+    def find(self, ip):
+        """Returns subnets containing :ip in the order they were added."""
+
+        address = ipaddr.IPAddress(ip)
+        bits = address.max_prefixlen
+        result = []
+        for (version, prefixlen), networks in self.prefixes.iteritems():
+            if version != address.version:
+                continue
+            mask = ((1 << bits) - 1) ^ ((1 << (bits - prefixlen)) - 1)
+            result.extend(networks.get(int(address) & mask, []))
+        return [subnet for _, subnet in sorted(result)]
+
+
+class ResourceIndex(object):
+    """Resources in CloudFerry format indexed by id and resource hash, so
+    that `NeutronNetwork.get_res_by_hash` and
+    `NeutronNetwork.get_res_hash_by_id` don't scan the list every time."""
+
+    def __init__(self, resources):
+        self.resources = resources
+        self.by_id = {}
+        self.by_hash = {}
+        for resource in resources:
+            if 'id' in resource:
+                self.by_id.setdefault(resource['id'], resource)
+            self.by_hash.setdefault(resource['res_hash'], resource)
+
+    @classmethod
+    def of(cls, resources):
+        if isinstance(resources, cls):
+            return resources
+        return cls(resources)
+
+    def __iter__(self):
+        return iter(self.resources)
+
+    def get_by_hash(self, resource_hash):
+        return self.by_hash.get(resource_hash)
+
+    def get_hash_by_id(self, resource_id):
+        resource = self.by_id.get(resource_id)
+        if resource is not None:
+            return resource['res_hash']
+
+
+class NetworkIndex(object):
+    """Networks, subnets, ports and security groups of the cloud in raw
+    neutron format, read with one listing call each on the first lookup.
+
+    Ports are indexed by (network id, MAC) and by fixed IP, subnets by CIDR,
+    security groups by (tenant id, name). Resources created or deleted
+    through NeutronNetwork are added to or removed from the index,
+    `invalidate` drops it, so that the next lookup lists resources again.
+    """
+
+    def __init__(self, network):
+        self.network = network
+        self.lock = threading.RLock()
+        self.ports = None
+        self.ports_by_mac = None
+        self.ports_by_ip = None
+        self.networks = None
+        self.networks_by_name = None
+        self.subnets = None
+        self.security_groups = None
+
+    def invalidate(self):
+        with self.lock:
+            self.ports = None
+            self.networks = None
+            self.security_groups = None
+
+    def _load_ports(self):
+        if self.ports is not None:
+            return
+        self.ports = collections.OrderedDict()
+        self.ports_by_mac = {}
+        self.ports_by_ip = {}
+        for port in self.network.get_list_ports():
+            self._index_port(port)
+
+    def _index_port(self, port):
+        self.ports[port['id']] = port
+        self.ports_by_mac.setdefault(
+            (port['network_id'], port['mac_address']), port)
+        for fixed_ip in port['fixed_ips']:
+            self.ports_by_ip.setdefault(fixed_ip['ip_address'], port)
+
+    def _load_networks(self):
+        if self.networks is not None:
+            return
+        self.networks = collections.OrderedDict()
+        self.networks_by_name = {}
+        self.subnets = SubnetTree()
+        for net in self.network.get_networks_list():
+            self._index_network(net)
+        for subnet in self.network.get_subnets_list():
+            self.subnets.add(subnet)
+
+    def _index_network(self, net):
+        self.networks[net['id']] = net
+        self.networks_by_name.setdefault(net['name'], net)
+
+    def _load_security_groups(self):
+        if self.security_groups is not None:
+            return
+        self.security_groups = collections.defaultdict(list)
+        for sec_gr in self.network.get_security_groups():
+            self._index_security_group(sec_gr)
+
+    def _index_security_group(self, sec_gr):
+        self.security_groups[(sec_gr['tenant_id'], sec_gr['name'])].append(
+            sec_gr)
+
+    def add_port(self, port):
+        with self.lock:
+            if self.ports is not None:
+                self._index_port(port)
+
+    def remove_port(self, port_id):
+        with self.lock:
+            if self.ports is None:
+                return
+            port = self.ports.pop(port_id, None)
+            if port is None:
+                return
+            key = (port['network_id'], port['mac_address'])
+            if self.ports_by_mac.get(key) is port:
+                del self.ports_by_mac[key]
+            for fixed_ip in port['fixed_ips']:
+                if self.ports_by_ip.get(fixed_ip['ip_address']) is port:
+                    del self.ports_by_ip[fixed_ip['ip_address']]
+
+    def add_network(self, net):
+        with self.lock:
+            if self.networks is not None:
+                self._index_network(net)
+
+    def add_subnet(self, subnet):
+        with self.lock:
+            if self.networks is not None:
+                self.subnets.add(subnet)
+
+    def add_security_group(self, sec_gr):
+        with self.lock:
+            if self.security_groups is not None:
+                self._index_security_group(sec_gr)
+
+    def get_port_by_mac(self, network_id, mac):
+        with self.lock:
+            self._load_ports()
+            return self.ports_by_mac.get((network_id, mac))
+
+    def get_port_by_ip(self, ip_address):
+        """Returns the first port with :ip_address in neutron listing
+        order."""
+
+        with self.lock:
+            self._load_ports()
+            return self.ports_by_ip.get(ip_address)
+
+    def get_network(self, network_id):
+        with self.lock:
+            self._load_networks()
+            return self.networks.get(network_id)
+
+    def get_network_by_name(self, name):
+        with self.lock:
+            self._load_networks()
+            return self.networks_by_name.get(name)
+
+    def get_subnets_by_ip(self, ip_address):
+        with self.lock:
+            self._load_networks()
+            return self.subnets.find(ip_address)
+
+    def get_security_groups(self, tenant_id, name):
+        with self.lock:
+            self._load_security_groups()
+            return list(self.security_groups.get((tenant_id, name), []))
 
 
 class NeutronNetwork(network.Network):
@@ -41,10 +251,16 @@ class NeutronNetwork(network.Network):
         self.ext_net_map = \
             utl.read_yaml_file(self.config.migrate.ext_net_map) or {}
         self.mysql_connector = cloud.mysql_connector('neutron')
+        self.index = NetworkIndex(self)
 
     @property
     def neutron_client(self):
-        return self.proxy(self.get_client(), self.config)
+        return self.proxy(
+            self.cloud.clients.get('network',
+                                   self.config.cloud.tenant,
+                                   self.config.cloud.user,
+                                   self.get_client),
+            self.config)
 
     def get_client(self):
         kwargs = {
@@ -67,6 +283,8 @@ class NeutronNetwork(network.Network):
         :rtype: Dictionary with all necessary neutron info
         """
 
+        self.index.invalidate()
+
         if kwargs.get('tenant_id'):
             tenant_id = self.filter_tenant_id = kwargs['tenant_id'][0]
         else:
@@ -190,6 +408,7 @@ class NeutronNetwork(network.Network):
             src router external ip 123.0.0.5 and FloatingIP 123.0.0.4
             dst router external ip 123.0.0.6 and FloatingIP 123.0.0.4
         """
+        self.index.invalidate()
         deploy_info = info
         self.upload_quota(deploy_info['quota'])
         self.upload_networks(deploy_info['networks'])
@@ -241,15 +460,19 @@ class NeutronNetwork(network.Network):
         return self.get_mac_by_ip
 
     def get_mac_by_ip(self, ip_address):
-        for port in self.get_list_ports():
-            for fixed_ip_info in port['fixed_ips']:
-                if fixed_ip_info['ip_address'] == ip_address:
-                    return port["mac_address"]
+        port = self.index.get_port_by_ip(ip_address)
+        if port is None:
+            # port may be created after the index is loaded
+            self.index.invalidate()
+            port = self.index.get_port_by_ip(ip_address)
+        if port is not None:
+            return port["mac_address"]
 
     def get_list_ports(self, **kwargs):
         return self.neutron_client.list_ports(**kwargs)['ports']
 
-    def create_port(self, net_id, mac, ip, tenant_id, keep_ip, sg_ids=None):
+    @staticmethod
+    def _port_body(net_id, mac, ip, tenant_id, keep_ip, sg_ids=None):
         param_create_port = {'network_id': net_id,
                              'mac_address': mac,
                              'tenant_id': tenant_id}
@@ -257,44 +480,123 @@ class NeutronNetwork(network.Network):
             param_create_port['security_groups'] = sg_ids
         if keep_ip:
             param_create_port['fixed_ips'] = [{"ip_address": ip}]
+        return param_create_port
+
+    def _create_port(self, param_create_port):
+        LOG.debug("Creating port IP '%s', MAC '%s' on net '%s'",
+                  param_create_port.get('fixed_ips'),
+                  param_create_port['mac_address'],
+                  param_create_port['network_id'])
+        port = self.neutron_client.create_port(
+            {'port': param_create_port})['port']
+        self.index.add_port(port)
+        return port
+
+    def create_port(self, net_id, mac, ip, tenant_id, keep_ip, sg_ids=None):
+        with ksresource.AddAdminUserToNonAdminTenant(
+                self.identity_client.keystone_client,
+                self.config.cloud.user,
+                self.config.cloud.tenant,
+                client_registry=self.cloud.clients,
+                keystone_factory=lambda: self.identity_client.keystone_client):
+            return self._create_port(self._port_body(net_id, mac, ip,
+                                                     tenant_id, keep_ip,
+                                                     sg_ids))
+
+    def create_ports(self, tenant_id, ports):
+        """Creates ports in tenant :tenant_id with bulk requests of up to
+        PORTS_BULK_SIZE ports.
+
+        :ports: list of dicts with `create_port` arguments except tenant ID
+
+        Bulk request is atomic, so if it fails, e.g. because one of IPs is
+        already allocated, ports of the request are created one by one.
+        Returns list of created ports in the order of :ports, with None for
+        ports whose IP is already allocated.
+        """
+
+        created = []
         with ksresource.AddAdminUserToNonAdminTenant(
                 self.identity_client.keystone_client,
                 self.config.cloud.user,
-                self.config.cloud.tenant):
+                self.config.cloud.tenant,
+                client_registry=self.cloud.clients,
+                keystone_factory=lambda: self.identity_client.keystone_client):
+            for i in xrange(0, len(ports), PORTS_BULK_SIZE):
+                bodies = [self._port_body(tenant_id=tenant_id, **port)
+                          for port in ports[i:i + PORTS_BULK_SIZE]]
+                created.extend(self._create_ports_bulk(bodies))
+        return created
+
+    def _create_ports_bulk(self, bodies):
+        LOG.debug("Creating %d ports in bulk", len(bodies))
+        # raw client is used, retries of the request failing because of
+        # allocated IP would fail the same way
+        client = self.neutron_client.client
+        try:
+            ports = client.create_port({'ports': bodies})['ports']
+        except neutron_exc.NeutronClientException as e:
+            LOG.debug("Unable to create ports in bulk, creating them one by "
+                      "one: %s", e)
+        else:
+            for port in ports:
+                self.index.add_port(port)
+            return ports
+
+        ports = []
+        for body in bodies:
             LOG.debug("Creating port IP '%s', MAC '%s' on net '%s'",
-                      ip, mac, net_id)
-            return self.neutron_client.create_port(
-                {'port': param_create_port})['port']
+                      body.get('fixed_ips'), body['mac_address'],
+                      body['network_id'])
+            try:
+                port = client.create_port({'port': body})['port']
+            except neutron_exc.IpAddressInUseClient:
+                ports.append(None)
+                continue
+            self.index.add_port(port)
+            ports.append(port)
+        return ports
 
     def delete_port(self, port_id):
-        return self.neutron_client.delete_port(port_id)
+        self.index.remove_port(port_id)
+        try:
+            return self.neutron_client.delete_port(port_id)
+        except neutron_exc.PortNotFoundClient:
+            LOG.debug("Port '%s' is already deleted", port_id)
 
     def get_network(self, network_info, tenant_id, keep_ip=False):
         if keep_ip:
-            instance_addr = ipaddr.IPAddress(network_info['ip'])
-            for snet in self.get_subnets_list():
-                network = self.get_network({"id": snet['network_id']}, None)
+            for snet in self.index.get_subnets_by_ip(network_info['ip']):
+                network = self.index.get_network(snet['network_id'])
+                if network is None:
+                    continue
                 if snet['tenant_id'] == tenant_id or network['shared']:
-                    if ipaddr.IPNetwork(snet['cidr']).Contains(instance_addr):
-                        return self.neutron_client.\
-                            list_networks(id=snet['network_id'])['networks'][0]
+                    return network
         if 'id' in network_info:
-            return self.neutron_client.\
+            network = self.index.get_network(network_info['id'])
+            return network or self.neutron_client.\
                 list_networks(id=network_info['id'])['networks'][0]
         if 'name' in network_info:
-            return self.neutron_client.\
+            network = self.index.get_network_by_name(network_info['name'])
+            return network or self.neutron_client.\
                 list_networks(name=network_info['name'])['networks'][0]
         else:
             raise Exception("Can't find suitable network")
 
     def check_existing_port(self, network_id, mac):
-        for port in self.get_list_ports(fields=['network_id',
-                                                'mac_address', 'id']):
-            if (port['network_id'] == network_id) \
-                    and (port['mac_address'] == mac):
-                return port['id']
+        port = self.index.get_port_by_mac(network_id, mac)
+        if port is not None:
+            return port['id']
         return None
 
+    def get_security_group_ids(self, tenant_id, names):
+        """Returns IDs of security groups of tenant :tenant_id with names
+        in :names."""
+
+        return [sec_gr['id']
+                for name in set(names)
+                for sec_gr in self.index.get_security_groups(tenant_id, name)]
+
     @staticmethod
     def convert(neutron_object, cloud, obj_name):
         """Convert OpenStack Neutron network object to CloudFerry object.
@@ -987,13 +1289,16 @@ class NeutronNetwork(network.Network):
                                 'description': sec_group['description']
                             }
                         }
-                    sec_group['meta']['id'] = self.neutron_client.\
-                        create_security_group(sg_info)['security_group']['id']
+                    created_sec_gr = self.neutron_client.\
+                        create_security_group(sg_info)['security_group']
+                    self.index.add_security_group(created_sec_gr)
+                    sec_group['meta']['id'] = created_sec_gr['id']
         LOG.info("Done")
 
     def upload_sec_group_rules(self, sec_groups):
         LOG.info("Creating neutron security group rules on destination...")
-        ex_secgrs = self.get_sec_gr_and_rules()
+        ex_secgrs = ResourceIndex(self.get_sec_gr_and_rules())
+        sec_groups = ResourceIndex(sec_groups)
         for sec_gr in sec_groups:
             ex_secgr = \
                 self.get_res_by_hash(ex_secgrs, sec_gr['res_hash'])
@@ -1125,6 +1430,7 @@ class NeutronNetwork(network.Network):
                       pprint.pformat(network_info))
             created_net = self.neutron_client.create_network(network_info)
             created_net = created_net['network']
+            self.index.add_network(created_net)
             LOG.info("Created net '%s'", created_net['name'])
         except neutron_exc.NeutronClientException as e:
             LOG.warning("Cannot create network on destination: %s. "
@@ -1150,6 +1456,7 @@ class NeutronNetwork(network.Network):
             try:
                 created_subnet = self.neutron_client.create_subnet(subnet_info)
                 created_subnet = created_subnet['subnet']
+                self.index.add_subnet(created_subnet)
                 snet['meta']['id'] = created_subnet['id']
 
                 LOG.info("Created subnet '%s' in net '%s'",
@@ -1162,11 +1469,12 @@ class NeutronNetwork(network.Network):
 
     def upload_routers(self, networks, subnets, routers):
         LOG.info("Creating routers on destination")
-        existing_nets = self.get_networks()
-        existing_subnets = self.get_subnets()
-        existing_routers = self.get_routers()
-        existing_routers_hashlist = \
-            [ex_router['res_hash'] for ex_router in existing_routers]
+        networks = ResourceIndex(networks)
+        subnets = ResourceIndex(subnets)
+        existing_nets = ResourceIndex(self.get_networks())
+        existing_subnets = ResourceIndex(self.get_subnets())
+        existing_routers = ResourceIndex(self.get_routers())
+        existing_routers_hashlist = existing_routers.by_hash
         for router in routers:
             tname = router['tenant_name']
             tenant_id = self.identity_client.get_tenant_id_by_name(tname)
@@ -1224,6 +1532,8 @@ class NeutronNetwork(network.Network):
     def add_router_interfaces(self, src_router, dst_router,
                               src_snets, dst_snets):
         LOG.info("Adding router interfaces")
+        src_snets = ResourceIndex.of(src_snets)
+        dst_snets = ResourceIndex.of(dst_snets)
         for snet_id in src_router['subnet_ids']:
             snet_hash = self.get_res_hash_by_id(src_snets, snet_id)
             src_net = self.get_res_by_hash(src_snets, snet_hash)
@@ -1251,23 +1561,61 @@ class NeutronNetwork(network.Network):
               destination. This is done from the DB level.
          2.2. Else - do not modify floating IP address
          3. Return list of ID of new floating IPs
+
+        Floating IPs are grouped by tenant, so that admin user is added to
+        each tenant once and addresses of all floating IPs of the tenant are
+        changed in one DB transaction.
         """
         LOG.info("Uploading floating IPs...")
-        existing_networks = self.get_networks()
-        new_floating_ids = []
+        networks = ResourceIndex(networks)
+        existing_networks = ResourceIndex(self.get_networks())
+        new_floating_ids = [None] * len(src_floats)
         fips_dst = self.neutron_client.list_floatingips()['floatingips']
         ipfloatings = {fip['floating_ip_address']: fip['id']
                        for fip in fips_dst}
-        for fip in src_floats:
+        tenants_fips = collections.OrderedDict()
+        for i, fip in enumerate(src_floats):
             ip = fip['floating_ip_address']
             if ip in ipfloatings:
-                new_floating_ids.append(ipfloatings[ip])
+                new_floating_ids[i] = ipfloatings[ip]
                 continue
-            with ksresource.AddAdminUserToNonAdminTenant(
-                    self.identity_client.keystone_client,
-                    self.config.cloud.user,
-                    fip['tenant_name']):
+            tenants_fips.setdefault(fip['tenant_name'], []).append(i)
 
+        for tenant_name, positions in tenants_fips.iteritems():
+            fip_ids = self.upload_tenant_floatingips(
+                tenant_name, [src_floats[i] for i in positions], networks,
+                existing_networks)
+            for i, fip_id in zip(positions, fip_ids):
+                new_floating_ids[i] = fip_id
+
+        LOG.info("Done")
+        return [fip_id for fip_id in new_floating_ids if fip_id is not None]
+
+    def upload_tenant_floatingips(self, tenant_name, src_floats, networks,
+                                  existing_networks):
+        """Creates floating IPs :src_floats of tenant :tenant_name on
+        destination and sets their addresses to the source ones, returns
+        IDs of created floating IPs in the order of :src_floats, with None
+        for floating IPs which are not created."""
+
+        fip_ids = [None] * len(src_floats)
+        created = []
+        with ksresource.AddAdminUserToNonAdminTenant(
+                self.identity_client.keystone_client,
+                self.config.cloud.user,
+                tenant_name,
+                client_registry=self.cloud.clients,
+                keystone_factory=lambda: self.identity_client.keystone_client):
+            tenant_id = self.identity_client.get_tenant_id_by_name(
+                tenant_name)
+
+            # neutron allocates the lowest free addresses, so creating
+            # floating IPs in order of source addresses reduces the number
+            # of address swaps
+            for i in sorted(xrange(len(src_floats)),
+                            key=lambda i: netaddr.IPAddress(
+                                src_floats[i]['floating_ip_address'])):
+                fip = src_floats[i]
                 ext_net_id = self.get_new_extnet_id(
                     fip['floating_network_id'], networks, existing_networks)
 
@@ -1277,49 +1625,82 @@ class NeutronNetwork(network.Network):
                              "IP '%s'", fip['floating_ip_address'])
                     continue
 
-                tenant = self.identity_client.keystone_client.tenants.find(
-                    name=fip['tenant_name'])
-
                 new_fip = {
                     'floatingip': {
                         'floating_network_id': ext_net_id,
-                        'tenant_id': tenant.id
+                        'tenant_id': tenant_id
                     }
                 }
                 created_fip = self.create_floatingip(new_fip)
                 if created_fip is None:
                     continue
+                created.append((i, created_fip))
+
+            while created:
+                ordered, swapped = order_address_changes(
+                    [((i, created_fip), created_fip['floating_ip_address'],
+                      src_floats[i]['floating_ip_address'])
+                     for i, created_fip in created])
+
+                # floating IPs holding addresses of each other release them
+                # and get recreated after others got their addresses
+                for _, created_fip in swapped:
+                    self.neutron_client.delete_floatingip(created_fip['id'])
+                self.restore_floatingip_addresses(
+                    [(created_fip['id'], src_floats[i]['floating_ip_address'])
+                     for i, created_fip in ordered])
+                for i, created_fip in ordered:
+                    fip_ids[i] = created_fip['id']
+
+                created = []
+                for i, created_fip in sorted(swapped):
+                    recreated_fip = self.create_floatingip(
+                        {'floatingip': {
+                            'floating_network_id':
+                                created_fip['floating_network_id'],
+                            'tenant_id': tenant_id}})
+                    if recreated_fip is not None:
+                        created.append((i, recreated_fip))
+
+        return fip_ids
+
+    def restore_floatingip_addresses(self, addresses):
+        """Sets addresses of floating IPs in one DB transaction.
+
+        :addresses: list of (floating IP ID, address), must be ordered so
+                    that no address is held by floating IP later in the list
+        """
 
-            fip_id = created_fip['id']
-            new_floating_ids.append(fip_id)
-            sqls = [('UPDATE IGNORE floatingips '
-                     'SET floating_ip_address = "{ip}" '
-                     'WHERE id = "{fip_id}"').format(ip=ip, fip_id=fip_id),
-                    ('UPDATE IGNORE ipallocations '
-                     'SET ip_address = "{ip}" '
-                     'WHERE port_id = ('
-                         'SELECT floating_port_id '
-                         'FROM floatingips '
-                         'WHERE id = "{fip_id}")').format(
-                        ip=ip, fip_id=fip_id),
-                    ('DELETE FROM ipavailabilityranges '
-                     'WHERE allocation_pool_id in ( '
+        if not addresses:
+            return
+        sqls = []
+        for fip_id, ip in addresses:
+            sqls.extend([
+                ('UPDATE IGNORE floatingips '
+                 'SET floating_ip_address = "{ip}" '
+                 'WHERE id = "{fip_id}"').format(ip=ip, fip_id=fip_id),
+                ('UPDATE IGNORE ipallocations '
+                 'SET ip_address = "{ip}" '
+                 'WHERE port_id = ('
+                     'SELECT floating_port_id '
+                     'FROM floatingips '
+                     'WHERE id = "{fip_id}")').format(
+                    ip=ip, fip_id=fip_id)])
+        for fip_id, _ in addresses:
+            sqls.append(('DELETE FROM ipavailabilityranges '
+                         'WHERE allocation_pool_id in ( '
                          'SELECT id '
                          'FROM ipallocationpools '
                          'WHERE subnet_id = ( '
-                             'SELECT subnet_id '
-                             'FROM ipallocations '
-                             'WHERE port_id = ( '
-                             'SELECT floating_port_id '
-                             'FROM floatingips '
-                             'WHERE id = "{fip_id}")))').format(
-                        fip_id=fip_id)]
-            LOG.debug(sqls)
-            dst_mysql = self.mysql_connector
-            dst_mysql.batch_execute(sqls)
-
-        LOG.info("Done")
-        return new_floating_ids
+                         'SELECT subnet_id '
+                         'FROM ipallocations '
+                         'WHERE port_id = ( '
+                         'SELECT floating_port_id '
+                         'FROM floatingips '
+                         'WHERE id = "{fip_id}")))').format(fip_id=fip_id))
+        LOG.debug(sqls)
+        dst_mysql = self.mysql_connector
+        dst_mysql.batch_execute(sqls)
 
     def create_floatingip(self, fip):
         try:
@@ -1339,15 +1720,14 @@ class NeutronNetwork(network.Network):
 
     @staticmethod
     def get_res_by_hash(existing_resources, resource_hash):
-        for resource in existing_resources:
-            if resource['res_hash'] == resource_hash:
-                return resource
+        """:existing_resources is either list of resources or ResourceIndex
+        of them, the latter should be used for repeated lookups."""
+
+        return ResourceIndex.of(existing_resources).get_by_hash(resource_hash)
 
     @staticmethod
     def get_res_hash_by_id(resources, resource_id):
-        for resource in resources:
-            if resource['id'] == resource_id:
-                return resource['res_hash']
+        return ResourceIndex.of(resources).get_hash_by_id(resource_id)
 
     @staticmethod
     def get_resource_hash(neutron_resource, *args):
@@ -1404,17 +1784,56 @@ class Router(object):
                     break
 
 
+def order_address_changes(changes):
+    """Orders changes of addresses, so that no address is assigned while it
+    is still held by another changed object.
+
+    :changes: list of (item, current address, new address)
+
+    Returns (ordered items, postponed items), postponed items hold
+    addresses of each other in a cycle, they must release their addresses
+    before ordered items are changed and get new addresses afterwards.
+    """
+
+    holders = {current: i for i, (_, current, _) in enumerate(changes)}
+    done = [False] * len(changes)
+    ordered = []
+    postponed = []
+    for i in xrange(len(changes)):
+        path = []
+        on_path = set()
+        j = i
+        while j is not None and not done[j] and j not in on_path:
+            path.append(j)
+            on_path.add(j)
+            holder = holders.get(changes[j][2])
+            j = holder if holder != j else None
+        if j is not None and j in on_path:
+            path.remove(j)
+            done[j] = True
+            postponed.append(changes[j][0])
+        for k in reversed(path):
+            done[k] = True
+            ordered.append(changes[k][0])
+    return ordered, postponed
+
+
 def get_network_from_list_by_id(network_id, networks_list):
     """Get Neutron network by id from provided networks list.
 
     :param network_id: Neutron network ID
     :param networks_list: List of Neutron networks, where target network should
-                          be searched
+                          be searched, or dict of them keyed by ID
     """
 
-    for net in networks_list:
-        if net['id'] == network_id:
+    if isinstance(networks_list, dict):
+        net = networks_list.get(network_id)
+        if net is not None:
             return net
+    else:
+        for net in networks_list:
+            if net['id'] == network_id:
+                return net
 
     LOG.warning("Cannot obtain network with id='%s' from provided networks "
                 "list", network_id)
@@ -1426,17 +1845,21 @@ def get_network_from_list(ip, tenant_id, networks_list, subnets_list):
         :param ip: IP address of VM from this network
         :param tenant_id: Tenant Id of VM in this network
         :param networks_list: List of Neutron networks, where target network
-                              should be searched
+                              should be searched, or dict of them keyed by ID
         :param subnets_list: List of Neutron subnets, where target network
-                             should be searched
+                             should be searched, or SubnetTree of them
         """
 
-        instance_ip = ipaddr.IPAddress(ip)
+        if isinstance(subnets_list, SubnetTree):
+            subnets_list = subnets_list.find(ip)
+            instance_ip = None
+        else:
+            instance_ip = ipaddr.IPAddress(ip)
 
         for subnet in subnets_list:
             network_id = subnet['network_id']
             net = get_network_from_list_by_id(network_id, networks_list)
             if subnet['tenant_id'] == tenant_id or net['shared']:
-                if ipaddr.IPNetwork(subnet['cidr']).Contains(instance_ip):
-                    return get_network_from_list_by_id(network_id,
-                                                       networks_list)
+                if instance_ip is None or \
+                        ipaddr.IPNetwork(subnet['cidr']).Contains(instance_ip):
+                    return net
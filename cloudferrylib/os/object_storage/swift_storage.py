@@ -12,13 +12,75 @@
 # See the License for the specific language governing permissions and#
 # limitations under the License.
 
+import json
+from multiprocessing import pool
+import urllib
+
 from cloudferrylib.base import objstorage
 from swiftclient import client as swift_client
 from cloudferrylib.utils import utils as utl
 
 
+LOG = utl.get_log(__name__)
+
+CHUNK_SIZE = 64 * 1024  # B
+MB = 1024 * 1024
+
+
+class ObjectReader(object):
+    """File-like object reading body of streamed GET response, which is an
+    iterator of chunks, so that it can be given to PUT request."""
+
+    def __init__(self, body):
+        self.body = iter(body)
+        self.chunk = ''
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self.chunk + ''.join(self.body)
+            self.chunk = ''
+            return data
+        if not self.chunk:
+            self.chunk = next(self.body, '')
+        if size >= len(self.chunk):
+            data, self.chunk = self.chunk, ''
+        else:
+            data, self.chunk = self.chunk[:size], self.chunk[size:]
+        return data
+
+
+def is_manifest(headers):
+    """Etag of large object manifest is not MD5 of its contents."""
+
+    return ('x-static-large-object' in headers or
+            'x-object-manifest' in headers)
+
+
+def object_size(src_storage, headers):
+    """Size of the object from headers of its GET response. Dynamic large
+    object may be returned without content-length, then sizes of its
+    segments are summed."""
+
+    if 'content-length' in headers:
+        return int(headers['content-length'])
+    if 'x-object-manifest' not in headers:
+        return 0
+    container, _, prefix = urllib.unquote(
+        headers['x-object-manifest']).partition('/')
+    _, segments = src_storage.get_container(container, prefix=prefix,
+                                            full_listing=True)
+    return sum(segment['bytes'] for segment in segments)
+
+
 class SwiftStorage(objstorage.ObjStorage):
-    """The main class for working with Object Storage Service. """
+    """The main class for working with Object Storage Service.
+
+    `read_info` reads only metadata of the objects, `deploy` streams every
+    object from source to destination with `[migrate] objstorage_workers`
+    objects copied at once. Objects larger than `[migrate]
+    swift_segment_size` are uploaded as static large objects, which
+    segments are copied in parallel.
+    """
 
     def __init__(self, config, cloud):
         super(SwiftStorage, self).__init__()
@@ -44,57 +106,154 @@ class SwiftStorage(objstorage.ObjStorage):
     def read_info(self, **kwargs):
         info = {
             utl.OBJSTORAGE_RESOURCE: {
-                utl.CONTAINERS: {}
+                utl.CONTAINERS: {},
+                # destination reads objects' data from source resource
+                'resource': self,
             }
         }
         account_info = self.get_account_info()
         info[utl.OBJSTORAGE_RESOURCE][utl.CONTAINERS] = account_info[1]
         for container_info in info[utl.OBJSTORAGE_RESOURCE][utl.CONTAINERS]:
             container_info['objects'] = \
-                self.get_container(container_info['name'])[1]
-            for object_info in container_info['objects']:
-                resp, object_info['data'] = \
-                    self.get_object(container_info['name'],
-                                    object_info['name'])
+                self.get_container(container_info['name'],
+                                   full_listing=True)[1]
         return info
 
     def deploy(self, info, **kwargs):
-        for container_info in info[utl.OBJSTORAGE_RESOURCE][utl.CONTAINERS]:
+        objstorage_info = info[utl.OBJSTORAGE_RESOURCE]
+        src_storage = objstorage_info.get('resource')
+        objects = []
+        for container_info in objstorage_info[utl.CONTAINERS]:
             self.put_container(container_info['name'])
             for object_info in container_info['objects']:
-                self.put_object(container=container_info['name'],
-                                obj_name=object_info['name'],
-                                content=object_info['data'],
-                                content_type=object_info['content_type'])
+                objects.append((container_info['name'], object_info))
+
+        self.in_workers(
+            lambda o: self.copy_object(src_storage, o[0], o[1]), objects)
         return info
 
+    def in_workers(self, func, items):
+        """Calls :func for every item with `[migrate] objstorage_workers`
+        threads, returns results in order of items."""
+
+        workers = min(self.config.migrate.objstorage_workers, len(items))
+        if workers <= 1:
+            return [func(item) for item in items]
+        workers_pool = pool.ThreadPool(workers)
+        try:
+            return workers_pool.map(func, items)
+        finally:
+            workers_pool.close()
+            workers_pool.join()
+
+    def copy_object(self, src_storage, container, object_info):
+        name = object_info['name']
+        if 'data' in object_info:
+            # info read before objects were streamed
+            self.put_object(container=container,
+                            obj_name=name,
+                            content=object_info['data'],
+                            content_type=object_info['content_type'])
+            return
+
+        segment_size = self.config.migrate.swift_segment_size * MB
+        if 0 < segment_size < object_info['bytes']:
+            self.copy_large_object(src_storage, container, object_info,
+                                   segment_size)
+            return
+
+        LOG.debug("Copying object '%s/%s'", container, name)
+        headers, body = src_storage.get_object(container, name,
+                                               resp_chunk_size=CHUNK_SIZE)
+        etag = None
+        if is_manifest(headers):
+            # container listing has size of the manifest, which is 0 for
+            # dynamic large object, not the size of its contents
+            size = object_size(src_storage, headers)
+            if 0 < segment_size < size:
+                if hasattr(body, 'close'):
+                    body.close()
+                self.copy_large_object(src_storage, container, object_info,
+                                       segment_size, size=size)
+                return
+        else:
+            etag = headers.get('etag', '').strip('"') or None
+        self.put_object(container=container,
+                        obj_name=name,
+                        content=ObjectReader(body),
+                        content_type=object_info['content_type'],
+                        etag=etag,
+                        chunk_size=CHUNK_SIZE)
+
+    def copy_large_object(self, src_storage, container, object_info,
+                          segment_size, size=None):
+        """Copies object of :size bytes, size from container listing by
+        default, as static large object, segments are stored in
+        `<container>_segments` container like swift client does."""
+
+        name = object_info['name']
+        if size is None:
+            size = object_info['bytes']
+        segments_container = '%s_segments' % container
+        prefix = '%s/slo/%s/%s/%s' % (name, object_info['last_modified'],
+                                      size, segment_size)
+        self.put_container(segments_container)
+        LOG.debug("Copying object '%s/%s' in %d segments", container, name,
+                  (size + segment_size - 1) / segment_size)
+
+        def copy_segment(i):
+            offset = i * segment_size
+            length = min(segment_size, size - offset)
+            segment_name = '%s/%08d' % (prefix, i)
+            _, body = src_storage.get_object(
+                container, name, resp_chunk_size=CHUNK_SIZE,
+                headers={'Range': 'bytes=%d-%d' % (offset,
+                                                   offset + length - 1)})
+            etag = self.put_object(container=segments_container,
+                                   obj_name=segment_name,
+                                   content=ObjectReader(body),
+                                   content_length=length,
+                                   chunk_size=CHUNK_SIZE)
+            return {'path': '/%s/%s' % (segments_container, segment_name),
+                    'etag': etag,
+                    'size_bytes': length}
+
+        manifest = self.in_workers(
+            copy_segment, range((size + segment_size - 1) / segment_size))
+        self.put_object(container=container,
+                        obj_name=name,
+                        content=json.dumps(manifest),
+                        content_type=object_info['content_type'],
+                        query_string='multipart-manifest=put')
+
     def get_account_info(self):
-        return swift_client.get_account(self.storage_url, self.token)
+        return swift_client.get_account(self.storage_url, self.token,
+                                        full_listing=True)
 
-    def get_container(self, container, *args):
+    def get_container(self, container, *args, **kwargs):
         return swift_client.get_container(self.storage_url,
                                           self.token,
-                                          container, *args)
+                                          container, *args, **kwargs)
 
-    def get_object(self, container, obj_name, *args):
+    def get_object(self, container, obj_name, *args, **kwargs):
         return swift_client.get_object(self.storage_url,
                                        self.token,
                                        container,
-                                       obj_name, *args)
+                                       obj_name, *args, **kwargs)
 
     def put_object(self,
                    container,
                    obj_name,
                    content=None,
                    content_type=None,
-                   *args):
+                   **kwargs):
         return swift_client.put_object(self.storage_url,
                                        self.token,
                                        container,
                                        obj_name,
                                        content,
-                                       content_type,
-                                       *args)
+                                       content_type=content_type,
+                                       **kwargs)
 
     def put_container(self, container, *args):
         return swift_client.put_container(self.storage_url,
@@ -13,6 +13,10 @@
 # limitations under the License.
 
 
+import hashlib
+import json
+import os
+
 import jsondate
 from cinderclient.v1 import client as cinder_client
 from cloudferrylib.utils import utils as utl
@@ -29,6 +33,68 @@ HOST = 'host'
 IGNORED_TBL_LIST = ('quota_usages')
 
 
+class TableCopyProgress(object):
+    """Primary key of the last row of each table copied to destination, so
+    that interrupted copy of cinder DB resumes after it.
+
+    Progress is stored as JSON file in :state_dir, if :state_dir is empty,
+    it is kept in memory only.
+    """
+
+    def __init__(self, state_dir, src_host, dst_host):
+        self.key = '{src_host}->{dst_host}'.format(src_host=src_host,
+                                                   dst_host=dst_host)
+        self.path = None
+        if state_dir:
+            self.path = os.path.join(
+                state_dir,
+                'cinder_db_' + hashlib.md5(self.key).hexdigest() + '.json')
+        self.tables = {}
+        self.load()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (IOError, ValueError) as e:
+            LOG.warning("Unable to read cinder DB copy progress '%s': %s",
+                        self.path, e)
+            return
+        if state.get('key') == self.key:
+            self.tables = state['tables']
+            LOG.info("Resuming copy of cinder DB tables %s",
+                     ", ".join(sorted(self.tables)))
+
+    def save(self):
+        if self.path is None:
+            return
+        state_dir = os.path.dirname(self.path)
+        if not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': self.key, 'tables': self.tables}, f)
+        os.rename(tmp_path, self.path)
+
+    def get(self, table):
+        """Returns primary key of the last copied row of :table or None."""
+
+        return self.tables.get(table)
+
+    def put(self, table, last_key):
+        self.tables[table] = last_key
+        self.save()
+
+    def remove(self):
+        """Forgets the progress, called once all tables are copied."""
+
+        self.tables = {}
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
 class CinderStorage(cinder_storage.CinderStorage):
 
     """Migration strategy used with NFS backend
@@ -90,11 +156,58 @@ class CinderStorage(cinder_storage.CinderStorage):
 
     def list_of_dicts_for_table(self, table):
         """ Performs SQL query and returns rows as dict """
-        # ignore deleted and errored volumes
         sql = ("SELECT * from {table}").format(table=table)
         query = self.mysql_connector.execute(sql)
         column_names = query.keys()
-        result = [dict(zip(column_names, row)) for row in query]
+        return self._filter_rows(
+            table, column_names,
+            [dict(zip(column_names, row)) for row in query])
+
+    def get_primary_key(self, table):
+        """Returns primary key column of :table, None if the key consists of
+        several columns."""
+
+        query = self.mysql_connector.execute(
+            "SHOW INDEX FROM {table} WHERE Key_name = 'PRIMARY'".format(
+                table=table))
+        columns = [row['Column_name'] for row in query]
+        return columns[0] if len(columns) == 1 else None
+
+    def iter_table(self, table, chunk_size, start_after=None):
+        """Yields (rows, last_key) pages of up to :chunk_size rows of :table
+        ordered by primary key, starting after :start_after key. Rows are
+        filtered the same way as by `list_of_dicts_for_table`, :last_key is
+        primary key of the last row read. Tables without single column
+        primary key are read at once."""
+
+        primary_key = self.get_primary_key(table)
+        if primary_key is None:
+            yield self.list_of_dicts_for_table(table), None
+            return
+        last_key = start_after
+        while True:
+            if last_key is None:
+                query = self.mysql_connector.execute(
+                    "SELECT * FROM {table} ORDER BY {key} "
+                    "LIMIT {limit}".format(table=table, key=primary_key,
+                                           limit=chunk_size))
+            else:
+                query = self.mysql_connector.execute(
+                    "SELECT * FROM {table} WHERE {key} > :last_key "
+                    "ORDER BY {key} LIMIT {limit}".format(
+                        table=table, key=primary_key, limit=chunk_size),
+                    last_key=last_key)
+            column_names = query.keys()
+            rows = [dict(zip(column_names, row)) for row in query]
+            if not rows:
+                return
+            last_key = rows[-1][primary_key]
+            yield self._filter_rows(table, column_names, rows), last_key
+            if len(rows) < chunk_size:
+                return
+
+    def _filter_rows(self, table, column_names, result):
+        # ignore deleted and errored volumes
         self.table = table
         # check if result has "deleted" column
         if DELETED in column_names:
@@ -123,6 +236,31 @@ class CinderStorage(cinder_storage.CinderStorage):
         return jsondate.dumps(
             {i: self.list_of_dicts_for_table(i) for i in self.list_of_tables})
 
+    def copy_tables(self, dst_storage, transform=None, **kwargs):
+        """Copies tables to database of :dst_storage page by page, so that
+        whole database is never kept in memory. Pages of
+        `[migrate] cinder_db_chunk_size` rows are read by primary key and
+        written in a transaction each, after :transform(table, rows) is
+        applied to them. Interrupted copy resumes after the last written
+        page."""
+
+        if kwargs.get('tenant_id'):
+            self.filter_tenant_id = kwargs['tenant_id'][0]
+
+        chunk_size = self.config.migrate.cinder_db_chunk_size
+        progress = TableCopyProgress(
+            self.config.migrate.transfer_manifest_dir,
+            self.mysql_host, dst_storage.mysql_host)
+        for table in self.list_of_tables:
+            for rows, last_key in self.iter_table(table, chunk_size,
+                                                  progress.get(table)):
+                if transform is not None:
+                    transform(table, rows)
+                dst_storage.deploy_data_to_table(table, rows)
+                if last_key is not None:
+                    progress.put(table, last_key)
+        progress.remove()
+
     def get_volume_host(self):
         # cached property
         if not hasattr(self, 'hosts'):
@@ -184,19 +322,36 @@ class CinderStorage(cinder_storage.CinderStorage):
                     unique_entries.append(candidate)
             return unique_entries, duplicated_pk
 
-        def add_to_database(cursor, table, entries):
-            """ insert dict to database """
-            if not entries:
-                return
-            keys = entries[0].keys()
-            query = "INSERT INTO {table} ({keys}) VALUES ({values})".format(
+        def get_existing_data(cursor, table, primary_key, keys):
+            """ get rows of database having the same primary keys """
+            existing_data = []
+            for i in xrange(0, len(keys), chunk_size):
+                chunk = keys[i:i + chunk_size]
+                cursor.execute(
+                    "SELECT * FROM {table} WHERE {key} IN ({values})".format(
+                        table=table, key=primary_key,
+                        values=",".join(["%s" for _ in chunk])),
+                    chunk)
+                existing_data.extend(cursor.fetchall())
+            return existing_data
+
+        def add_to_database(connection, cursor, table, entries):
+            """ insert dict to database, commit each chunk_size entries """
+            for i in xrange(0, len(entries), chunk_size):
+                chunk = entries[i:i + chunk_size]
+                keys = chunk[0].keys()
+                query = ("INSERT INTO {table} ({keys}) "
+                         "VALUES ({values})").format(
                     keys=",".join(keys),
                     table=table,
                     values=",".join(["%s" for _ in keys]))
 
-            LOG.debug(query)
-            cursor.executemany(query, [i.values() for i in entries])
+                LOG.debug(query)
+                cursor.executemany(query, [[e[k] for k in keys]
+                                           for e in chunk])
+                connection.commit()
 
+        chunk_size = self.config.migrate.cinder_db_chunk_size
         # create raw connection to db driver to get the most awesome features
         self.fix_entries(table_list_of_dicts, table_name)
         sql_engine = self.mysql_connector.get_engine()
@@ -204,15 +359,16 @@ class CinderStorage(cinder_storage.CinderStorage):
         cursor = connection.cursor(dictionary=True)
         primary_key, auto_increment = get_key_and_auto_increment(
             cursor, table_name)
-        data_in_database = self.list_of_dicts_for_table(table_name)
+        data_in_database = get_existing_data(
+            cursor, table_name, primary_key,
+            [i[primary_key] for i in table_list_of_dicts])
         unique_entries, duplicated_pk = filter_data(data_in_database,
                                                     table_list_of_dicts,
                                                     primary_key,
                                                     auto_increment)
-        add_to_database(cursor, table_name, unique_entries)
-        add_to_database(cursor, table_name, duplicated_pk)
+        add_to_database(connection, cursor, table_name, unique_entries)
+        add_to_database(connection, cursor, table_name, duplicated_pk)
         cursor.close()
-        connection.commit()
         connection.close()
 
     def fix_entries(self, table_list_of_dicts, table_name):
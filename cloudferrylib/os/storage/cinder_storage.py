@@ -43,7 +43,12 @@ class CinderStorage(storage.Storage):
 
     @property
     def cinder_client(self):
-        return self.proxy(self.get_client(self.config), self.config)
+        return self.proxy(
+            self.cloud.clients.get('volume',
+                                   self.config.cloud.tenant,
+                                   self.config.cloud.user,
+                                   self.get_client),
+            self.config)
 
     def get_client(self, params=None):
 
@@ -61,8 +66,15 @@ class CinderStorage(storage.Storage):
         )
 
     def read_info(self, **kwargs):
+        """Reads info of volumes matching search options :kwargs, all
+        volumes with one of IDs listed in optional `ids` argument are read
+        with one list request."""
+
         info = {utl.VOLUMES_TYPE: {}}
+        ids = kwargs.pop('ids', None)
         for vol in self.get_volumes_list(search_opts=kwargs):
+            if ids is not None and vol.id not in ids:
+                continue
             volume = self.convert_volume(vol, self.config, self.cloud)
             snapshots = {}
             if self.config.migrate.keep_volume_snapshots:
@@ -167,15 +179,27 @@ class CinderStorage(storage.Storage):
     def get_status(self, resource_id):
         return self.cinder_client.volumes.get(resource_id).status
 
+    def get_statuses(self, res_ids):
+        """Gets statuses of many volumes with one volumes list request."""
+
+        if len(res_ids) < 2:
+            return super(CinderStorage, self).get_statuses(res_ids)
+        statuses = {volume.id: volume.status
+                    for volume in self.get_volumes_list(search_opts={})}
+        return {res_id: (statuses[res_id] if res_id in statuses
+                         else self.get_status(res_id))
+                for res_id in res_ids}
+
     def deploy_volumes(self, info):
         new_ids = {}
         for vol_id, vol in info[utl.VOLUMES_TYPE].iteritems():
             vol_for_deploy = self.convert_to_params(vol)
             volume = self.create_volume(**vol_for_deploy)
             vol[utl.VOLUME_BODY]['id'] = volume.id
-            self.try_wait_for_status(volume.id, self.get_status, AVAILABLE)
-            self.finish(vol)
             new_ids[volume.id] = vol_id
+        self.try_wait_for_statuses(new_ids.keys(), AVAILABLE)
+        for vol in info[utl.VOLUMES_TYPE].itervalues():
+            self.finish(vol)
         return new_ids
 
     def deploy_volumes_db(self, info):
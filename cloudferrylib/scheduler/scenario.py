@@ -84,7 +84,12 @@ class Scenario(object):
             elem = tasks[name] if name in tasks else None
             if isinstance(value, list):
                 if isinstance(value[0], dict):
-                    elem = self.construct_net(value, tasks)
+                    sub_net = self.construct_net(value, tasks)
+                    if hasattr(elem, 'set_net'):
+                        # task processes nested chain by itself
+                        elem.set_net(sub_net)
+                    else:
+                        elem = sub_net
                 else:
                     for task in value:
                         tasks[name] = tasks[name] | tasks[task]
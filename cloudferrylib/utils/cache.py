@@ -13,71 +13,119 @@
 # limitations under the License.
 
 import collections
-import functools
+import threading
+import time
 
 
-class Memoized(object):
-    """Decorator. Caches a function's return value each time it is called.
-   If called later with the same arguments, the cached value is returned
-   (not reevaluated).
+class IdentityMap(object):
+    """Objects having `id` and `name` attributes (e.g. Keystone tenants),
+    loaded in bulk and indexed by both.
 
-   Does not support key-value arguments.
+    Objects are loaded with :load on first access and loaded again once they
+    are older than :ttl seconds (0 - never) or after `invalidate`. Objects
+    created, updated or deleted by the caller are put into or removed from
+    the map with `add` and `remove`, so that it doesn't need to be reloaded.
 
-   Taken from https://wiki.python.org/moin/PythonDecoratorLibrary#Memoize
-   """
-
-    def __init__(self, func):
-        self.func = func
-        self.cache = {}
-
-    def __call__(self, *args):
-        if not isinstance(args, collections.Hashable):
-            # uncacheable. a list, for instance.
-            # better to not cache than blow up.
-            return self.func(*args)
-        if args in self.cache:
-            return self.cache[args]
-        else:
-            value = self.func(*args)
-            self.cache[args] = value
-            return value
-
-    def reset(self):
-        self.cache = {}
-
-    def __repr__(self):
-        """Return the function's docstring."""
-        return self.func.__doc__
-
-    def __get__(self, obj, objtype):
-        """Support instance methods."""
-        return functools.partial(self.__call__, obj)
-
-
-class Cached(object):
-    """Property. Modifies class methods at runtime by caching results.
-
-    `getter` - cached method;
-    `modifier` - method which modifies cached values. Calling this method
-    resets cache.
+    Object missing in the map is read with :fetch (by ID) or :fetch_by_name,
+    which return None if there is no such object, and added to the map.
+    Objects which are not found are not read again until the map is
+    reloaded.
     """
 
-    def __init__(self, getter, modifier):
-        self.getter = getter
-        self.modifier = modifier
-        self.cacher = None
-
-    def __call__(self, cls):
-        getter = getattr(cls, self.getter)
-        cached_getter = Memoized(getter)
-        setattr(cls, self.getter, cached_getter)
-
-        modifier = getattr(cls, self.modifier)
-
-        def mod(*args, **kwargs):
-            cached_getter.reset()
-            return modifier(*args, **kwargs)
-
-        setattr(cls, self.modifier, mod)
-
-        return cls
+    def __init__(self, load, ttl=0, fetch=None, fetch_by_name=None):
+        self.load = load
+        self.ttl = ttl
+        self.fetch = fetch
+        self.fetch_by_name = fetch_by_name
+        self.lock = threading.RLock()
+        self.loaded_at = None
+        self.by_id = collections.OrderedDict()
+        self.by_name = {}
+        self.misses = set()
+        # changes whenever contents of the map change, so that values
+        # derived from it can be cached
+        self.generation = 0
+
+    def _ensure_loaded(self):
+        if self.loaded_at is not None and (
+                not self.ttl or time.time() - self.loaded_at < self.ttl):
+            return
+        objects = self.load()
+        self.by_id = collections.OrderedDict()
+        self.by_name = {}
+        self.misses = set()
+        self.loaded_at = time.time()
+        for obj in objects:
+            self._index(obj)
+        self.generation += 1
+
+    def _index(self, obj):
+        self._unindex(obj.id)
+        self.by_id[obj.id] = obj
+        self.by_name.setdefault(obj.name, obj)
+
+    def _unindex(self, obj_id):
+        obj = self.by_id.pop(obj_id, None)
+        if obj is not None and self.by_name.get(obj.name) is obj:
+            del self.by_name[obj.name]
+            for other in self.by_id.itervalues():
+                if other.name == obj.name:
+                    self.by_name[obj.name] = other
+                    break
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = None
+            self.generation += 1
+
+    def add(self, obj):
+        with self.lock:
+            if self.loaded_at is not None:
+                self._index(obj)
+                self.generation += 1
+
+    def remove(self, obj_id):
+        with self.lock:
+            if self.loaded_at is not None:
+                self._unindex(obj_id)
+                self.generation += 1
+
+    def _fetch(self, fetch, key):
+        if fetch is None:
+            return None
+        with self.lock:
+            if key in self.misses:
+                return None
+            generation = self.generation
+        obj = fetch(key[1])
+        with self.lock:
+            if obj is not None:
+                self.add(obj)
+            elif generation == self.generation:
+                self.misses.add(key)
+        return obj
+
+    def list(self):
+        with self.lock:
+            self._ensure_loaded()
+            return self.by_id.values()
+
+    def get(self, obj_id):
+        """Returns object by ID or None."""
+
+        with self.lock:
+            self._ensure_loaded()
+            obj = self.by_id.get(obj_id)
+        if obj is None:
+            obj = self._fetch(self.fetch, ('id', obj_id))
+        return obj
+
+    def find(self, name):
+        """Returns object by name or None."""
+
+        with self.lock:
+            self._ensure_loaded()
+            obj = self.by_name.get(name)
+        if obj is None:
+            obj = self._fetch(self.fetch_by_name, ('name', name))
+        return obj
@@ -25,10 +25,28 @@ grep_cmd = BC("grep %s")
 rbd_cmd = BC("rbd %s")
 base_ssh_cmd = BC("ssh %s")
 ssh_cmd = base_ssh_cmd("-oStrictHostKeyChecking=no %s '%s'")
+ssh_mux_cmd = base_ssh_cmd("-oStrictHostKeyChecking=no -oControlMaster=auto "
+                           "-oControlPath=%s -oControlPersist=%s %s '%s'")
 ssh_cmd_port = base_ssh_cmd("-oStrictHostKeyChecking=no -p %s %s '%s'")
 dd_cmd_of = BC("dd bs=%s of=%s")
 dd_cmd_if = BC("dd bs=%s if=%s")
 dd_full = BC('dd if=%s of=%s bs=%s count=%s seek=%sM')
+dd_cmd_if_range = BC("dd bs=%s if=%s skip=%s count=%s")
+dd_cmd_of_range = BC("dd bs=%s of=%s seek=%s conv=notrunc")
+dd_cmd_of_range_sparse = BC("dd bs=%s of=%s seek=%s conv=notrunc,sparse")
+md5sum_cmd = BC("md5sum")
+block_md5_cmd = BC("if [ -e %s ]; then dd bs=1M if=%s 2>/dev/null | "
+                   "head -c %s | split -b %s --filter=md5sum; fi")
+truncate_cmd = BC("truncate -s %s %s")
+# block devices can't be truncated, their size is left as is
+truncate_file_cmd = BC("if [ ! -e %s ] || [ -f %s ]; then truncate -s %s %s; "
+                       "fi")
+stat_size_cmd = BC("stat --printf=%%s %s")
+# stat reports 0 as size of block device
+file_size_cmd = BC("if [ -b %s ]; then blockdev --getsize64 %s; "
+                   "else stat --printf=%%s %s; fi")
+head_bytes_cmd = BC("head -c %s")
+stat_mtime_cmd = BC("stat --printf=%%Y %s")
 gunzip_cmd = BC("gunzip")
 gzip_cmd = BC("gzip -%s -c %s")
 scp_cmd = BC('scp -o StrictHostKeyChecking=no %s %s@%s:%s %s')
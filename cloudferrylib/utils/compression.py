@@ -0,0 +1,233 @@
+# Copyright 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compression of data streamed between hosts by SSH data drivers.
+
+Codec is selected with `[migrate] file_compression` option, `dd` means no
+compression. With `auto` codec is chosen for every transfer by compressing a
+sample of the data on source host with each codec installed on both hosts
+and comparing compression throughput and ratio with the bandwidth measured
+by sending the same sample to destination host. Codec chosen for a pair of
+hosts is reused for the following transfers between them.
+
+`[migrate] level_compression` is clamped into the range of levels supported
+by the codec, codec's own default level is used if it is not set.
+"""
+
+import threading
+import time
+
+from cloudferrylib.utils import cmd_cfg
+from cloudferrylib.utils.console_cmd import BC
+from cloudferrylib.utils import utils
+
+
+LOG = utils.get_log(__name__)
+
+NONE = 'dd'
+AUTO = 'auto'
+
+# size of the sample in MB used to choose codec
+SAMPLE_SIZE = 64
+# data smaller than this number of MB is not sampled
+MIN_SAMPLED_SIZE = 4 * SAMPLE_SIZE
+
+which_cmd = BC("which %s; true")
+wc_cmd = BC("wc -c")
+discard_cmd = BC("cat > /dev/null")
+
+
+class Codec(object):
+    def __init__(self, name, compress=None, decompress=None, extension='',
+                 levels=(1, 9), default_level=6):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+        self.extension = extension
+        self.levels = levels
+        self.default_level = default_level
+
+    @property
+    def binary(self):
+        return self.compress.split(' ')[0] if self.compress else None
+
+    def level(self, level):
+        """Returns :level clamped into the levels supported by the codec,
+        default level of the codec if :level is None."""
+
+        if level is None:
+            return self.default_level
+        return min(max(int(level), self.levels[0]), self.levels[1])
+
+    def compress_cmd(self, level):
+        return BC(self.compress.format(level=self.level(level)))
+
+    def decompress_cmd(self):
+        return BC(self.decompress)
+
+    def pipe_compress(self, cmd, level):
+        """Appends compression to the command writing data to stdout."""
+
+        if self.compress is None:
+            return cmd
+        return cmd >> self.compress_cmd(level)
+
+    def pipe_decompress(self, cmd):
+        """Prepends decompression to the command reading data from stdin."""
+
+        if self.decompress is None:
+            return cmd
+        return self.decompress_cmd() >> cmd
+
+    def __repr__(self):
+        return 'Codec(%s)' % self.name
+
+
+CODECS = dict((codec.name, codec) for codec in [
+    Codec(NONE),
+    Codec('gzip', 'gzip -{level} -c', 'gzip -d -c', '.gz'),
+    Codec('pigz', 'pigz -{level} -c', 'pigz -d -c', '.gz'),
+    Codec('lz4', 'lz4 -{level} -c', 'lz4 -d -c', '.lz4', default_level=1),
+    Codec('zstd', 'zstd -{level} -T0 -c', 'zstd -d -c', '.zst',
+          levels=(1, 19), default_level=3),
+    Codec('xz', 'xz -{level} -T0 -c', 'xz -d -c', '.xz', levels=(0, 9)),
+])
+
+# codecs chosen with `auto` by (source host, destination host)
+_selected = {}
+_selected_lock = threading.Lock()
+
+
+def get_codec(name):
+    if name not in CODECS:
+        raise ValueError("Unknown compression codec '%s', use one of: %s" %
+                         (name, ', '.join(sorted(CODECS.keys() + [AUTO]))))
+    return CODECS[name]
+
+
+def configured_codec(cfg):
+    """Returns codec configured with `[migrate] file_compression` for the
+    transfers where sample of data can not be taken, `auto` means gzip."""
+
+    name = cfg.file_compression
+    return get_codec('gzip' if name == AUTO else name)
+
+
+def available_codecs(run):
+    """Returns names of codecs which binaries are installed on the host
+    commands are executed on with :run."""
+
+    binaries = set(codec.binary for codec in CODECS.values()
+                   if codec.binary)
+    output = str(run(which_cmd(' '.join(sorted(binaries)))))
+    found = set(line.strip().split('/')[-1] for line in output.splitlines())
+    return set(name for name, codec in CODECS.items()
+               if codec.binary is None or codec.binary in found)
+
+
+def file_sample_cmd(path, size):
+    """Command reading sample from the middle of file of :size bytes."""
+
+    skip = max(size / (1024 * 1024) / 2 - SAMPLE_SIZE / 2, 0)
+    return cmd_cfg.dd_cmd_if_range('1M', path, skip, SAMPLE_SIZE)
+
+
+def rbd_sample_cmd(path):
+    return (cmd_cfg.rbd_cmd('export %s -')(path) >>
+            BC('head -c %dM' % SAMPLE_SIZE))
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, max(time.time() - start, 0.001)
+
+
+def select_codec(cfg, sample, run_on_src, run_on_dst, send_to_dst,
+                 hosts=None, size=None):
+    """Returns codec configured with `[migrate] file_compression`.
+
+    If it is `auto`, data produced by command returned by :sample on source
+    host is
+    compressed with every codec available on both hosts and sent to
+    destination host with :send_to_dst, which takes command producing data
+    on source host and command consuming it on destination host. Codec
+    giving the highest throughput is returned.
+
+    Codec is chosen once for :hosts, (source host, destination host) pair.
+    Data of :size bytes smaller than MIN_SAMPLED_SIZE is not sampled, gzip
+    is used for it unless codec is already chosen for :hosts.
+    """
+
+    name = cfg.file_compression
+    if name != AUTO:
+        return get_codec(name)
+
+    if hosts is not None:
+        with _selected_lock:
+            if hosts in _selected:
+                return _selected[hosts]
+    if size is not None and size < MIN_SAMPLED_SIZE * 1024 * 1024:
+        return configured_codec(cfg)
+
+    best = _sample_codecs(cfg, sample, run_on_src, run_on_dst, send_to_dst)
+    if best is None:
+        # nothing to sample, so the choice is not kept for the hosts
+        return get_codec(NONE)
+    if hosts is not None:
+        with _selected_lock:
+            _selected[hosts] = best
+    return best
+
+
+def select_file_codec(cfg, path, run_on_src, run_on_dst, send_to_dst,
+                      hosts=None, size=None):
+    """select_codec for the file at :path on source host, its size is read
+    with stat unless it is given with :size."""
+
+    if size is None and cfg.file_compression == AUTO:
+        size = int(str(run_on_src(cmd_cfg.stat_size_cmd(path))).strip())
+    return select_codec(cfg, lambda: file_sample_cmd(path, size), run_on_src,
+                        run_on_dst, send_to_dst, hosts=hosts, size=size)
+
+
+def _sample_codecs(cfg, sample, run_on_src, run_on_dst, send_to_dst):
+    names = available_codecs(run_on_src) & available_codecs(run_on_dst)
+    sample_cmd = sample()
+    size, read_time = timed(run_on_src, sample_cmd >> wc_cmd)
+    size = int(str(size).strip() or 0)
+    if size == 0:
+        return None
+    sample_mb = float(size) / (1024 * 1024)
+
+    _, send_time = timed(send_to_dst, sample_cmd, discard_cmd)
+    bandwidth = sample_mb / send_time
+
+    best, best_speed = get_codec(NONE), bandwidth
+    for name in sorted(names - set([NONE])):
+        codec = CODECS[name]
+        compressed, compress_time = timed(
+            run_on_src,
+            codec.pipe_compress(sample_cmd, cfg.level_compression) >> wc_cmd)
+        ratio = float(size) / max(int(str(compressed).strip() or 0), 1)
+        compress_speed = sample_mb / max(compress_time - read_time, 0.001)
+        speed = min(compress_speed, bandwidth * ratio)
+        LOG.debug("Codec '%s': ratio %.1f, compression %.1f MB/s, "
+                  "effective %.1f MB/s", name, ratio, compress_speed, speed)
+        if speed > best_speed:
+            best, best_speed = codec, speed
+
+    LOG.info("Using '%s' compression, link bandwidth %.1f MB/s, expected "
+             "throughput %.1f MB/s", best.name, bandwidth, best_speed)
+    return best
@@ -17,6 +17,7 @@ from fabric.api import env
 from fabric.api import settings
 
 from cloudferrylib.utils import cmd_cfg
+from cloudferrylib.utils import compression
 from cloudferrylib.utils import driver_transporter
 from cloudferrylib.utils import rbd_util
 from cloudferrylib.utils import utils
@@ -36,9 +37,6 @@ class SSHCephToCeph(driver_transporter.DriverTransporter):
               utils.forward_agent(env.key_filename)):
 
             rbd_import_diff = rbd_util.RbdUtil.rbd_import_diff_cmd
-            ssh_cmd = cmd_cfg.ssh_cmd
-            ssh_rbd_import_diff = ssh_cmd(host_dst, rbd_import_diff)
-
             if snapshot:
                 process_params = [snapshot['name'], data['path_src'], '-', '-',
                                   data['path_dst']]
@@ -57,7 +55,23 @@ class SSHCephToCeph(driver_transporter.DriverTransporter):
                 rbd_export_diff = rbd_util.RbdUtil.rbd_export_diff_cmd
                 process_params = [data['path_src'], '-', '-', data['path_dst']]
 
-            process = rbd_export_diff >> ssh_rbd_import_diff
-            process = process(*process_params)
+            # the last two parameters belong to import-diff
+            rbd_export_diff = rbd_export_diff(*process_params[:-2])
+            rbd_import_diff = rbd_import_diff(*process_params[-2:])
+
+            def send_to_dst(src_cmd, dst_cmd):
+                process = src_cmd >> cmd_cfg.ssh_cmd(host_dst, dst_cmd)
+                self.src_cloud.ssh_util.execute(process)
+
+            codec = compression.select_codec(
+                self.cfg.migrate,
+                lambda: compression.rbd_sample_cmd(data['path_src']),
+                self.src_cloud.ssh_util.execute,
+                lambda cmd: self.src_cloud.ssh_util.execute(
+                    cmd_cfg.ssh_cmd(host_dst, cmd)),
+                send_to_dst, hosts=(host_src, host_dst))
 
-            self.src_cloud.ssh_util.execute(process)
+            send_to_dst(
+                codec.pipe_compress(rbd_export_diff,
+                                    self.cfg.migrate.level_compression),
+                codec.pipe_decompress(rbd_import_diff))
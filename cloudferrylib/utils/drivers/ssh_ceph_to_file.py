@@ -16,6 +16,7 @@
 from fabric.api import env
 
 from cloudferrylib.utils import cmd_cfg
+from cloudferrylib.utils import compression
 from cloudferrylib.utils import driver_transporter
 from cloudferrylib.utils import rbd_util
 from cloudferrylib.utils import utils
@@ -30,14 +31,23 @@ class SSHCephToFile(driver_transporter.DriverTransporter):
         ssh_ip_dst = self.dst_cloud.getIpSsh()
         with utils.forward_agent(env.key_filename), utils.up_ssh_tunnel(
                 data['host_dst'], ssh_ip_dst, ssh_ip_src) as port:
-            dd = cmd_cfg.dd_cmd_of
-            ssh_cmd = cmd_cfg.ssh_cmd_port
-            rbd_export = rbd_util.RbdUtil.rbd_export_cmd
-
-            ssh_dd = ssh_cmd(port, 'localhost', dd)
-
-            process = rbd_export >> ssh_dd
-            process = process(data['path_src'], '-', '1M',
-                              data['path_dst'])
-
-            self.src_cloud.ssh_util.execute(process)
+            rbd_export = rbd_util.RbdUtil.rbd_export_cmd(data['path_src'], '-')
+            dd = cmd_cfg.dd_cmd_of('1M', data['path_dst'])
+
+            def send_to_dst(src_cmd, dst_cmd):
+                process = src_cmd >> cmd_cfg.ssh_cmd_port(port, 'localhost',
+                                                          dst_cmd)
+                self.src_cloud.ssh_util.execute(process)
+
+            codec = compression.select_codec(
+                self.cfg.migrate,
+                lambda: compression.rbd_sample_cmd(data['path_src']),
+                self.src_cloud.ssh_util.execute,
+                lambda cmd: self.dst_cloud.ssh_util.execute(
+                    cmd, internal_host=data['host_dst']),
+                send_to_dst, hosts=(ssh_ip_src, data['host_dst']))
+
+            send_to_dst(
+                codec.pipe_compress(rbd_export,
+                                    self.cfg.migrate.level_compression),
+                codec.pipe_decompress(dd))
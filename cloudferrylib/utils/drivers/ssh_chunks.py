@@ -13,12 +13,18 @@
 # limitations under the License.
 
 
-import os
+import hashlib
 import math
+import os
+from multiprocessing import pool
 
+from cloudferrylib.utils import cmd_cfg
+from cloudferrylib.utils import compression
 from cloudferrylib.utils import driver_transporter
 from cloudferrylib.utils import files
 from cloudferrylib.utils import remote_runner
+from cloudferrylib.utils import sparse
+from cloudferrylib.utils import transfer_manifest
 from cloudferrylib.utils import utils
 
 
@@ -33,8 +39,8 @@ def remote_file_size(runner, path):
     return int(runner.run('stat --printf="%s" {path}'.format(path=path)))
 
 
-def remote_file_size_mb(runner, path):
-    return int(math.ceil(remote_file_size(runner, path) / (1024.0 * 1024.0)))
+def remote_file_mtime(runner, path):
+    return int(runner.run('stat --printf="%Y" {path}'.format(path=path)))
 
 
 def remote_md5_sum(runner, path):
@@ -43,11 +49,19 @@ def remote_md5_sum(runner, path):
     return md5.split(' ')[0]
 
 
-def remote_gzip(runner, path):
-    gzip_file = "gzip -f {split}".format(split=path)
-    runner.run(gzip_file)
-    zipped_file_name = path + ".gz"
-    return zipped_file_name
+def remote_compress(runner, path, codec, level):
+    """Compresses :path with :codec replacing the file, returns path of the
+    compressed file."""
+
+    if codec.compress is None:
+        return path
+    compressed_path = path + codec.extension
+    compress = "{compress} < {file} > {compressed} && rm -f {file}".format(
+        compress=codec.compress_cmd(level),
+        file=path,
+        compressed=compressed_path)
+    runner.run(compress)
+    return compressed_path
 
 
 def remote_scp(runner, dst_user, src_path, dst_host, dst_path):
@@ -91,27 +105,41 @@ def verified_file_copy(src_runner, dst_runner, dst_user, src_path, dst_path,
                               src_path, dst_host)
 
 
-def remote_split_file(runner, input, output, start, block_size):
-    split_file = ('dd if={input} of={output} skip={start} bs={block_size}M '
-                  'count=1').format(input=input,
-                                    output=output,
-                                    block_size=block_size,
-                                    start=start)
-    runner.run(split_file)
+def remote_split_file_md5(runner, input, output, start, block_size):
+    """Cuts chunk :start of :input into :output and returns MD5 of the chunk
+    computed from the same read."""
 
+    split_file = ('dd if={input} skip={start} bs={block_size}M count=1 | '
+                  'tee {output} | md5sum').format(input=input,
+                                                  output=output,
+                                                  block_size=block_size,
+                                                  start=start)
+    md5 = str(runner.run(split_file))
+    return md5.split(' ')[0]
 
-def remote_unzip(runner, path):
-    unzip = "gzip -f -d {file}".format(file=path)
-    runner.run(unzip)
 
+def remote_decompress_join_file(runner, dest_file, part, start, block_size,
+                                codec):
+    """Unpacks :part directly into chunk :start of :dest_file keeping the
+    rest of the file, so chunks may be joined in any order."""
 
-def remote_join_file(runner, dest_file, part, start, block_size):
-    join = ("dd if={part} of={dest} seek={start} bs={block_size}M "
-            "count=1").format(part=part,
-                              dest=dest_file,
-                              start=start,
-                              block_size=block_size)
-    runner.run(join)
+    join = codec.pipe_decompress(cmd_cfg.dd_cmd_of_range(
+        '{block_size}M'.format(block_size=block_size), dest_file, start))
+    runner.run("cat {part} | {join}".format(part=part, join=join))
+
+
+def remote_chunk_md5_sum(runner, path, start, block_size):
+    get_md5 = ("dd if={file} skip={start} bs={block_size}M count=1 | "
+               "md5sum").format(file=path,
+                                start=start,
+                                block_size=block_size)
+    md5 = str(runner.run(get_md5))
+    return md5.split(' ')[0]
+
+
+def remote_truncate(runner, path, size):
+    truncate = "truncate -s {size} {file}".format(size=size, file=path)
+    runner.run(truncate)
 
 
 def remote_rm_file(runner, path):
@@ -119,8 +147,28 @@ def remote_rm_file(runner, path):
     runner.run(rm)
 
 
+def combined_md5(chunk_md5s):
+    """Checksum of the whole file built from checksums of its chunks."""
+
+    return hashlib.md5(''.join(chunk_md5s)).hexdigest()
+
+
 class CopyFilesBetweenComputeHosts(driver_transporter.DriverTransporter):
-    """Copies file splitting it into gzipped chunks.
+    """Copies file splitting it into compressed chunks.
+
+    Up to `migrate.ssh_chunks_in_flight` chunks are split, compressed, copied
+    and joined into destination file simultaneously, temporary files of a
+    chunk are removed as soon as the chunk is joined. Each chunk is verified
+    with MD5 after it is joined, checksum of the whole file is combined from
+    the checksums of chunks, so files are not read once more to verify them.
+
+    With `migrate.sparse_file_transfer` chunks which are not allocated are
+    not copied, they are left as holes on destination.
+
+    Verified chunks are recorded in transfer manifest, see
+    `transfer_manifest.TransferManifest`. If transfer of the same unchanged
+    file is restarted, chunks which are still intact on destination are not
+    copied again.
 
     If one chunk failed to copy, retries until succeeds or retry limit reached
     """
@@ -131,59 +179,181 @@ class CopyFilesBetweenComputeHosts(driver_transporter.DriverTransporter):
         dst_host = data['host_dst']
         dst_path = data['path_dst']
 
-        src_user = self.cfg.src.ssh_user
-        dst_user = self.cfg.dst.ssh_user
         block_size = self.cfg.migrate.ssh_chunk_size
-        num_retries = self.cfg.migrate.retry
-        src_password = self.cfg.src.ssh_sudo_password
-        dst_password = self.cfg.dst.ssh_sudo_password
+        in_flight = max(self.cfg.migrate.ssh_chunks_in_flight, 1)
 
-        src_runner = remote_runner.RemoteRunner(src_host,
-                                                src_user,
-                                                password=src_password,
-                                                sudo=True)
-        dst_runner = remote_runner.RemoteRunner(dst_host,
-                                                dst_user,
-                                                password=dst_password,
-                                                sudo=True)
+        src_runner = self.src_runner(src_host)
+        dst_runner = self.dst_runner(dst_host)
 
-        file_size = remote_file_size_mb(src_runner, src_path)
+        file_size = remote_file_size(src_runner, src_path)
+        num_blocks = int(math.ceil(
+            float(file_size) / (block_size * 1024 * 1024)))
 
-        with files.RemoteTempDir(src_runner) as src_temp_dir,\
-                files.RemoteTempDir(dst_runner) as dst_temp_dir:
-            partial_files = []
+        manifest = transfer_manifest.TransferManifest(
+            self.cfg.migrate.transfer_manifest_dir,
+            src_host, src_path, dst_host, dst_path,
+            size=file_size,
+            mtime=remote_file_mtime(src_runner, src_path),
+            chunk_size=block_size)
 
-            src_md5 = remote_md5_sum(src_runner, src_path)
+        codec = self.select_codec(data, src_runner, dst_runner, file_size)
 
-            num_blocks = int(math.ceil(float(file_size) / block_size))
+        holes = set()
+        if self.cfg.migrate.sparse_file_transfer:
+            holes = self.hole_chunks(src_runner, src_path, file_size)
+            # holes are kept on destination, so it must have the same size
+            remote_truncate(dst_runner, dst_path, file_size)
 
-            for i in xrange(num_blocks):
-                part = os.path.basename(src_path) + '.part{i}'.format(i=i)
-                part_path = os.path.join(src_temp_dir, part)
-                remote_split_file(src_runner, src_path, part_path, i,
-                                  block_size)
-                gzipped_path = remote_gzip(src_runner, part_path)
-                gzipped_filename = os.path.basename(gzipped_path)
-                dst_gzipped_path = os.path.join(dst_temp_dir, gzipped_filename)
-
-                verified_file_copy(src_runner, dst_runner, dst_user,
-                                   gzipped_path, dst_gzipped_path, dst_host,
-                                   num_retries)
-
-                remote_unzip(dst_runner, dst_gzipped_path)
-                partial_files.append(os.path.join(dst_temp_dir, part))
-
-            for i in xrange(num_blocks):
-                remote_join_file(dst_runner, dst_path, partial_files[i], i,
-                                 block_size)
-
-            dst_md5 = remote_md5_sum(dst_runner, dst_path)
+        with files.RemoteTempDir(src_runner) as src_temp_dir,\
+                files.RemoteTempDir(dst_runner) as dst_temp_dir:
 
-            if src_md5 != dst_md5:
+            def copy_chunk(i):
+                md5 = manifest.get(i)
+                if md5 is not None:
+                    dst_md5 = remote_chunk_md5_sum(self.dst_runner(dst_host),
+                                                   dst_path, i, block_size)
+                    if dst_md5 == md5:
+                        LOG.debug("Chunk %d of '%s' is already copied",
+                                  i, src_path)
+                        return md5, dst_md5
+                    manifest.discard(i)
+
+                if i in holes:
+                    md5 = sparse.zero_md5(
+                        min(block_size * sparse.MB,
+                            file_size - i * block_size * sparse.MB))
+                    dst_md5 = remote_chunk_md5_sum(self.dst_runner(dst_host),
+                                                   dst_path, i, block_size)
+                    if dst_md5 == md5:
+                        return md5, dst_md5
+
+                src_md5, dst_md5 = self.transfer_chunk(data, i, src_temp_dir,
+                                                       dst_temp_dir, codec)
+                if src_md5 == dst_md5:
+                    manifest.put(i, src_md5)
+                return src_md5, dst_md5
+
+            if in_flight > 1 and num_blocks > 1:
+                # runners of the chunks use fabric settings concurrently
+                with utils.thread_local_fabric_env():
+                    workers = pool.ThreadPool(min(in_flight, num_blocks))
+                    try:
+                        checksums = workers.map(copy_chunk,
+                                                xrange(num_blocks))
+                    finally:
+                        workers.close()
+                        workers.join()
+            else:
+                checksums = [copy_chunk(i) for i in xrange(num_blocks)]
+
+            # chunks are written in place, so remains of previously existing
+            # destination file must be cut off
+            remote_truncate(dst_runner, dst_path, file_size)
+
+            src_md5 = combined_md5(src for src, _ in checksums)
+            dst_md5 = combined_md5(dst for _, dst in checksums)
+            LOG.debug("Combined MD5 of '%s': source '%s', destination '%s'",
+                      src_path, src_md5, dst_md5)
+
+            if (src_md5 != dst_md5 or
+                    remote_file_size(dst_runner, dst_path) != file_size):
                 message = ("Error copying file from '{src_host}:{src_file}' "
                            "to '{dst_host}:{dst_file}'").format(
                     src_file=src_path, src_host=src_host, dst_file=dst_path,
                     dst_host=dst_host)
                 LOG.error(message)
                 remote_rm_file(dst_runner, dst_path)
+                manifest.remove()
                 raise FileCopyFailure(message)
+
+            manifest.remove()
+
+    def hole_chunks(self, runner, path, file_size):
+        """Returns numbers of chunks of the file which are not allocated."""
+
+        block_size = self.cfg.migrate.ssh_chunk_size * sparse.MB
+        num_blocks = int(math.ceil(float(file_size) / block_size))
+        extents = sparse.remote_data_extents(runner.run, path)
+        if extents is None:
+            return set()
+        allocated = set()
+        for first, count in sparse.align_extents(extents, block_size):
+            allocated.update(xrange(first, first + count))
+        holes = set(xrange(num_blocks)) - allocated
+        LOG.info("%d of %d chunks of '%s' are not allocated",
+                 len(holes), num_blocks, path)
+        return holes
+
+    def select_codec(self, data, src_runner, dst_runner, file_size):
+        def send_to_dst(src_cmd, dst_cmd):
+            dst = '{user}@{host}'.format(user=self.cfg.dst.ssh_user,
+                                         host=data['host_dst'])
+            src_runner.run(str(src_cmd >> cmd_cfg.ssh_cmd(dst, dst_cmd)))
+
+        return compression.select_file_codec(
+            self.cfg.migrate, data['path_src'],
+            lambda cmd: src_runner.run(str(cmd)),
+            lambda cmd: dst_runner.run(str(cmd)),
+            send_to_dst, hosts=(data['host_src'], data['host_dst']),
+            size=file_size)
+
+    def src_runner(self, host):
+        return remote_runner.RemoteRunner(
+            host, self.cfg.src.ssh_user,
+            password=self.cfg.src.ssh_sudo_password, sudo=True)
+
+    def dst_runner(self, host):
+        return remote_runner.RemoteRunner(
+            host, self.cfg.dst.ssh_user,
+            password=self.cfg.dst.ssh_sudo_password, sudo=True)
+
+    def transfer_chunk(self, data, i, src_temp_dir, dst_temp_dir, codec):
+        """Copies chunk :i of the file and joins it into destination file.
+
+        Returns MD5 of the chunk on source and destination.
+        """
+
+        src_path = data['path_src']
+        dst_host = data['host_dst']
+        dst_path = data['path_dst']
+        dst_user = self.cfg.dst.ssh_user
+        block_size = self.cfg.migrate.ssh_chunk_size
+        num_retries = self.cfg.migrate.retry
+
+        # runners are not shared between threads since they keep state
+        src_runner = self.src_runner(data['host_src'])
+        dst_runner = self.dst_runner(dst_host)
+
+        part = os.path.basename(src_path) + '.part{i}'.format(i=i)
+        part_path = os.path.join(src_temp_dir, part)
+
+        attempt = 0
+        while True:
+            attempt += 1
+            src_md5 = remote_split_file_md5(src_runner, src_path, part_path,
+                                            i, block_size)
+            packed_path = remote_compress(src_runner, part_path, codec,
+                                          self.cfg.migrate.level_compression)
+            dst_packed_path = os.path.join(dst_temp_dir,
+                                           os.path.basename(packed_path))
+            try:
+                verified_file_copy(src_runner, dst_runner, dst_user,
+                                   packed_path, dst_packed_path, dst_host,
+                                   num_retries)
+            finally:
+                remote_rm_file(src_runner, packed_path)
+
+            try:
+                remote_decompress_join_file(dst_runner, dst_path,
+                                            dst_packed_path, i, block_size,
+                                            codec)
+            finally:
+                remote_rm_file(dst_runner, dst_packed_path)
+
+            dst_md5 = remote_chunk_md5_sum(dst_runner, dst_path, i,
+                                           block_size)
+            if src_md5 == dst_md5 or attempt > num_retries:
+                return src_md5, dst_md5
+
+            LOG.warning("Chunk %d of '%s' is corrupted on destination, "
+                        "attempt '%d'. Retrying", i, src_path, attempt)
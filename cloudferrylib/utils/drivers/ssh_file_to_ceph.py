@@ -19,6 +19,7 @@ from fabric.api import settings
 from cloudferrylib.os.actions import utils as action_utils
 
 from cloudferrylib.utils import cmd_cfg
+from cloudferrylib.utils import compression
 from cloudferrylib.utils import driver_transporter
 from cloudferrylib.utils import rbd_util
 from cloudferrylib.utils import utils
@@ -35,16 +36,29 @@ class SSHFileToCeph(driver_transporter.DriverTransporter):
         with (settings(host_string=ssh_ip_src,
                        connection_attempts=env.connection_attempts),
               utils.forward_agent(env.key_filename)):
-            rbd_import = rbd_util.RbdUtil.rbd_import_cmd
-            ssh_cmd_dst = cmd_cfg.ssh_cmd
-            ssh_dst = ssh_cmd_dst(ssh_ip_dst, rbd_import)
+            sparse_size = self.cfg.migrate.rbd_import_sparse_size
+            if sparse_size:
+                rbd_import = rbd_util.RbdUtil.rbd_import_sparse_cmd(
+                    '2', sparse_size, '-', data['path_dst'])
+            else:
+                rbd_import = rbd_util.RbdUtil.rbd_import_cmd(
+                    '2', '-', data['path_dst'])
+            dd = cmd_cfg.dd_cmd_if('1M', data['path_src'])
 
-            dd = cmd_cfg.dd_cmd_if
-            ssh_cmd_src = cmd_cfg.ssh_cmd
-            ssh_src = ssh_cmd_src(data['host_src'], dd)
+            def run_on_src(cmd):
+                return self.src_cloud.ssh_util.execute(
+                    cmd, internal_host=data['host_src'])
 
-            process = ssh_src >> ssh_dst
-            process = process('1M', data['path_src'], '2', '-',
-                              data['path_dst'])
+            def send_to_dst(src_cmd, dst_cmd):
+                process = (cmd_cfg.ssh_cmd(data['host_src'], src_cmd) >>
+                           cmd_cfg.ssh_cmd(ssh_ip_dst, dst_cmd))
+                self.src_cloud.ssh_util.execute(process)
 
-            self.src_cloud.ssh_util.execute(process)
+            codec = compression.select_file_codec(
+                self.cfg.migrate, data['path_src'], run_on_src,
+                self.dst_cloud.ssh_util.execute, send_to_dst,
+                hosts=(data['host_src'], ssh_ip_dst))
+
+            send_to_dst(
+                codec.pipe_compress(dd, self.cfg.migrate.level_compression),
+                codec.pipe_decompress(rbd_import))
@@ -13,62 +13,62 @@
 # limitations under the License.
 
 
+import contextlib
+import math
+from multiprocessing import pool
+
 from fabric.api import settings
 
 from cloudferrylib.utils import cmd_cfg
+from cloudferrylib.utils import compression
 from cloudferrylib.utils import driver_transporter
+from cloudferrylib.utils import sparse
+from cloudferrylib.utils import transfer_manifest
 from cloudferrylib.utils import utils
+from cloudferrylib.utils.drivers import ssh_chunks
 
 
 LOG = utils.get_log(__name__)
 
 
+def block_ranges(blocks):
+    """Groups sorted block numbers into (first block, number of blocks)
+    ranges of consecutive blocks."""
+
+    ranges = []
+    for block in blocks:
+        if ranges and ranges[-1][0] + ranges[-1][1] == block:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([block, 1])
+    return [tuple(r) for r in ranges]
+
+
 class SSHFileToFile(driver_transporter.DriverTransporter):
     def transfer(self, data):
+        codec = self.select_codec(data)
+
+        if self.cfg.migrate.delta_file_transfer:
+            return self.transfer_delta(data, codec)
+
+        if self.cfg.migrate.resumable_file_transfer:
+            return self.transfer_by_chunks(data, codec)
+
+        if self.cfg.migrate.sparse_file_transfer:
+            return self.transfer_sparse(data, codec)
+
+        if self.cfg.migrate.ssh_transfer_streams > 1:
+            return self.transfer_multi_stream(data, codec)
+
         if self.cfg.migrate.direct_compute_transfer:
-            return self.transfer_direct(data)
+            return self.transfer_direct(data, codec)
 
         LOG.debug("| | copy file")
-        ssh_ip_src = self.src_cloud.getIpSsh()
-        ssh_ip_dst = self.dst_cloud.getIpSsh()
-        with utils.forward_agent(self.cfg.migrate.key_filename), \
-                utils.up_ssh_tunnel(data['host_dst'],
-                                    ssh_ip_dst,
-                                    ssh_ip_src) as port:
-            if self.cfg.migrate.file_compression == "dd":
-                dd_dst = cmd_cfg.dd_cmd_of
-                ssh_cmd_dst = cmd_cfg.ssh_cmd_port
-                ssh_dst = ssh_cmd_dst(port, 'localhost', dd_dst)
-
-                dd_src = cmd_cfg.dd_cmd_if
-                ssh_cmd_src = cmd_cfg.ssh_cmd
-                ssh_src = ssh_cmd_src(data['host_src'], dd_src)
-
-                process = ssh_src >> ssh_dst
-                process = process('1M',
-                                  data['path_src'],
-                                  '1M',
-                                  data['path_dst'])
-
-                self.src_cloud.ssh_util.execute(process)
-
-            elif self.cfg.migrate.file_compression == "gzip":
-                dd = cmd_cfg.dd_cmd_of
-                gunzip_dd = cmd_cfg.gunzip_cmd >> dd
-                ssh_cmd_dst = cmd_cfg.ssh_cmd_port
-                ssh_dst = ssh_cmd_dst(port, 'localhost', gunzip_dd)
-
-                gzip_cmd = cmd_cfg.gzip_cmd
-                ssh_cmd_src = cmd_cfg.ssh_cmd
-                ssh_src = ssh_cmd_src(data['host_src'], gzip_cmd)
-
-                process = ssh_src >> ssh_dst
-                process = process(self.cfg.migrate.level_compression,
-                                  data['path_src'], '1M', data['path_dst'])
-
-                self.src_cloud.ssh_util.execute(process)
-
-    def transfer_direct(self, data):
+        with self.transfer_channel(data) as port:
+            self.copy(data, port, cmd_cfg.dd_cmd_if('1M', data['path_src']),
+                      cmd_cfg.dd_cmd_of('1M', data['path_dst']), codec)
+
+    def transfer_direct(self, data, codec):
         ssh_attempts = self.cfg.migrate.ssh_connection_attempts
         LOG.debug("| | copy file")
         if self.cfg.src.ssh_user != 'root' or self.cfg.dst.ssh_user != 'root':
@@ -79,33 +79,335 @@ class SSHFileToFile(driver_transporter.DriverTransporter):
         with (settings(host_string=data['host_src'],
                        connection_attempts=ssh_attempts),
               utils.forward_agent(self.cfg.migrate.key_filename)):
-            if self.cfg.migrate.file_compression == "dd":
-                dd_dst = cmd_cfg.dd_cmd_of
-                ssh_cmd_dst = cmd_cfg.ssh_cmd
-                ssh_dst = ssh_cmd_dst(data['host_dst'], dd_dst)
+            self.copy(data, None, cmd_cfg.dd_cmd_if('1M', data['path_src']),
+                      cmd_cfg.dd_cmd_of('1M', data['path_dst']), codec)
+
+    def select_codec(self, data):
+        def send_to_dst(src_cmd, dst_cmd):
+            with self.transfer_channel(data) as port:
+                self.run_pipe(data, port, src_cmd, dst_cmd)
+
+        return compression.select_file_codec(
+            self.cfg.migrate, data['path_src'],
+            lambda cmd: self.run_on_src(data, cmd),
+            lambda cmd: self.run_on_dst(data, cmd),
+            send_to_dst, hosts=(data['host_src'], data['host_dst']))
+
+    def transfer_by_chunks(self, data, codec):
+        """Copies file by chunks of `migrate.ssh_chunk_size` MB.
+
+        Each chunk is verified with MD5 and recorded in transfer manifest, so
+        restarted transfer of unchanged file copies only the chunks which are
+        missing or corrupted on destination.
+        """
+
+        src_path = data['path_src']
+        dst_path = data['path_dst']
+        chunk_size = self.cfg.migrate.ssh_chunk_size
+
+        file_size = int(self.run_on_src(data,
+                                        cmd_cfg.stat_size_cmd(src_path)))
+        num_chunks = int(math.ceil(
+            float(file_size) / (chunk_size * 1024 * 1024)))
+
+        manifest = transfer_manifest.TransferManifest(
+            self.cfg.migrate.transfer_manifest_dir,
+            data['host_src'], src_path, data['host_dst'], dst_path,
+            size=file_size,
+            mtime=int(self.run_on_src(data,
+                                      cmd_cfg.stat_mtime_cmd(src_path))),
+            chunk_size=chunk_size)
+
+        with self.transfer_channel(data) as port:
+            self.in_streams(
+                lambda i: self.transfer_chunk(data, port, codec, manifest, i),
+                xrange(num_chunks))
+
+        # chunks are written in place, so remains of previously existing
+        # destination file must be cut off
+        self.run_on_dst(data, cmd_cfg.truncate_cmd(file_size, dst_path))
+        manifest.remove()
+
+    def transfer_multi_stream(self, data, codec):
+        """Splits file into `migrate.ssh_transfer_streams` ranges, each of
+        them is copied with its own ssh stream.
+
+        Copy is verified with MD5 combined from MD5 of the ranges, which are
+        computed on both hosts in parallel as well.
+        """
+
+        src_path = data['path_src']
+        dst_path = data['path_dst']
+        streams = self.cfg.migrate.ssh_transfer_streams
+
+        file_size = self.file_size(data)
+        size_mb = int(math.ceil(float(file_size) / (1024 * 1024)))
+        range_size = max(int(math.ceil(float(size_mb) / streams)), 1)
+        ranges = [(offset, range_size)
+                  for offset in xrange(0, size_mb, range_size)]
+        LOG.debug("Copying '%s' in %d streams", src_path, len(ranges))
+
+        with self.transfer_channel(data) as port:
+            self.in_streams(
+                lambda r: self.copy_range(data, port, codec, *r), ranges)
+
+        self.truncate_dst(data, file_size)
+
+        src_md5 = ssh_chunks.combined_md5(self.in_streams(
+            lambda r: self.range_md5(data, *r, source=True,
+                                     file_size=file_size), ranges))
+        dst_md5 = ssh_chunks.combined_md5(self.in_streams(
+            lambda r: self.range_md5(data, *r, source=False,
+                                     file_size=file_size), ranges))
+        if src_md5 != dst_md5:
+            message = ("Error copying file from '{src_host}:{src_file}' "
+                       "to '{dst_host}:{dst_file}'").format(
+                src_file=src_path, src_host=data['host_src'],
+                dst_file=dst_path, dst_host=data['host_dst'])
+            LOG.error(message)
+            raise ssh_chunks.FileCopyFailure(message)
+
+    def transfer_sparse(self, data, codec):
+        """Copies only allocated extents of the file, holes are recreated
+        on destination, zero blocks inside of extents are not written.
+
+        Falls back to copying the whole file if extents are unknown.
+        """
+
+        src_path = data['path_src']
+        dst_path = data['path_dst']
+
+        file_size = int(self.run_on_src(data,
+                                        cmd_cfg.stat_size_cmd(src_path)))
+        extents = sparse.remote_data_extents(
+            lambda cmd: self.run_on_src(data, cmd), src_path)
+        if extents is None:
+            extents = [(0, file_size)]
+        ranges = sparse.align_extents(extents, sparse.MB)
+        LOG.info("%d MB of %d MB of '%s' are allocated",
+                 sum(size for _, size in ranges),
+                 int(math.ceil(float(file_size) / sparse.MB)), src_path)
+
+        # destination must not keep any data outside of copied extents
+        self.run_on_dst(data, cmd_cfg.truncate_cmd(0, dst_path) &
+                        cmd_cfg.truncate_cmd(file_size, dst_path))
+
+        with self.transfer_channel(data) as port:
+            self.in_streams(
+                lambda r: self.copy_range(data, port, codec, *r,
+                                          sparse_dst=True),
+                ranges)
+
+    def in_streams(self, func, items):
+        """Calls :func for each of :items in up to
+        `migrate.ssh_transfer_streams` threads, returns list of results."""
+
+        items = list(items)
+        streams = min(self.cfg.migrate.ssh_transfer_streams, len(items))
+        if streams <= 1:
+            return [func(item) for item in items]
+        # commands of the streams use fabric settings concurrently
+        with utils.thread_local_fabric_env():
+            workers = pool.ThreadPool(streams)
+            try:
+                return workers.map(func, items)
+            finally:
+                workers.close()
+                workers.join()
+
+    def file_size(self, data):
+        """Size of source file or block device in bytes."""
+
+        path = data['path_src']
+        return int(str(self.run_on_src(
+            data, cmd_cfg.file_size_cmd(path, path, path))).strip())
+
+    def truncate_dst(self, data, size):
+        """Sets size of destination file to :size bytes, block device is
+        left as is."""
+
+        path = data['path_dst']
+        self.run_on_dst(data, cmd_cfg.truncate_file_cmd(path, path, size,
+                                                        path))
+
+    def transfer_chunk(self, data, port, codec, manifest, i):
+        src_path = data['path_src']
+        num_retries = self.cfg.migrate.retry
+
+        md5 = manifest.get(i)
+        if md5 is not None:
+            if self.chunk_md5(data, i, source=False) == md5:
+                LOG.debug("Chunk %d of '%s' is already copied", i, src_path)
+                return
+            manifest.discard(i)
+
+        attempt = 0
+        while True:
+            attempt += 1
+            self.copy_chunk(data, port, codec, i)
+            src_md5 = self.chunk_md5(data, i, source=True)
+            if src_md5 == self.chunk_md5(data, i, source=False):
+                manifest.put(i, src_md5)
+                return
+            if attempt > num_retries:
+                raise ssh_chunks.FileCopyFailure(
+                    "Unable to copy chunk %d of '%s' to '%s' host" %
+                    (i, src_path, data['host_dst']))
+            LOG.warning("Chunk %d of '%s' is corrupted on destination, "
+                        "attempt '%d'. Retrying", i, src_path, attempt)
+
+    def transfer_delta(self, data, codec):
+        """Copies only blocks of `migrate.delta_block_size` MB which differ
+        between source and destination files.
+
+        Blocks are compared by MD5 computed on both hosts, so transfer
+        repeated for the same file, e.g. while instance is running and once
+        more after it is stopped, copies only blocks changed in between.
+        Copied blocks are verified with MD5 and copied again if they differ.
+        Source and destination may be block devices, destination device may
+        be bigger than source.
+        """
+
+        src_path = data['path_src']
+        block_size = self.cfg.migrate.delta_block_size
+
+        file_size = self.file_size(data)
+        src_blocks = self.block_md5s(data, True, file_size)
+        dst_blocks = self.block_md5s(data, False, file_size)
+        changed = [i for i, md5 in enumerate(src_blocks)
+                   if i >= len(dst_blocks) or dst_blocks[i] != md5]
+        LOG.info("%d of %d blocks of '%s' differ on destination",
+                 len(changed), len(src_blocks), src_path)
+
+        # blocks are written in place, so destination file must have the
+        # size of source before copied ranges are verified
+        self.truncate_dst(data, file_size)
+
+        with self.transfer_channel(data) as port:
+            self.in_streams(
+                lambda r: self.copy_verified_range(data, port, codec,
+                                                   file_size, *r),
+                [(start * block_size, count * block_size)
+                 for start, count in block_ranges(changed)])
+
+    def copy_verified_range(self, data, port, codec, file_size, offset,
+                            size):
+        """Copies :size MB of file of :file_size bytes starting from :offset
+        MB until MD5 of the range matches on both hosts, up to
+        `migrate.retry` times."""
+
+        attempt = 0
+        while True:
+            attempt += 1
+            self.copy_range(data, port, codec, offset, size)
+            if (self.range_md5(data, offset, size, True, file_size) ==
+                    self.range_md5(data, offset, size, False, file_size)):
+                return
+            if attempt > self.cfg.migrate.retry:
+                raise ssh_chunks.FileCopyFailure(
+                    "Unable to copy %d MB at %d MB of '%s' to '%s' host" %
+                    (size, offset, data['path_src'], data['host_dst']))
+            LOG.warning("%d MB at %d MB of '%s' are corrupted on "
+                        "destination, attempt '%d'. Retrying", size, offset,
+                        data['path_src'], attempt)
+
+    def block_md5s(self, data, source, file_size):
+        """Returns list of MD5 of the blocks of the first :file_size bytes of
+        the file or block device, empty if it does not exist."""
+
+        path = data['path_src'] if source else data['path_dst']
+        run = self.run_on_src if source else self.run_on_dst
+        output = run(data, cmd_cfg.block_md5_cmd(
+            path, path, file_size,
+            '%dM' % self.cfg.migrate.delta_block_size))
+        return [line.split(' ')[0] for line in str(output).splitlines()
+                if line.strip()]
+
+    @contextlib.contextmanager
+    def transfer_channel(self, data):
+        """Yields port of ssh tunnel to destination host, or None if data
+        is copied directly between compute hosts."""
+
+        with utils.forward_agent(self.cfg.migrate.key_filename):
+            if self.cfg.migrate.direct_compute_transfer:
+                yield None
+            else:
+                with utils.up_ssh_tunnel(data['host_dst'],
+                                         self.dst_cloud.getIpSsh(),
+                                         self.src_cloud.getIpSsh()) as port:
+                    yield port
+
+    def run_on_src(self, data, cmd):
+        if self.cfg.migrate.direct_compute_transfer:
+            return self.src_cloud.ssh_util.execute(
+                cmd, host_exec=data['host_src'])
+        return self.src_cloud.ssh_util.execute(
+            cmd, internal_host=data['host_src'])
+
+    def run_on_dst(self, data, cmd):
+        if self.cfg.migrate.direct_compute_transfer:
+            return self.dst_cloud.ssh_util.execute(
+                cmd, host_exec=data['host_dst'])
+        return self.dst_cloud.ssh_util.execute(
+            cmd, internal_host=data['host_dst'])
+
+    def chunk_md5(self, data, i, source):
+        chunk_size = self.cfg.migrate.ssh_chunk_size
+        return self.range_md5(data, i * chunk_size, chunk_size, source)
+
+    def range_md5(self, data, offset, size, source, file_size=None):
+        """Returns MD5 of :size MB of file starting from :offset MB.
+
+        If :file_size is given, data after :file_size bytes is not read, so
+        that the range can be compared with a bigger block device.
+        """
+
+        path = data['path_src'] if source else data['path_dst']
+        cmd = cmd_cfg.dd_cmd_if_range('1M', path, offset, size)
+        if file_size is not None:
+            cmd = cmd >> cmd_cfg.head_bytes_cmd(
+                max(min(size * sparse.MB, file_size - offset * sparse.MB),
+                    0))
+        cmd = cmd >> cmd_cfg.md5sum_cmd
+        run = self.run_on_src if source else self.run_on_dst
+        return str(run(data, cmd)).split(' ')[0]
+
+    def copy_chunk(self, data, port, codec, i):
+        chunk_size = self.cfg.migrate.ssh_chunk_size
+        self.copy_range(data, port, codec, i * chunk_size, chunk_size)
 
-                dd_src = cmd_cfg.dd_cmd_if
+    def copy_range(self, data, port, codec, offset, size, sparse_dst=False):
+        """Copies :size MB of file starting from :offset MB.
 
-                process = dd_src >> ssh_dst
-                process = process('1M',
-                                  data['path_src'],
-                                  '1M',
-                                  data['path_dst'])
+        If :sparse_dst is set, zero blocks are not written to destination,
+        which must be zeroed in the range then.
+        """
 
-                self.src_cloud.ssh_util.execute(process,
-                                                host_exec=data['host_src'])
+        dd_dst = (cmd_cfg.dd_cmd_of_range_sparse if sparse_dst
+                  else cmd_cfg.dd_cmd_of_range)
+        self.copy(data, port,
+                  cmd_cfg.dd_cmd_if_range('1M', data['path_src'], offset,
+                                          size),
+                  dd_dst('1M', data['path_dst'], offset),
+                  codec)
 
-            elif self.cfg.migrate.file_compression == "gzip":
-                dd = cmd_cfg.dd_cmd_of
-                gunzip_dd = cmd_cfg.gunzip_cmd >> dd
-                ssh_cmd_dst = cmd_cfg.ssh_cmd
-                ssh_dst = ssh_cmd_dst(data['host_dst'], gunzip_dd)
+    def copy(self, data, port, src_cmd, dst_cmd, codec):
+        """Pipes output of :src_cmd to :dst_cmd compressed with :codec."""
 
-                gzip_cmd = cmd_cfg.gzip_cmd
+        self.run_pipe(
+            data, port,
+            codec.pipe_compress(src_cmd, self.cfg.migrate.level_compression),
+            codec.pipe_decompress(dst_cmd))
 
-                process = gzip_cmd >> ssh_dst
-                process = process(self.cfg.migrate.level_compression,
-                                  data['path_src'], '1M', data['path_dst'])
+    def run_pipe(self, data, port, src_cmd, dst_cmd):
+        """Pipes output of :src_cmd run on source host to :dst_cmd run on
+        destination host."""
 
-                self.src_cloud.ssh_util.execute(process,
-                                                host_exec=data['host_src'])
+        if port is None:
+            process = src_cmd >> cmd_cfg.ssh_cmd(data['host_dst'], dst_cmd)
+            self.src_cloud.ssh_util.execute(process,
+                                            host_exec=data['host_src'])
+        else:
+            process = (cmd_cfg.ssh_cmd(data['host_src'], src_cmd) >>
+                       cmd_cfg.ssh_cmd_port(port, 'localhost', dst_cmd))
+            self.src_cloud.ssh_util.execute(process)
@@ -15,20 +15,82 @@
 
 import progressbar
 import re
+import threading
 import time
 
 from utils import get_log
 
 LOG = get_log(__name__)
 
-# Maximum Bytes Per Packet
+# Size of the buffer data is read from source into
 CHUNK_SIZE = 512 * 1024  # B
 
+# Time of transfer at full speed the token bucket can accumulate, the
+# smaller it is, the smoother the speed is
+BURST_TIME = 0.1  # s
+
+
+def parse_speed_limit(speed_limit):
+    """Returns speed limit in bytes per second, 0 means unlimited."""
+
+    if speed_limit == '-':
+        return 0
+    array = filter(None, re.split(r'(\d+)', speed_limit))
+    mult = {
+        'b': 1,
+        'kb': 1024,
+        'mb': 1024 * 1024,
+    }[array[1].lower()]
+    return int(array[0]) * mult
+
+
+class TokenBucket(object):
+    """Limits rate of data transfer to :rate bytes per second.
+
+    Bucket can be shared between several transfers (threads), so that the
+    limit is applied to their total speed. Bucket holds at most
+    BURST_TIME seconds of transfer, so that speed is even at sub-second
+    scale. Transfer of more data than available makes the balance negative
+    and waits until it is paid off, so reads of any size are allowed.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(rate * BURST_TIME, 1)
+        self.tokens = self.capacity
+        self.timestamp = time.time()
+        self.lock = threading.Lock()
+
+    def consume(self, size):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.time()
+            self.tokens = min(
+                self.capacity,
+                self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= size
+            delay = -self.tokens / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
 
 class FileLikeProxy:
+    """File-like object reading image data from source Glance, which is
+    given as data of image created in destination Glance.
+
+    Data is read into preallocated buffer, so that reads of any size don't
+    copy data more than once. :speed_limit is either a string like '10MB'
+    or TokenBucket shared with other transfers. :callback is called with
+    (transferred bytes, total bytes, image id, image name, speed in bytes
+    per second, estimated time left in seconds) whenever another percent
+    of data is transferred.
+    """
+
     def __init__(self, transfer_object, callback, speed_limit='1mb'):
         self.__callback = callback if callback \
-            else lambda size, length, obj_id, name: True
+            else lambda size, length, obj_id, name, speed, eta: True
         self.resp = transfer_object['resource'].get_ref_image(
             transfer_object['id'])
         self.length = (
@@ -38,11 +100,16 @@ class FileLikeProxy:
         self.percent = self.length / 100
         self.res = 0
         self.delta = 0
-        self.buffer = ''
-        self.prev_send_time = 0
-        self.speed_limit = self._parse_speed_limit(speed_limit)
-        if self.speed_limit != 0:
-            self.read = self.speed_limited_read
+        self.buffer = bytearray(CHUNK_SIZE)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.eof = False
+        self.start_time = time.time()
+        if isinstance(speed_limit, TokenBucket):
+            self.bucket = speed_limit
+        else:
+            self.bucket = TokenBucket(parse_speed_limit(speed_limit))
         msg = 'Download file {}({}): '.format(self.name, self.id)
         self.bar = progressbar.ProgressBar(
             widgets=[
@@ -54,45 +121,58 @@ class FileLikeProxy:
             ]
         ).start()
 
-    def _parse_speed_limit(self, speed_limit):
-        if speed_limit is '-':
-            return 0
-        array = filter(None, re.split(r'(\d+)', speed_limit))
-        mult = {
-            'b': 1,
-            'kb': 1024,
-            'mb': 1024 * 1024,
-        }[array[1].lower()]
-        return int(array[0]) * mult
-
-    def read(self, *args, **kwargs):
-        res = self.resp.read(*args, **kwargs)
-        self._trigger_callback(len(res))
+    def _fill(self):
+        """Reads next portion of data from source into the buffer."""
+
+        self.start = 0
+        if hasattr(self.resp, 'readinto'):
+            self.end = self.resp.readinto(self.buffer) or 0
+        else:
+            data = self.resp.read(CHUNK_SIZE)
+            self.end = len(data)
+            self.view[:self.end] = data
+        self.eof = self.end == 0
+
+    def _read_buffered(self, size):
+        if self.start == self.end and not self.eof:
+            self._fill()
+        size = min(size, self.end - self.start)
+        res = self.view[self.start:self.start + size].tobytes()
+        self.start += size
         return res
 
-    def speed_limited_read(self, *args, **kwargs):
-        if len(self.buffer) < CHUNK_SIZE:
-            self.buffer += self.resp.read(*args, **kwargs)
-
-        res = self.buffer[0:CHUNK_SIZE]
-        self.buffer = self.buffer[CHUNK_SIZE::]
-
+    def read(self, size=-1):
+        if size is None or size < 0:
+            parts = []
+            while True:
+                part = self._read_buffered(CHUNK_SIZE)
+                if not part:
+                    break
+                self.bucket.consume(len(part))
+                parts.append(part)
+            res = ''.join(parts)
+        else:
+            res = self._read_buffered(size)
+            self.bucket.consume(len(res))
         self._trigger_callback(len(res))
-
-        # avoid division by zero
-        if self.speed_limit > 0:
-            cur_send_time = time.time()
-            sleep_time = float(len(res)) / self.speed_limit
-            sleep_time -= cur_send_time - self.prev_send_time
-            time.sleep(max(0, sleep_time))
-            self.prev_send_time = cur_send_time
         return res
 
+    def speed(self):
+        return self.res / max(time.time() - self.start_time, 0.001)
+
+    def eta(self):
+        speed = self.speed()
+        if not speed:
+            return None
+        return max(self.length - self.res, 0) / speed
+
     def _trigger_callback(self, len_data):
         self.delta += len_data
         self.res += len_data
         if (self.delta > self.percent or len_data == 0) and self.length > 0:
-            self.bar.update(self.res * 100 / self.length)
+            self.bar.update(min(self.res * 100 / self.length, 100))
+            self.__callback(self.res, self.length, self.id, self.name,
+                            self.speed(), self.eta())
             self.delta = 0
         if len_data == 0:
             self.bar.finish()
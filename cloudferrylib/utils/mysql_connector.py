@@ -13,8 +13,62 @@
 # limitations under the License.
 
 
+import threading
+import time
+
 import sqlalchemy
 
+from cloudferrylib.utils import utils
+
+
+LOG = utils.get_log(__name__)
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_POOL_RECYCLE = 3600
+DEFAULT_POOL_PRE_PING = True
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+class ConnectionStats(object):
+    """Counters of connection acquisition time and statement latency
+    collected for one database engine."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.connection_time = 0.0
+        self.statements = 0
+        self.statement_time = 0.0
+
+    def add_connection(self, elapsed):
+        with self.lock:
+            self.connections += 1
+            self.connection_time += elapsed
+
+    def add_statement(self, elapsed):
+        with self.lock:
+            self.statements += 1
+            self.statement_time += elapsed
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'connections': self.connections,
+                'connection_time': self.connection_time,
+                'statements': self.statements,
+                'statement_time': self.statement_time,
+            }
+
+
+class _PooledEngine(object):
+    def __init__(self, engine):
+        self.engine = engine
+        self.stats = ConnectionStats()
+
 
 def get_db_host(cloud_config):
     """Returns DB host based on configuration.
@@ -36,7 +90,25 @@ def get_db_host(cloud_config):
     return db_host
 
 
+def dispose_engines():
+    """Closes all pooled connections and forgets about shared engines."""
+
+    with _engines_lock:
+        for pooled in _engines.values():
+            LOG.debug("Disposing DB engine '%s', stats: %s",
+                      pooled.engine.url, pooled.stats.as_dict())
+            pooled.engine.dispose()
+        _engines.clear()
+
+
 class MysqlConnector():
+    """Runs SQL statements against a single database.
+
+    All connectors pointing to the same database URL share one SQLAlchemy
+    engine, so the connection pool (and already established MySQL sessions)
+    are reused throughout the whole migration.
+    """
+
     def __init__(self, config, db):
         self.config = config
         self.db = db
@@ -50,16 +122,65 @@ class MysqlConnector():
                                             self.config['db_port'],
                                             self.db)
 
+    def _get_option(self, name, default):
+        try:
+            value = self.config[name]
+        except (KeyError, AttributeError):
+            return default
+        return default if value is None else value
+
+    def _pooled_engine(self):
+        with _engines_lock:
+            pooled = _engines.get(self.connection_url)
+            if pooled is None:
+                LOG.debug("Creating DB engine for '%s' database", self.db)
+                engine = sqlalchemy.create_engine(
+                    self.connection_url,
+                    pool_size=self._get_option('db_pool_size',
+                                               DEFAULT_POOL_SIZE),
+                    max_overflow=self._get_option('db_max_overflow',
+                                                  DEFAULT_MAX_OVERFLOW),
+                    pool_timeout=self._get_option('db_pool_timeout',
+                                                  DEFAULT_POOL_TIMEOUT),
+                    pool_recycle=self._get_option('db_pool_recycle',
+                                                  DEFAULT_POOL_RECYCLE),
+                    pool_pre_ping=self._get_option('db_pool_pre_ping',
+                                                   DEFAULT_POOL_PRE_PING))
+                pooled = _PooledEngine(engine)
+                _engines[self.connection_url] = pooled
+            return pooled
+
+    @property
+    def stats(self):
+        return self._pooled_engine().stats
+
     def get_engine(self):
-        return sqlalchemy.create_engine(self.connection_url)
+        return self._pooled_engine().engine
 
-    def execute(self, command, **kwargs):
-        with sqlalchemy.create_engine(
-                self.connection_url).begin() as connection:
+    @staticmethod
+    def _connect(pooled):
+        start = time.time()
+        connection = pooled.engine.connect()
+        pooled.stats.add_connection(time.time() - start)
+        return connection
+
+    @staticmethod
+    def _execute(pooled, connection, command, **kwargs):
+        start = time.time()
+        try:
             return connection.execute(sqlalchemy.text(command), **kwargs)
+        finally:
+            pooled.stats.add_statement(time.time() - start)
+
+    def execute(self, command, **kwargs):
+        pooled = self._pooled_engine()
+        with self._connect(pooled) as connection:
+            with connection.begin():
+                return self._execute(pooled, connection, command, **kwargs)
 
     def batch_execute(self, commands, **kwargs):
-        with sqlalchemy.create_engine(
-                self.connection_url).begin() as connection:
-            for command in commands:
-                connection.execute(sqlalchemy.text(command), **kwargs)
+        pooled = self._pooled_engine()
+        with self._connect(pooled) as connection:
+            with connection.begin():
+                for command in commands:
+                    self._execute(pooled, connection, command, **kwargs)
@@ -20,6 +20,8 @@ from cloudferrylib.utils import ssh_util
 class RbdUtil(ssh_util.SshUtil):
     rbd_rm_cmd = cmd_cfg.rbd_cmd("rm -p %s %s")
     rbd_import_cmd = cmd_cfg.rbd_cmd("import --image-format=%s %s %s")
+    rbd_import_sparse_cmd = cmd_cfg.rbd_cmd(
+        "import --image-format=%s --sparse-size %s %s %s")
     rbd_import_diff_cmd = cmd_cfg.rbd_cmd("import-diff %s %s")
     rbd_export_cmd = cmd_cfg.rbd_cmd("export %s %s")
     rbd_export_diff_cmd = cmd_cfg.rbd_cmd("export-diff %s %s")
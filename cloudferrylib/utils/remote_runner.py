@@ -12,9 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import threading
+import uuid
+
+from fabric.api import env
 from fabric.api import sudo
 from fabric.api import run
 from fabric.api import settings
+from fabric.network import normalize_to_string
+from fabric import state
 
 import cfglib
 from cloudferrylib.utils.utils import forward_agent
@@ -27,6 +34,30 @@ class RemoteExecutionError(RuntimeError):
     pass
 
 
+_connection_locks = collections.defaultdict(threading.Lock)
+_connection_locks_lock = threading.Lock()
+
+
+def _connect():
+    """Opens SSH connection to the host of current fabric env unless it is
+    already in fabric connection cache.
+
+    Fabric keeps connections open and runs every command in a new channel of
+    the cached connection, but checking and filling the cache is not thread
+    safe, so threads running commands on the same host would open several
+    connections. Connections are keyed by user, host, port and gateway.
+    """
+
+    key = normalize_to_string(env.host_string)
+    if env.gateway:
+        key = '%s via %s' % (key, normalize_to_string(env.gateway))
+    with _connection_locks_lock:
+        lock = _connection_locks[key]
+    with lock:
+        if env.host_string not in state.connections:
+            state.connections.connect(env.host_string)
+
+
 class RemoteRunner(object):
     def __init__(self, host, user, password=None, sudo=False, key=None,
                  ignore_errors=False):
@@ -57,6 +88,7 @@ class RemoteRunner(object):
             with forward_agent(self.key):
                 LOG.debug("running '%s' on '%s' host as user '%s'",
                           cmd, self.host, self.user)
+                _connect()
                 if self.sudo and self.user != 'root':
                     return sudo(cmd)
                 else:
@@ -69,3 +101,45 @@ class RemoteRunner(object):
             self.run(cmd)
         finally:
             self.ignore_errors = ignore_errors_original
+
+    def run_batch(self, cmds):
+        """Runs :cmds one after another in a single remote shell and returns
+        list of their outputs, saving a round trip per command.
+
+        All commands are run even if some of them fail, RemoteExecutionError
+        is raised afterwards for the first failed one unless errors are
+        ignored.
+        """
+
+        if not cmds:
+            return []
+        marker = 'cloudferry-batch-%s' % uuid.uuid4().hex
+        script = ' ; '.join('%s ; rc=$? ; echo ; echo %s $rc' % (cmd, marker)
+                            for cmd in cmds)
+        ignore_errors_original = self.ignore_errors
+        try:
+            self.ignore_errors = True
+            output = self.run(script)
+        finally:
+            self.ignore_errors = ignore_errors_original
+
+        outputs = []
+        lines = []
+        failed = None
+        for line in str(output).splitlines():
+            if not line.startswith(marker + ' '):
+                lines.append(line)
+                continue
+            if lines and not lines[-1]:
+                lines.pop()
+            if line.split()[-1] != '0' and failed is None:
+                failed = len(outputs)
+            outputs.append('\n'.join(lines))
+            lines = []
+
+        if len(outputs) != len(cmds):
+            failed = len(outputs) if failed is None else failed
+        if failed is not None and not self.ignore_errors:
+            raise RemoteExecutionError(
+                "Command '%s' failed on '%s' host" % (cmds[failed], self.host))
+        return outputs
@@ -0,0 +1,84 @@
+# Copyright 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers to copy only allocated parts of sparse files.
+
+Allocated extents are found with `qemu-img map` of the file opened as raw
+image, which uses SEEK_DATA/SEEK_HOLE, so holes are not read at all.
+"""
+
+import hashlib
+import json
+
+from cloudferrylib.utils import cmd_cfg
+from cloudferrylib.utils import remote_runner
+from cloudferrylib.utils import utils
+
+
+LOG = utils.get_log(__name__)
+
+MB = 1024 * 1024
+
+qemu_img_map_cmd = cmd_cfg.qemu_img_cmd("map -f raw --output=json %s")
+
+
+def parse_qemu_img_map(output):
+    """Returns (start, length) in bytes of the extents holding data."""
+
+    return [(extent['start'], extent['length'])
+            for extent in json.loads(output)
+            if extent.get('data') and not extent.get('zero')]
+
+
+def remote_data_extents(run, path):
+    """Returns extents of :path holding data or None if they can not be
+    found, e.g. qemu-img is not installed."""
+
+    try:
+        return parse_qemu_img_map(str(run(qemu_img_map_cmd(path))))
+    except (remote_runner.RemoteExecutionError, ValueError) as e:
+        LOG.warning("Unable to get allocated extents of '%s', whole file "
+                    "is copied: %s", path, e)
+        return None
+
+
+def align_extents(extents, unit):
+    """Rounds extents to :unit bytes and merges overlapping and adjacent
+    ones, returns list of (first unit, number of units)."""
+
+    ranges = []
+    for start, length in sorted(extents):
+        first = start / unit
+        last = (start + length - 1) / unit
+        if ranges and ranges[-1][0] + ranges[-1][1] >= first:
+            ranges[-1][1] = max(ranges[-1][1], last - ranges[-1][0] + 1)
+        else:
+            ranges.append([first, last - first + 1])
+    return [tuple(r) for r in ranges]
+
+
+_zero_md5s = {}
+
+
+def zero_md5(size):
+    """MD5 of :size zero bytes."""
+
+    if size in _zero_md5s:
+        return _zero_md5s[size]
+    md5 = hashlib.md5()
+    block = '\0' * MB
+    for offset in xrange(0, size, MB):
+        md5.update(block[:min(size - offset, MB)])
+    _zero_md5s[size] = md5.hexdigest()
+    return _zero_md5s[size]
@@ -18,26 +18,62 @@ import cmd_cfg
 from utils import forward_agent
 
 
+# %r, %h and %p are expanded by ssh to remote user, host and port
+CONTROL_PATH = '/tmp/cloudferry-ssh-%r@%h:%p'
+
+
 class SshUtil(object):
     def __init__(self, cloud, config_migrate, host=None):
         self.cloud = cloud
         self.host = host if host else cloud.host
         self.config_migrate = config_migrate
 
+    def runner(self, host_exec=None, ignore_errors=False):
+        host = host_exec if host_exec else self.host
+        return remote_runner.RemoteRunner(
+            host,
+            self.cloud.ssh_user,
+            password=self.cloud.ssh_sudo_password,
+            sudo=False,
+            ignore_errors=ignore_errors)
+
     def execute(self, cmd, internal_host=None, host_exec=None,
                 ignore_errors=False):
-        host = host_exec if host_exec else self.host
-        runner = \
-            remote_runner.RemoteRunner(host,
-                                       self.cloud.ssh_user,
-                                       password=self.cloud.ssh_sudo_password,
-                                       sudo=False,
-                                       ignore_errors=ignore_errors)
+        runner = self.runner(host_exec, ignore_errors)
         if internal_host:
             return self.execute_on_inthost(runner, str(cmd), internal_host)
         else:
             return runner.run(str(cmd))
 
+    def execute_batch(self, cmds, internal_host=None, host_exec=None,
+                      ignore_errors=False):
+        """Runs several commands in one SSH session, returns their outputs.
+
+        See RemoteRunner.run_batch.
+        """
+
+        runner = self.runner(host_exec, ignore_errors)
+        if internal_host:
+            with forward_agent(self.config_migrate.key_filename):
+                return runner.run_batch(
+                    [str(self.inthost_cmd(internal_host, cmd))
+                     for cmd in cmds])
+        return runner.run_batch([str(cmd) for cmd in cmds])
+
+    def inthost_cmd(self, host, cmd):
+        """Command running :cmd on :host from the cloud controller.
+
+        With `[migrate] ssh_control_persist` connections from controller are
+        shared by OpenSSH ControlMaster, so only the first command pays for
+        SSH handshake.
+        """
+
+        persist = self.config_migrate.ssh_control_persist
+        if not persist:
+            return cmd_cfg.ssh_cmd(host, str(cmd))
+        return cmd_cfg.ssh_mux_cmd(CONTROL_PATH, '%ds' % persist, host,
+                                   str(cmd))
+
     def execute_on_inthost(self, runner, cmd, host):
         with forward_agent(self.config_migrate.key_filename):
-            return runner.run(str(cmd_cfg.ssh_cmd(host, str(cmd))))
+            return runner.run(str(self.inthost_cmd(host, cmd)))
@@ -0,0 +1,106 @@
+# Copyright 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import threading
+
+from cloudferrylib.utils import utils
+
+
+LOG = utils.get_log(__name__)
+
+
+class TransferManifest(object):
+    """Keeps MD5 of the chunks of a file which are copied and verified on
+    destination, so interrupted transfer can be resumed from the chunks
+    which are missing.
+
+    Manifest is stored as JSON file in :state_dir, it is discarded if
+    :source (e.g. size, modification time of source file and chunk size)
+    differs from the one manifest was created for. If :state_dir is empty,
+    manifest is kept in memory only.
+    """
+
+    def __init__(self, state_dir, src_host, src_path, dst_host, dst_path,
+                 **source):
+        self.key = '{src_host}:{src_path}->{dst_host}:{dst_path}'.format(
+            src_host=src_host, src_path=src_path, dst_host=dst_host,
+            dst_path=dst_path)
+        self.source = source
+        self.path = None
+        if state_dir:
+            self.path = os.path.join(
+                state_dir, hashlib.md5(self.key).hexdigest() + '.json')
+        self.chunks = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (IOError, ValueError) as e:
+            LOG.warning("Unable to read transfer manifest '%s': %s",
+                        self.path, e)
+            return
+        if state.get('key') != self.key or state.get('source') != self.source:
+            LOG.info("Source of '%s' has changed, transfer starts over",
+                     self.key)
+            return
+        self.chunks = dict((int(i), md5)
+                           for i, md5 in state['chunks'].items())
+        LOG.info("Resuming transfer of '%s', %d chunks are already copied",
+                 self.key, len(self.chunks))
+
+    def save(self):
+        if self.path is None:
+            return
+        state_dir = os.path.dirname(self.path)
+        if not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': self.key,
+                       'source': self.source,
+                       'chunks': self.chunks}, f)
+        os.rename(tmp_path, self.path)
+
+    def get(self, chunk):
+        """Returns MD5 of copied :chunk or None if it was not copied."""
+
+        with self.lock:
+            return self.chunks.get(chunk)
+
+    def put(self, chunk, md5):
+        with self.lock:
+            self.chunks[chunk] = md5
+            self.save()
+
+    def discard(self, chunk):
+        with self.lock:
+            if self.chunks.pop(chunk, None) is not None:
+                self.save()
+
+    def remove(self):
+        """Forgets the transfer, called once it is completed or failed
+        for good."""
+
+        with self.lock:
+            self.chunks = {}
+            if self.path is not None and os.path.exists(self.path):
+                os.remove(self.path)
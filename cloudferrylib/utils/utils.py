@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and#
 # limitations under the License.
 
+import contextlib
 import logging
 import time
 import timeit
@@ -28,8 +29,10 @@ from jinja2 import Environment, FileSystemLoader
 import os
 import inspect
 from multiprocessing import Lock
+import threading
 from fabric.api import run, settings, local, env, sudo
 from fabric.context_managers import hide
+from fabric.utils import _AttributeDict
 import ipaddr
 import yaml
 from logging import config
@@ -107,6 +110,100 @@ SSH_CMD = \
     "ssh -oStrictHostKeyChecking=no -L %s:%s:22 -R %s:localhost:%s %s -Nf"
 
 
+class ThreadLocalEnv(_AttributeDict):
+    """Fabric `env` which keeps values set outside of the main thread local
+    to the thread.
+
+    Fabric keeps connection settings (`host_string`, `user`, etc) in the
+    single global `env` dictionary, so commands run from several threads at
+    once (e.g. parallel instance migration) would use each other's hosts.
+    Values set in the main thread remain visible to all threads.
+
+    Only used within `thread_local_fabric_env` block.
+    """
+
+    _local = threading.local()
+    _deleted = object()
+
+    @classmethod
+    def _overrides(cls):
+        if isinstance(threading.current_thread(), threading._MainThread):
+            return None
+        if not hasattr(cls._local, 'env'):
+            cls._local.env = {}
+        return cls._local.env
+
+    def __getitem__(self, key):
+        overrides = self._overrides()
+        if overrides and key in overrides:
+            if overrides[key] is self._deleted:
+                raise KeyError(key)
+            return overrides[key]
+        return super(ThreadLocalEnv, self).__getitem__(key)
+
+    def __setitem__(self, key, value):
+        overrides = self._overrides()
+        if overrides is None:
+            super(ThreadLocalEnv, self).__setitem__(key, value)
+        else:
+            overrides[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        overrides = self._overrides()
+        if overrides is None:
+            super(ThreadLocalEnv, self).__delitem__(key)
+        else:
+            overrides[key] = self._deleted
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+
+@contextlib.contextmanager
+def thread_local_fabric_env():
+    """Keeps fabric settings changed by threads started within the block
+    local to them, e.g. `settings(host_string=...)` of one worker does not
+    change host used by the others.
+
+    Fabric `env` is restored when the block is left, so fabric behaves as
+    usual outside of it. All the threads using fabric must be finished by
+    then.
+    """
+
+    if isinstance(env, ThreadLocalEnv):
+        yield
+        return
+    # fabric modules import `env` object directly, so it can only be changed
+    # in place (`env` maps attribute assignment to dictionary keys)
+    original_class = env.__class__
+    object.__setattr__(env, '__class__', ThreadLocalEnv)
+    try:
+        yield
+    finally:
+        object.__setattr__(env, '__class__', original_class)
+
+
 class ext_dict(dict):
     def __getattr__(self, name):
         if name in self:
@@ -317,8 +414,14 @@ class forward_agent(object):
     """
         Forwarding ssh-key for access on to source and
         destination clouds via ssh
+
+        Agent is checked and started once per process for every key, so
+        entering the context for each remote command is cheap.
     """
 
+    _forwarded_keys = set()
+    _lock = threading.Lock()
+
     def __init__(self, key_file):
         self.key_file = key_file
 
@@ -339,8 +442,17 @@ class forward_agent(object):
         return False
 
     def __enter__(self):
-        if self._agent_already_running():
+        key_path = os.path.expanduser(self.key_file)
+        if key_path in self._forwarded_keys:
             return
+        with self._lock:
+            if key_path in self._forwarded_keys:
+                return
+            if not self._agent_already_running():
+                self._start_agent()
+            self._forwarded_keys.add(key_path)
+
+    def _start_agent(self):
         start_ssh_agent = ("eval `ssh-agent` && echo $SSH_AUTH_SOCK && "
                            "ssh-add %s") % self.key_file
         info_agent = local(start_ssh_agent, capture=True).split("\n")
@@ -462,6 +574,32 @@ def get_libvirt_block_info(libvirt_name, init_host, compute_host, ssh_user,
     return libvirt_output
 
 
+def get_libvirt_block_info_batch(libvirt_names, init_host, compute_host,
+                                 ssh_user, ssh_sudo_password):
+    """Returns dict of `get_libvirt_block_info` outputs for each of
+    :libvirt_names, listing block devices of all of them with one remote
+    command. Domains missing on the host get empty lists."""
+
+    marker = '@@ '
+    cmd = "; ".join("echo '{marker}{name}'; virsh domblklist {name}".format(
+        marker=marker, name=name) for name in libvirt_names)
+    block_info = {name: [] for name in libvirt_names}
+    with settings(host_string=compute_host,
+                  user=ssh_user,
+                  password=ssh_sudo_password,
+                  gateway=init_host,
+                  connection_attempts=env.connection_attempts,
+                  warn_only=True):
+        out = sudo(cmd)
+    current = None
+    for line in out.splitlines():
+        if line.startswith(marker):
+            current = line[len(marker):].strip()
+        elif current in block_info:
+            block_info[current].extend(line.split())
+    return block_info
+
+
 def find_element_by_in(list_values, word):
     for i in list_values:
         if word in i:
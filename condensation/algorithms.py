@@ -12,6 +12,11 @@
 # See the License for the specific language governing permissions and#
 # limitations under the License.
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def accurate(flavors_list, max_ram, max_core):
     """
@@ -19,48 +24,23 @@ def accurate(flavors_list, max_ram, max_core):
     solution with dynamic programming
     Good place to start with one dimensional problem:
         http://rosettacode.org/wiki/Knapsack_problem/Bounded#Python
-    """
 
-    # allocate huge 4-dimensional array, filled with zeros
-    state = []
-    for i in range(len(flavors_list) + 1):
-        i_array = []
-        for ram in range(max_ram + 1):
-            ram_array = []
-            for core in range(max_core + 1):
-                # for each state - we keep 2 objectives
-                ram_array.append((0, 0))
-            i_array.append(ram_array)
-        state.append(i_array)
-
-    # start filling the array
-    for index in range(1, len(flavors_list) + 1):
-        flavor_ram, flavor_core = flavors_list[index - 1][1:]
-        for ram in range(1, max_ram + 1):
-            for core in range(1, max_core + 1):
-                if ram >= flavor_ram and core >= flavor_core:
-                    previous_item = state[
-                        index - 1][ram - flavor_ram][core - flavor_core]
-                    current_item = state[index - 1][ram][core]
-                    candidate_ram = previous_item[0] + flavor_ram
-                    candidate_core = previous_item[1] + flavor_core
-                    # we put item into knapsack
-                    # only if we can improve both of objectives
-                    if (candidate_ram >= current_item[0] and
-                            candidate_core >= current_item[1]):
-                        state[index][ram][core] = (candidate_ram,
-                                                   candidate_core)
-                    else:
-                        state[index][ram][core] = state[index - 1][ram][core]
-                else:
-                    state[index][ram][core] = state[index - 1][ram][core]
+    Only the previous row of the table is kept. For every item we remember
+    the cells where it was put into knapsack, that is enough to backtrack
+    the result.
+    """
+    if max_ram < 0 or max_core < 0:
+        return []
+    if numpy is not None:
+        added = _accurate_numpy(flavors_list, max_ram, max_core)
+    else:
+        added = _accurate_python(flavors_list, max_ram, max_core)
 
     # backtrack the result
     result = []
     ram, core = max_ram, max_core
     for index in range(len(flavors_list), 0, -1):
-        was_added = state[index][ram][core] != state[index - 1][ram][core]
-        if was_added:
+        if added[index - 1](ram, core):
             result.append(flavors_list[index - 1])
             flavor_ram, flavor_core = flavors_list[index - 1][1:]
             ram -= flavor_ram
@@ -68,32 +48,174 @@ def accurate(flavors_list, max_ram, max_core):
     return result
 
 
+def _accurate_python(flavors_list, max_ram, max_core):
+    width = max_core + 1
+    # for each state - we keep 2 objectives
+    state = [(0, 0)] * ((max_ram + 1) * width)
+    added = []
+    for _, flavor_ram, flavor_core in flavors_list:
+        taken = bytearray(len(state))
+        new_state = state[:]
+        shift = flavor_ram * width + flavor_core
+        for ram in range(max(flavor_ram, 1), max_ram + 1):
+            row = ram * width
+            for pos in range(row + max(flavor_core, 1), row + width):
+                previous_item = state[pos - shift]
+                current_item = state[pos]
+                candidate = (previous_item[0] + flavor_ram,
+                             previous_item[1] + flavor_core)
+                # we put item into knapsack
+                # only if we can improve both of objectives
+                if (candidate[0] >= current_item[0] and
+                        candidate[1] >= current_item[1] and
+                        candidate != current_item):
+                    new_state[pos] = candidate
+                    taken[pos] = 1
+        state = new_state
+        added.append(lambda ram, core, taken=taken:
+                     taken[ram * width + core])
+    return added
+
+
+def _accurate_numpy(flavors_list, max_ram, max_core):
+    rams = numpy.zeros((max_ram + 1, max_core + 1), dtype=numpy.int64)
+    cores = numpy.zeros_like(rams)
+    added = []
+    for _, flavor_ram, flavor_core in flavors_list:
+        first_ram, first_core = max(flavor_ram, 1), max(flavor_core, 1)
+        if first_ram > max_ram or first_core > max_core:
+            added.append(lambda ram, core: False)
+            continue
+        current = (slice(first_ram, None), slice(first_core, None))
+        previous = (slice(first_ram - flavor_ram, max_ram + 1 - flavor_ram),
+                    slice(first_core - flavor_core,
+                          max_core + 1 - flavor_core))
+        candidate_ram = rams[previous] + flavor_ram
+        candidate_core = cores[previous] + flavor_core
+        current_ram, current_core = rams[current], cores[current]
+        taken = ((candidate_ram >= current_ram) &
+                 (candidate_core >= current_core) &
+                 ((candidate_ram != current_ram) |
+                  (candidate_core != current_core)))
+        rams[current] = numpy.where(taken, candidate_ram, current_ram)
+        cores[current] = numpy.where(taken, candidate_core, current_core)
+        added.append(lambda ram, core, taken=taken, r=first_ram,
+                     c=first_core: (ram >= r and core >= c and
+                                    bool(taken[ram - r, core - c])))
+    return added
+
+
 def fast(flavors_list, max_ram, max_core):
     """
     This is implementation of unbounded multiobjective multidimensional
     knapsack problem solution
     Good place to start:
     http://rosettacode.org/wiki/Knapsack_problem/Unbounded/Python_dynamic_programming#DP.2C_multiple_size_dimensions
+
+    Instead of copying list of counts into every cell we keep the count of
+    the current flavor only and remember the cells updated by each flavor,
+    counts of the solution are restored by walking these cells back.
     """
+    if max_ram < 0 or max_core < 0:
+        return [0 for i in flavors_list]
+    if numpy is not None and all(fl_obj[2] > 0 for fl_obj in flavors_list):
+        updated = _fast_numpy(flavors_list, max_ram, max_core)
+    else:
+        updated = _fast_python(flavors_list, max_ram, max_core)
+
+    # walk back from the last cell
+    counts = [0 for i in flavors_list]
+    ram, core = max_ram, max_core
+    index = len(flavors_list) - 1
+    while index >= 0:
+        if updated[index](ram, core):
+            counts[index] += 1
+            flavor_ram, flavor_core = flavors_list[index][2:]
+            ram -= flavor_ram
+            core -= flavor_core
+            if flavor_ram or flavor_core:
+                continue
+        index -= 1
+    return counts
 
-    # prepare initial state
-    state = []
-    for ram in range(max_ram + 1):
-        state.append([[[0, 0], [0 for i in flavors_list]]
-                      for r in range(max_core + 1)])
 
-    # find solution
-    for i, fl_obj in enumerate(flavors_list):
+def _fast_python(flavors_list, max_ram, max_core):
+    width = max_core + 1
+    size = (max_ram + 1) * width
+    rams = [0] * size
+    cores = [0] * size
+    updated = []
+    for fl_obj in flavors_list:
         flavor_count, flavor_ram, flavor_core = fl_obj[1:]
+        # how many vms of this flavor is in the cell
+        used = [0] * size
+        changed = bytearray(size)
+        shift = flavor_ram * width + flavor_core
         for ram in range(flavor_ram, max_ram + 1):
-            for core in range(flavor_core, max_core + 1):
-                prev_state = state[ram - flavor_ram][core - flavor_core]
-                candidate_ram = prev_state[0][0] + flavor_ram
-                candidate_core = prev_state[0][1] + flavor_core
-                if prev_state[1][i] < flavor_count:
-                    if (state[ram][core][0][0] <= candidate_ram and
-                            state[ram][core][0][1] <= candidate_core):
-                        state[ram][core] = [
-                            [candidate_ram, candidate_core], prev_state[1][:]]
-                        state[ram][core][1][i] += 1
-    return state[max_ram][max_core][1]
+            row = ram * width
+            for pos in range(row + flavor_core, row + width):
+                prev = pos - shift
+                if used[prev] < flavor_count:
+                    candidate_ram = rams[prev] + flavor_ram
+                    candidate_core = cores[prev] + flavor_core
+                    if (rams[pos] <= candidate_ram and
+                            cores[pos] <= candidate_core):
+                        rams[pos] = candidate_ram
+                        cores[pos] = candidate_core
+                        used[pos] = used[prev] + 1
+                        changed[pos] = 1
+        updated.append(lambda ram, core, changed=changed:
+                       changed[ram * width + core])
+    return updated
+
+
+def _fast_numpy(flavors_list, max_ram, max_core):
+    rams = numpy.zeros((max_ram + 1, max_core + 1), dtype=numpy.int64)
+    cores = numpy.zeros_like(rams)
+    updated = []
+    for fl_obj in flavors_list:
+        flavor_count, flavor_ram, flavor_core = fl_obj[1:]
+        used = numpy.zeros_like(rams)
+        changed = numpy.zeros(rams.shape, dtype=bool)
+        if flavor_core <= max_core:
+            columns = max_core + 1 - flavor_core
+            # rows depend on the rows above them only, so each row can be
+            # filled at once
+            for ram in range(flavor_ram, max_ram + 1):
+                prev = ram - flavor_ram
+                candidate_ram = rams[prev, :columns] + flavor_ram
+                candidate_core = cores[prev, :columns] + flavor_core
+                current_ram = rams[ram, flavor_core:]
+                current_core = cores[ram, flavor_core:]
+                mask = ((used[prev, :columns] < flavor_count) &
+                        (current_ram <= candidate_ram) &
+                        (current_core <= candidate_core))
+                current_ram[mask] = candidate_ram[mask]
+                current_core[mask] = candidate_core[mask]
+                used[ram, flavor_core:][mask] = used[prev, :columns][mask] + 1
+                changed[ram, flavor_core:] = mask
+        updated.append(lambda ram, core, changed=changed:
+                       bool(changed[ram, core]))
+    return updated
+
+
+def greedy(flavors_list, max_ram, max_core):
+    """
+    Fills the node with as many vms of each flavor as fit, in the order of
+    flavors_list, bounded by the number of vms of the flavor.
+    Takes the same arguments and returns the same counts as `fast`, it is
+    used instead of dynamic programming when the table is too big.
+    """
+    counts = []
+    for fl_obj in flavors_list:
+        flavor_count, flavor_ram, flavor_core = fl_obj[1:]
+        count = flavor_count
+        if flavor_ram:
+            count = min(count, max_ram // flavor_ram)
+        if flavor_core:
+            count = min(count, max_core // flavor_core)
+        count = max(count, 0)
+        max_ram -= count * flavor_ram
+        max_core -= count * flavor_core
+        counts.append(count)
+    return counts
@@ -123,10 +123,41 @@ class Node(object):
         max_core = int(math.floor(free_resources[1] / self.core_factor))
         max_ram = int(math.floor(free_resources[0] / self.ram_factor))
 
+        # coarser ram scale makes the tables smaller, flavors are rounded up
+        # and node is rounded down so solution always fits the node
+        granularity = CONF.condense.ram_granularity
+        if granularity > 1:
+            max_ram //= granularity
+
+        def reduced_ram(fl_obj):
+            if granularity > 1:
+                return -(-fl_obj.reduced_ram // granularity)
+            return fl_obj.reduced_ram
+
         flavors_dict = {}
         flavors_list = []
         result_dict = {}
-        if accurate:
+        vms_count = sum(count for count in flavors.values() if count > 0)
+        size = (max(max_ram, 0) + 1) * (max(max_core, 0) + 1) * (
+            vms_count if accurate else len(flavors))
+        if 0 < CONF.condense.max_knapsack_size < size:
+            # table is too big, fill the node with biggest flavors first
+            flavor_id, flavor_count, flavor_ram, flavor_core = range(4)
+            for fl_obj, count in flavors.items():
+                flavors_dict[fl_obj.fl_id] = fl_obj
+                flavors_list.append(
+                    (fl_obj.fl_id, count, reduced_ram(fl_obj),
+                     fl_obj.reduced_core))
+            flavors_list = sorted(flavors_list,
+                                  key=lambda a: (a[flavor_ram],
+                                                 a[flavor_core]),
+                                  reverse=True)
+            for index, i in enumerate(algorithms.greedy(
+                    flavors_list, max_ram, max_core)):
+                if i:
+                    flavor = flavors_dict[flavors_list[index][flavor_id]]
+                    result_dict[flavor] = i
+        elif accurate:
             # convert data from dict to list of tuples (algorithm interface)
             flavor_id, flavor_ram, flavor_core = range(3)
             for fl_obj, count in flavors.items():
@@ -134,7 +165,7 @@ class Node(object):
                 for i in range(count):
                     flavors_list.append(
                         (fl_obj.fl_id,
-                         fl_obj.reduced_ram, fl_obj.reduced_core))
+                         reduced_ram(fl_obj), fl_obj.reduced_core))
             # convert output of algorithm to application interface (dict)
             for i in algorithms.accurate(flavors_list, max_ram, max_core):
                 flavor = flavors_dict[i[flavor_id]]
@@ -149,7 +180,7 @@ class Node(object):
             for fl_obj, count in flavors.items():
                 flavors_dict[fl_obj.fl_id] = fl_obj
                 flavors_list.append(
-                    (fl_obj.fl_id, count, fl_obj.reduced_ram,
+                    (fl_obj.fl_id, count, reduced_ram(fl_obj),
                      fl_obj.reduced_core))
             # sort flavors by ram
             flavors_list = sorted(flavors_list, key=lambda a: a[flavor_ram],
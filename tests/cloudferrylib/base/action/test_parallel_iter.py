@@ -0,0 +1,122 @@
+# Copyright 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import mock
+
+from cloudferrylib.base.action import parallel_iter
+from cloudferrylib.scheduler import task
+from tests import test
+
+
+class MarkInstance(task.Task):
+    def __init__(self, lock, active, max_active):
+        self.lock = lock
+        self.active = active
+        self.max_active = max_active
+        super(MarkInstance, self).__init__()
+
+    def run(self, info=None, **kwargs):
+        with self.lock:
+            self.active.append(1)
+            self.max_active.append(len(self.active))
+        for inst in info['instances'].values():
+            inst['meta']['migrated'] = True
+        with self.lock:
+            self.active.pop()
+        return {'info': info}
+
+
+class FailInstance(task.Task):
+    def run(self, info=None, **kwargs):
+        if 'bad' in info['instances']:
+            raise RuntimeError('boom')
+
+
+def make_instances(*hosts):
+    return {'vm%d' % i: {'instance': {'host': host,
+                                      'boot_mode': 'boot_image'},
+                         'meta': {}}
+            for i, host in enumerate(hosts)}
+
+
+class ParallelIterTestCase(test.TestCase):
+    def setUp(self):
+        super(ParallelIterTestCase, self).setUp()
+        self.cfg = mock.Mock()
+        self.cfg.migrate.instance_workers = 4
+        self.cfg.migrate.instance_workers_per_host = 0
+        self.cfg.migrate.instance_workers_per_storage = 0
+        self.cfg.src_compute.backend = 'ceph'
+        self.max_active = []
+        self.net = MarkInstance(threading.Lock(), [], self.max_active)
+
+    def run_action(self, instances, net=None):
+        action = parallel_iter.ParallelIter({'cfg': self.cfg},
+                                            net=net or self.net)
+        return action.run(info_iter={'instances': instances},
+                          info_result={'instances': {}})
+
+    def test_all_instances_are_merged_into_result(self):
+        instances = make_instances('h1', 'h2', 'h3', 'h1', 'h2')
+
+        result = self.run_action(dict(instances))['info_result']
+
+        self.assertEqual(set(instances), set(result['instances']))
+        for inst in result['instances'].values():
+            self.assertTrue(inst['meta']['migrated'])
+
+    def test_serial_mode_processes_one_instance_at_time(self):
+        self.cfg.migrate.instance_workers = 1
+
+        self.run_action(make_instances('h1', 'h2', 'h3'))
+
+        self.assertEqual([1, 1, 1], self.max_active)
+
+    def test_error_is_raised_after_running_instances_finish(self):
+        instances = make_instances('h1', 'h2')
+        instances['bad'] = make_instances('h3')['vm0']
+
+        self.assertRaises(RuntimeError, self.run_action, instances,
+                          FailInstance())
+
+    def test_per_host_limit_is_applied(self):
+        self.cfg.migrate.instance_workers_per_host = 1
+        action = parallel_iter.ParallelIter({'cfg': self.cfg}, net=self.net)
+        started = []
+        action._start = mock.Mock(
+            side_effect=lambda obj_id, obj, kw, finished, in_thread: (
+                started.append(obj['instance']['host']),
+                finished.put((obj_id, {'instances': {obj_id: obj}}, None))))
+
+        action.run(info_iter={'instances': make_instances('h1', 'h1', 'h2')},
+                   info_result={'instances': {}})
+
+        self.assertEqual(3, len(started))
+        self.assertEqual(2, len(set(started[:2])))
+
+    def test_copy_net_keeps_links_and_creates_new_elements(self):
+        first = task.Task()
+        second = task.Task()
+        alternative = task.Task()
+        net = first >> (second | alternative)
+
+        net_copy = parallel_iter.copy_net(net)
+
+        self.assertIsNot(net, net_copy)
+        self.assertIsNot(second, net_copy)
+        start = net_copy.go_start()
+        self.assertIs(start.next_element[0], net_copy)
+        self.assertIsNot(alternative, net_copy.next_element[1])
@@ -55,3 +55,45 @@ class ClientsTestCase(test.TestCase):
 
         self.assertTrue(cmd.startswith(client))
         self.assertTrue(cmd.endswith(" ".join(args)))
+
+
+class ClientRegistryTestCase(test.TestCase):
+    def setUp(self):
+        super(ClientRegistryTestCase, self).setUp()
+        self.registry = clients.ClientRegistry()
+        self.factory = mock.Mock(side_effect=lambda: mock.Mock())
+
+    def test_returns_same_client_for_same_credentials(self):
+        client1 = self.registry.get('compute', 't1', 'user', self.factory)
+        client2 = self.registry.get('compute', 't1', 'user', self.factory)
+
+        self.assertIs(client1, client2)
+        self.assertEqual(1, self.factory.call_count)
+
+    def test_creates_client_per_tenant(self):
+        client1 = self.registry.get('compute', 't1', 'user', self.factory)
+        client2 = self.registry.get('compute', 't2', 'user', self.factory)
+
+        self.assertIsNot(client1, client2)
+
+    def test_recreates_client_when_token_changes(self):
+        client1 = self.registry.get('image', 't1', 'user', self.factory,
+                                    token='token1')
+        client2 = self.registry.get('image', 't1', 'user', self.factory,
+                                    token='token1')
+        client3 = self.registry.get('image', 't1', 'user', self.factory,
+                                    token='token2')
+
+        self.assertIs(client1, client2)
+        self.assertIsNot(client1, client3)
+
+    def test_invalidates_only_matching_clients(self):
+        compute = self.registry.get('compute', 't1', 'user', self.factory)
+        network = self.registry.get('network', 't2', 'user', self.factory)
+
+        self.registry.invalidate(tenant='t1', user='user')
+
+        self.assertIsNot(compute, self.registry.get('compute', 't1', 'user',
+                                                    self.factory))
+        self.assertIs(network, self.registry.get('network', 't2', 'user',
+                                                 self.factory))
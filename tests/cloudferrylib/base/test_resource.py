@@ -66,3 +66,47 @@ class ResourceTestCase(test.TestCase):
         self.fake_get_status.assert_called_once_with(1)
         if mock_sleep.called:
             self.fail('Sleep has been called')
+
+
+@mock.patch('cloudferrylib.base.resource.time.sleep')
+class StatusWatcherTestCase(test.TestCase):
+    def test_statuses_are_polled_for_all_resources_at_once(self, mock_sleep):
+        get_statuses = mock.Mock(side_effect=[
+            {1: 'building', 2: 'building'},
+            {1: 'ACTIVE', 2: 'building'},
+            {2: 'active'}])
+        watcher = resource.StatusWatcher(get_statuses)
+        watches = [watcher.watch(i, 'active') for i in (1, 2)]
+
+        self.assertEqual(['ACTIVE', 'active'], watcher.wait(watches))
+        get_statuses.assert_has_calls([mock.call([1, 2]),
+                                       mock.call([1, 2]),
+                                       mock.call([2])])
+        mock_sleep.assert_called_once_with(1)
+
+    def test_poll_interval_grows_while_nothing_changes(self, mock_sleep):
+        get_statuses = mock.Mock(return_value={1: 'building'})
+        watcher = resource.StatusWatcher(get_statuses, max_interval=4)
+        watch = watcher.watch(1, ['active', 'error'], timeout=10)
+
+        self.assertRaises(t_exc, watcher.wait, [watch])
+        self.assertEqual([1, 2, 4, 4],
+                         [c[0][0] for c in mock_sleep.call_args_list])
+        self.assertEqual('building', watch.status)
+
+    def test_callback_is_called_once_resolved(self, _):
+        callback = mock.Mock()
+        watcher = resource.StatusWatcher(mock.Mock(return_value={1: 'ok'}))
+        watch = watcher.watch(1, 'ok', callback=callback)
+
+        watcher.wait([watch])
+        callback.assert_called_once_with(watch)
+
+    def test_wait_for_own_status_uses_watcher(self, mock_sleep):
+        res = resource.Resource()
+        res.get_statuses = mock.Mock(side_effect=[{1: 'offline'},
+                                                  {1: 'online'}])
+
+        res.wait_for_status(1, res.get_status, 'online')
+        self.assertEqual(2, res.get_statuses.call_count)
+        mock_sleep.assert_called_once_with(1)
@@ -0,0 +1,99 @@
+# Copyright 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+import mock
+
+from cloudferrylib.os.actions import task_transfer
+from cloudferrylib.utils import utils
+from tests import test
+
+
+class FakeDriver(object):
+    def __init__(self, *args):
+        self.lock = threading.Lock()
+        self.active = []
+        self.max_active = {}
+        self.started = []
+
+    def transfer(self, data):
+        with self.lock:
+            self.started.append(data['id'])
+            self.active.append(data)
+            for key in ('host_src', 'volume_type', None):
+                value = data.get(key) if key else 'all'
+                active = len([d for d in self.active
+                              if (d.get(key) if key else 'all') == value])
+                self.max_active[value] = max(
+                    self.max_active.get(value, 0), active)
+        time.sleep(0.01)
+        with self.lock:
+            self.active.remove(data)
+
+
+class TaskTransferTestCase(test.TestCase):
+    def setUp(self):
+        super(TaskTransferTestCase, self).setUp()
+        self.cfg = utils.ext_dict(migrate=utils.ext_dict({
+            'transfer_workers': 4,
+            'transfer_workers_per_host': 1,
+            'transfer_workers_per_backend': 0,
+            'transfer_largest_first': True}))
+        self.init = {'src_cloud': mock.Mock(),
+                     'dst_cloud': mock.Mock(),
+                     'cfg': self.cfg,
+                     'driver': FakeDriver}
+        self.info = {'volumes': {
+            str(i): {'volume': {'id': str(i),
+                                'size': i,
+                                'volume_type': 'type%d' % (i % 2),
+                                'host_src': 'host%d' % (i % 3),
+                                'host_dst': 'dst%d' % i}}
+            for i in range(12)}}
+
+    def transfer(self):
+        action = task_transfer.TaskTransfer(self.init, 'driver')
+        action.run(info=self.info)
+        return action.driver
+
+    def test_all_volumes_are_copied(self):
+        driver = self.transfer()
+        self.assertEqual(sorted(self.info['volumes']), sorted(driver.started))
+
+    def test_copies_per_host_are_limited(self):
+        driver = self.transfer()
+        self.assertEqual(3, driver.max_active['all'])
+        for host in ('host0', 'host1', 'host2'):
+            self.assertEqual(1, driver.max_active[host])
+
+    def test_copies_per_backend_are_limited(self):
+        self.cfg.migrate.transfer_workers_per_host = 0
+        self.cfg.migrate.transfer_workers_per_backend = 1
+        driver = self.transfer()
+        self.assertEqual(1, driver.max_active['type0'])
+        self.assertEqual(1, driver.max_active['type1'])
+
+    def test_largest_volumes_are_copied_first(self):
+        self.cfg.migrate.transfer_workers = 1
+        driver = self.transfer()
+        self.assertEqual([str(i) for i in range(11, -1, -1)], driver.started)
+
+    def test_error_is_raised_after_running_copies_finish(self):
+        driver = mock.Mock()
+        driver.transfer.side_effect = [None, RuntimeError()] + [None] * 10
+        self.init['driver'] = mock.Mock(return_value=driver)
+        action = task_transfer.TaskTransfer(self.init, 'driver')
+        self.assertRaises(RuntimeError, action.run, info=self.info)
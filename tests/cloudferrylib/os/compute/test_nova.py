@@ -19,6 +19,7 @@ import mock
 from novaclient.v1_1 import client as nova_client
 from oslotest import mockpatch
 
+from cloudferrylib.base import clients
 from cloudferrylib.os.compute import nova_compute
 from cloudferrylib.utils import timeout_exception
 from cloudferrylib.utils import utils
@@ -53,6 +54,7 @@ class NovaComputeTestCase(test.TestCase):
         self.identity_mock = mock.Mock()
 
         self.fake_cloud = mock.Mock()
+        self.fake_cloud.clients = clients.ClientRegistry()
         self.fake_cloud.resources = dict(identity=self.identity_mock)
         self.fake_cloud.position = 'src'
 
@@ -320,6 +322,57 @@ class DeployInstanceWithManualScheduling(test.TestCase):
         self.assertEqual(nc.deploy_instance.call_count, 1)
 
 
+@mock.patch('cloudferrylib.os.compute.nova_compute.time.sleep')
+class DeployAllInstancesTestCase(test.TestCase):
+    def setUp(self):
+        super(DeployAllInstancesTestCase, self).setUp()
+        self.nc = mock.Mock()
+        self.nc.config.migrate.boot_workers = 2
+        self.nc.get_compute_hosts.return_value = ['host1', 'host2']
+        self.requests = [
+            ({'availability_zone': 'zone', 'name': name}, {'name': name},
+             mock.Mock())
+            for name in ('vm1', 'vm2')]
+
+    def test_all_vms_are_waited_for_with_one_request(self, _):
+        self.nc.boot_instance.side_effect = ['id1', 'id2']
+        self.nc.get_changed_statuses.side_effect = [
+            {'id1': 'ACTIVE', 'id2': 'BUILD'},
+            {'id2': 'ACTIVE'}]
+
+        deployer = nova_compute.RandomSchedulerVmDeployer(self.nc)
+        new_ids = deployer.deploy_all(self.requests)
+
+        self.assertEqual(['id1', 'id2'], sorted(new_ids))
+        self.assertEqual(2, self.nc.boot_instance.call_count)
+        self.assertEqual(2, self.nc.get_changed_statuses.call_count)
+
+    def test_failed_vm_is_rescheduled_without_blocking_others(self, _):
+        self.nc.config.migrate.boot_workers = 1
+        self.nc.boot_instance.side_effect = ['id1', 'id2', 'id3']
+        self.nc.get_changed_statuses.side_effect = [
+            {'id1': 'ERROR', 'id2': 'ACTIVE'},
+            {'id3': 'ACTIVE'}]
+
+        deployer = nova_compute.RandomSchedulerVmDeployer(self.nc)
+        new_ids = deployer.deploy_all(self.requests)
+
+        self.assertEqual(['id3', 'id2'], new_ids)
+        self.nc.delete_vm_by_id.assert_called_once_with('id1')
+        self.assertIn(self.requests[0][1]['availability_zone'],
+                      ['zone:host1', 'zone:host2'])
+
+    def test_fails_if_vm_does_not_boot_on_any_node(self, _):
+        self.nc.boot_instance.side_effect = ['id1', 'id2', 'id3']
+        self.nc.get_changed_statuses.return_value = {
+            'id1': 'ERROR', 'id2': 'ERROR', 'id3': 'ERROR'}
+
+        deployer = nova_compute.RandomSchedulerVmDeployer(self.nc)
+        self.assertRaises(nova_compute.DestinationCloudNotOperational,
+                          deployer.deploy_all, self.requests[:1])
+        self.assertEqual(3, self.nc.boot_instance.call_count)
+
+
 class FlavorDeploymentTestCase(test.TestCase):
     def test_flavor_is_updated_with_destination_id(self):
         config = mock.Mock()
@@ -503,3 +556,41 @@ class NovaClientTestCase(test.TestCase):
 
         n_client.assert_called_with(user, password, tenant, auth_url,
                                     cacert=cacert, insecure=insecure)
+
+
+class InstanceInfoBatchTestCase(test.TestCase):
+    def setUp(self):
+        super(InstanceInfoBatchTestCase, self).setUp()
+        self.compute = mock.Mock()
+        self.compute.config.migrate.instance_read_workers = 2
+        self.compute.config.migrate.direct_compute_transfer = False
+        self.compute.mysql_connector.execute.side_effect = [
+            [{'uuid': 'vm1', 'vcpus': 1, 'memory_mb': 512, 'root_gb': 1,
+              'ephemeral_gb': 0}],
+            [{'instance_uuid': 'vm1', 'volume_id': 'vol1',
+              'device_name': '/dev/vdb'}]]
+
+    def instance(self, instance_id, host, flavor_id):
+        instance = mock.Mock(id=instance_id, flavor={'id': flavor_id})
+        setattr(instance, nova_compute.INSTANCE_HOST_ATTRIBUTE, host)
+        setattr(instance, nova_compute.INSTANCE_LIBVIRT_NAME_ATTRIBUTE,
+                'instance-' + instance_id)
+        return instance
+
+    @mock.patch('cloudferrylib.utils.utils.get_libvirt_block_info_batch')
+    def test_block_info_is_read_once_per_host(self, block_info):
+        block_info.side_effect = lambda names, *args: {n: [n] for n in names}
+        instances = [self.instance('vm1', 'host1', 'f1'),
+                     self.instance('vm2', 'host2', 'f1'),
+                     self.instance('vm3', 'host1', 'f2')]
+
+        batch = nova_compute.InstanceInfoBatch(self.compute, instances)
+
+        self.assertEqual(2, block_info.call_count)
+        self.assertEqual(['instance-vm3'], batch.block_info['instance-vm3'])
+        self.assertEqual(2, self.compute.get_flavor_from_id.call_count)
+        self.assertEqual(2, self.compute.mysql_connector.execute.call_count)
+        self.assertEqual([{'id': 'vol1', 'device': '/dev/vdb'}],
+                         batch.volumes['vm1'])
+        self.assertEqual([], batch.volumes['vm2'])
+        self.assertEqual(512, batch.flav_details['vm1']['memory_mb'])
@@ -21,6 +21,7 @@ from keystoneclient.v2_0 import client as keystone_client
 from oslotest import mockpatch
 
 import cfglib
+from cloudferrylib.base import clients
 from cloudferrylib.os.identity import keystone
 from cloudferrylib.utils import utils
 from tests import test
@@ -41,7 +42,8 @@ FAKE_CONFIG = utils.ext_dict(
                             'keep_user_passwords': False,
                             'overwrite_user_passwords': False,
                             'migrate_users': True,
-                            'optimize_user_role_fetch': False}),
+                            'optimize_user_role_fetch': False,
+                            'identity_cache_ttl': 0}),
     mail=utils.ext_dict({'server': '-'}))
 
 
@@ -54,6 +56,7 @@ class KeystoneIdentityTestCase(test.TestCase):
                                               new=self.mock_client)
         self.useFixture(self.kc_patch)
         self.fake_cloud = mock.Mock()
+        self.fake_cloud.clients = clients.ClientRegistry()
         self.fake_cloud.mysql_connector = mock.Mock()
 
         self.keystone_client = keystone.KeystoneIdentity(FAKE_CONFIG,
@@ -104,10 +107,19 @@ class KeystoneIdentityTestCase(test.TestCase):
         self.fake_same_user.id = 'fake_same_id'
         self.fake_same_user.name = 'fake_same_name'
 
-    def test_get_client_generates_new_token(self):
+    def test_keystone_client_is_reused(self):
+        self.mock_client.reset_mock()
+
         client1 = self.keystone_client.keystone_client
         client2 = self.keystone_client.keystone_client
-        self.assertFalse(client1 == client2)
+
+        self.assertIs(client1.client, client2.client)
+        self.assertEqual(1, self.mock_client.call_count)
+
+    def test_get_client_talks_to_auth_url(self):
+        client = self.keystone_client.get_client()
+
+        self.assertEqual('http://1.1.1.1:35357/v2.0', client.management_url)
 
     def test_get_tenants_list(self):
         fake_tenants_list = [self.fake_tenant_0, self.fake_tenant_1]
@@ -127,11 +139,107 @@ class KeystoneIdentityTestCase(test.TestCase):
 
     def test_get_tenant_by_name_default(self):
         self.mock_client().tenants.list.return_value = []
+        self.mock_client().tenants.find.side_effect = exceptions.NotFound(
+            404)
 
         tenant = self.keystone_client.get_tenant_by_name('tenant_name_0')
 
         self.assertIsNone(tenant)
 
+    def test_identity_lookups_use_identity_map(self):
+        self.mock_client().tenants.list.return_value = [self.fake_tenant_0,
+                                                        self.fake_tenant_1]
+        self.mock_client().users.list.return_value = [self.fake_user_0]
+        self.mock_client().tenants.get.side_effect = exceptions.NotFound(404)
+
+        for _ in range(3):
+            self.assertEqual(
+                self.fake_tenant_1.name,
+                self.keystone_client.try_get_tenant_name_by_id(
+                    self.fake_tenant_1.id))
+            self.assertEqual(
+                self.fake_tenant_0.id,
+                self.keystone_client.get_tenant_id_by_name(
+                    self.fake_tenant_0.name))
+            self.assertEqual(
+                self.fake_user_0.name,
+                self.keystone_client.try_get_username_by_id(
+                    self.fake_user_0.id))
+            self.assertEqual('default',
+                             self.keystone_client.try_get_tenant_name_by_id(
+                                 'missing', default='default'))
+
+        self.assertEqual(1, self.mock_client().tenants.list.call_count)
+        self.assertEqual(1, self.mock_client().users.list.call_count)
+        self.mock_client().tenants.get.assert_called_once_with('missing')
+        self.assertFalse(self.mock_client().tenants.find.called)
+
+    def test_missing_tenant_is_read_and_added_to_identity_map(self):
+        self.mock_client().tenants.list.return_value = [self.fake_tenant_0]
+        self.mock_client().tenants.get.return_value = self.fake_tenant_1
+
+        for _ in range(2):
+            self.assertEqual(
+                self.fake_tenant_1.name,
+                self.keystone_client.try_get_tenant_name_by_id(
+                    self.fake_tenant_1.id))
+
+        self.mock_client().tenants.get.assert_called_once_with(
+            self.fake_tenant_1.id)
+        self.assertEqual(1, self.mock_client().tenants.list.call_count)
+
+    def test_created_tenant_is_added_to_identity_map(self):
+        self.mock_client().tenants.list.return_value = [self.fake_tenant_0]
+        self.mock_client().tenants.create.return_value = self.fake_tenant_1
+        self.keystone_client.get_tenants_list()
+
+        self.keystone_client.create_tenant(self.fake_tenant_1.name)
+
+        self.assertEqual([self.fake_tenant_0, self.fake_tenant_1],
+                         self.keystone_client.get_tenants_list())
+        self.assertEqual(1, self.mock_client().tenants.list.call_count)
+
+    def test_user_passwords_are_read_with_single_query(self):
+        self.mock_client().users.list.return_value = [self.fake_user_0,
+                                                      self.fake_user_1]
+        self.fake_cloud.mysql_connector().execute.return_value = [
+            (self.fake_user_0.id, 'hash_0'), (self.fake_user_1.id, 'hash_1'),
+            ('other_user_id', 'hash_2')]
+
+        self.assertEqual({self.fake_user_0.name: 'hash_0',
+                          self.fake_user_1.name: 'hash_1'},
+                         self.keystone_client._get_user_passwords())
+        self.assertEqual(
+            1, self.fake_cloud.mysql_connector().execute.call_count)
+
+    def test_roles_are_read_with_v3_role_assignments(self):
+        tenants = [self.fake_tenant_0, self.fake_tenant_1]
+        users = [self.fake_user_0, self.fake_user_1]
+        self.mock_client().roles.list.return_value = [self.fake_role_0,
+                                                      self.fake_role_1]
+        self.mock_client().request.return_value = (None, {
+            'role_assignments': [
+                {'role': {'id': self.fake_role_1.id},
+                 'user': {'id': self.fake_user_0.id},
+                 'scope': {'project': {'id': self.fake_tenant_1.id}}},
+                {'role': {'id': self.fake_role_0.id},
+                 'group': {'id': 'group_id'},
+                 'scope': {'project': {'id': self.fake_tenant_1.id}}}]})
+
+        roles = self.keystone_client._get_user_tenants_roles_by_api(tenants,
+                                                                    users)
+
+        self.mock_client().request.assert_called_once_with(
+            'http://1.1.1.1:35357/v3/role_assignments', 'GET',
+            authenticated=True)
+        self.assertFalse(self.mock_client().roles.roles_for_user.called)
+        self.assertEqual(
+            [{'role': {'name': self.fake_role_1.name,
+                       'id': self.fake_role_1.id}}],
+            roles[self.fake_user_0.name][self.fake_tenant_1.name])
+        self.assertEqual([], roles[self.fake_user_1.name][
+            self.fake_tenant_1.name])
+
     def test_get_users_list(self):
         fake_users_list = [self.fake_user_0, self.fake_user_1]
         self.mock_client().users.list.return_value = fake_users_list
@@ -141,7 +249,7 @@ class KeystoneIdentityTestCase(test.TestCase):
         self.assertEqual(fake_users_list, users_list)
 
     def test_get_roles_list(self):
-        fake_roles_list = ['fake_role_0', 'fake_role_1']
+        fake_roles_list = [self.fake_role_0, self.fake_role_1]
         self.mock_client().roles.list.return_value = fake_roles_list
 
         roles_list = self.keystone_client.get_roles_list()
@@ -499,6 +607,45 @@ class AddAdminToNonAdminTenantTestCase(test.TestCase):
         assert ksclient.roles.add_user_role.called
         assert ksclient.roles.remove_user_role.called
 
+    def test_cached_clients_are_invalidated_on_role_change(self):
+        ksclient = mock.MagicMock()
+        ksclient.users.find.return_value.name = 'adm'
+        ksclient.tenants.find.return_value.name = 'tenant'
+        registry = clients.ClientRegistry()
+        registry.get('compute', 'tenant', 'adm', mock.Mock)
+        keystone_factory = mock.Mock(return_value=ksclient)
+
+        with keystone.AddAdminUserToNonAdminTenant(
+                ksclient, 'adm', 'tenant', client_registry=registry,
+                keystone_factory=keystone_factory):
+            client = registry.get('compute', 'tenant', 'adm', mock.Mock)
+            admin_client = registry.get('identity', 'admin', 'adm',
+                                        mock.Mock)
+
+        self.assertIsNot(client,
+                         registry.get('compute', 'tenant', 'adm', mock.Mock))
+        # all tokens of the user are revoked, not only ones of the tenant
+        self.assertIsNot(admin_client,
+                         registry.get('identity', 'admin', 'adm', mock.Mock))
+        self.assertEqual(2, keystone_factory.call_count)
+
+    def test_role_is_shared_by_blocks_entered_at_once(self):
+        ksclient = mock.MagicMock()
+        first = keystone.AddAdminUserToNonAdminTenant(ksclient, 'adm',
+                                                      'tenant')
+        second = keystone.AddAdminUserToNonAdminTenant(ksclient, 'adm',
+                                                       'tenant')
+
+        with first:
+            with second:
+                pass
+            assert not ksclient.roles.remove_user_role.called
+
+        ksclient.roles.add_user_role.assert_called_once_with(
+            user=mock.ANY, role=mock.ANY, tenant=mock.ANY)
+        ksclient.roles.remove_user_role.assert_called_once_with(
+            user=mock.ANY, role=mock.ANY, tenant=mock.ANY)
+
     def test_nothing_happens_if_admin_is_already_member_of_a_tenant(self):
         ksclient = mock.MagicMock()
         role_name = 'member'
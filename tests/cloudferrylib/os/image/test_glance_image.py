@@ -14,10 +14,12 @@
 
 
 import mock
+from glanceclient import exc as glance_exceptions
 
 from glanceclient.v1 import client as glance_client
 from oslotest import mockpatch
 
+from cloudferrylib.base import clients
 from cloudferrylib.os.image.glance_image import GlanceImage
 from cloudferrylib.utils import utils
 from tests import test
@@ -34,7 +36,8 @@ FAKE_CONFIG = utils.ext_dict(cloud=utils.ext_dict({'user': 'fake_user',
                                                    }),
                              migrate=utils.ext_dict({'speed_limit': '10MB',
                                                      'retry': '7',
-                                                     'time_wait': 5}))
+                                                     'time_wait': 5,
+                                                     'image_workers': 1}))
 
 
 class FakeUser(object):
@@ -68,6 +71,7 @@ class GlanceImageTestCase(test.TestCase):
         self.image_mock = mock.Mock()
 
         self.fake_cloud = mock.Mock()
+        self.fake_cloud.clients = clients.ClientRegistry()
         self.fake_cloud.position = 'dst'
 
         self.fake_cloud.resources = dict(identity=self.identity_mock,
@@ -186,13 +190,97 @@ class GlanceImageTestCase(test.TestCase):
         self.assertEquals(self.fake_image_2,
                           self.glance_image.get_image('fake_image_name_2'))
 
-    def test_get_image_status(self):
+    def test_images_are_listed_once_for_lookups(self):
         fake_images = [self.fake_image_1, self.fake_image_2]
         self.glance_mock_client().images.list.return_value = fake_images
 
+        self.glance_image.get_image_by_id('fake_image_id_1')
+        self.glance_image.get_image_by_name('fake_image_name_2')
+        self.glance_image.get_image('fake_image_name_1')
+        self.assertEqual(
+            ['fake_image_id_1'],
+            self.glance_image.get_img_id_list_by_checksum('fake_shecksum_1'))
+
+        self.assertEqual(1, self.glance_mock_client().images.list.call_count)
+
+    def test_catalog_is_reloaded_if_image_is_missing(self):
+        self.glance_mock_client().images.list.return_value = [
+            self.fake_image_1]
+        self.glance_mock_client().images.get.side_effect = (
+            glance_exceptions.HTTPNotFound)
+        self.glance_image.get_image_by_id('fake_image_id_1')
+        self.glance_mock_client().images.list.return_value = [
+            self.fake_image_1, self.fake_image_2]
+
+        self.assertEqual(self.fake_image_2,
+                         self.glance_image.get_image('fake_image_name_2'))
+        self.assertEqual(2, self.glance_mock_client().images.list.call_count)
+
+    def test_catalog_is_reloaded_once_per_missing_name(self):
+        self.glance_mock_client().images.list.return_value = [
+            self.fake_image_1]
+
+        self.assertIsNone(self.glance_image.get_image_by_name('missing'))
+        self.assertIsNone(self.glance_image.get_image_by_name('missing'))
+        self.assertEqual(2, self.glance_mock_client().images.list.call_count)
+
+    def test_missing_id_is_read_with_single_get(self):
+        self.glance_mock_client().images.list.return_value = [
+            self.fake_image_2]
+        self.glance_mock_client().images.get.return_value = (
+            self.fake_image_1)
+        self.glance_image.get_image_by_name('fake_image_name_2')
+
+        self.assertEqual(self.fake_image_1,
+                         self.glance_image.get_image_by_id('fake_image_id_1'))
+        self.assertEqual(self.fake_image_1,
+                         self.glance_image.get_image_by_id('fake_image_id_1'))
+        self.glance_mock_client().images.get.assert_called_once_with(
+            'fake_image_id_1')
+        self.assertEqual(1, self.glance_mock_client().images.list.call_count)
+
+    def test_missing_id_not_found(self):
+        self.glance_mock_client().images.list.return_value = []
+        self.glance_mock_client().images.get.side_effect = (
+            glance_exceptions.HTTPNotFound)
+
+        self.assertIsNone(self.glance_image.get_image_by_id('missing'))
+
+    def test_catalog_is_updated_on_create_and_delete(self):
+        self.glance_mock_client().images.list.return_value = [
+            self.fake_image_2]
+        self.glance_mock_client().images.create.return_value = (
+            self.fake_image_1)
+        self.glance_image.get_image_by_name('fake_image_name_2')
+
+        self.glance_image.create_image(name='fake_image_name_1')
+        self.assertEqual(
+            self.fake_image_1,
+            self.glance_image.catalog.get_by_checksum_and_name(
+                'fake_shecksum_1', 'fake_image_name_1'))
+
+        self.glance_image.delete_image('fake_image_id_1')
+        self.assertIsNone(
+            self.glance_image.catalog.get_by_id('fake_image_id_1'))
+        self.assertEqual([], self.glance_image.catalog.get_by_checksum(
+            'fake_shecksum_1'))
+        self.assertEqual(1, self.glance_mock_client().images.list.call_count)
+
+    def test_get_image_status(self):
+        self.glance_mock_client().images.list.return_value = [
+            self.fake_image_2]
+        self.glance_mock_client().images.get.return_value = (
+            self.fake_image_1)
+        self.glance_image.get_image_by_name('fake_image_name_2')
+
         self.assertEquals(self.fake_image_1.status,
                           self.glance_image.get_image_status(
                               'fake_image_id_1'))
+        self.glance_mock_client().images.get.assert_called_once_with(
+            'fake_image_id_1')
+        self.assertEqual(self.fake_image_1,
+                         self.glance_image.catalog.get_by_id(
+                             'fake_image_id_1'))
 
     def test_get_ref_image(self):
         fake_images = [self.fake_image_1, self.fake_image_2]
@@ -202,8 +290,8 @@ class GlanceImageTestCase(test.TestCase):
                           self.glance_image.get_ref_image('fake_image_id_1'))
 
     def test_get_image_checksum(self):
-        fake_images = [self.fake_image_1, self.fake_image_2]
-        self.glance_mock_client().images.list.return_value = fake_images
+        self.glance_mock_client().images.get.return_value = (
+            self.fake_image_1)
 
         self.assertEquals(self.fake_image_1.checksum,
                           self.glance_image.get_image_checksum(
@@ -248,3 +336,84 @@ class GlanceImageTestCase(test.TestCase):
 
         info = self.glance_image.read_info()
         self.assertEqual(self.fake_result_info, info)
+
+    @mock.patch('cloudferrylib.os.image.glance_image.file_like_proxy.'
+                'FileLikeProxy')
+    def test_upload_images_keeps_order_and_shares_speed_limit(self, proxy):
+        images = []
+        for i in range(5):
+            img = dict(self.fake_result_info['images']['fake_image_id_1'][
+                'image'], id='id_%d' % i, name='name_%d' % i)
+            images.append(img)
+        self.glance_image.create_image = mock.Mock(
+            side_effect=lambda **kw: mock.Mock(id='new_' + kw['name']))
+
+        with mock.patch.dict(FAKE_CONFIG.migrate, image_workers=2):
+            created = self.glance_image.upload_images(images)
+
+        self.assertEqual(['new_name_%d' % i for i in range(5)],
+                         [c.id for c in created])
+        buckets = set(c[0][2] for c in proxy.call_args_list)
+        self.assertEqual(1, len(buckets))
+        self.assertEqual(10 * 1024 * 1024, buckets.pop().rate)
+
+    @mock.patch('cloudferrylib.os.image.glance_image.file_like_proxy.'
+                'FileLikeProxy')
+    def test_upload_image_is_retried(self, proxy):
+        img = self.fake_result_info['images']['fake_image_id_1']['image']
+        self.glance_image.create_image = mock.Mock(
+            side_effect=[RuntimeError, self.fake_image_1])
+
+        self.assertEqual(self.fake_image_1,
+                         self.glance_image.upload_image(img, '-'))
+        self.assertEqual(2, proxy.call_count)
+
+    @mock.patch('cloudferrylib.os.image.glance_image.file_like_proxy.'
+                'FileLikeProxy')
+    def test_partial_image_is_deleted_before_retry(self, proxy):
+        img = self.fake_result_info['images']['fake_image_id_1']['image']
+        partial = mock.Mock(id='partial', owner='fake_tenant_id')
+        partial.name = 'fake_image_name_1'
+        self.glance_mock_client().images.list.side_effect = [
+            [self.fake_image_1], [self.fake_image_1, partial]]
+        self.glance_image.catalog.get_by_id('fake_image_id_1')
+        self.glance_image.create_image = mock.Mock(
+            side_effect=[RuntimeError, self.fake_image_1])
+
+        self.glance_image.upload_image(img, '-')
+        self.glance_mock_client().images.delete.assert_called_once_with(
+            'partial')
+
+    def test_read_info_prefetches_locations_and_members(self):
+        images = []
+        for i in range(3):
+            img = mock.MagicMock(id='id_%d' % i, status='active',
+                                 owner='tenant_id', is_public=False)
+            img.name = 'name_%d' % i
+            img.to_dict.return_value = {'id': img.id, 'name': img.name,
+                                        'is_public': False, 'properties': {}}
+            images.append(img)
+        self.glance_mock_client().images.list.return_value = images
+        self.image_mock.is_snapshot.return_value = False
+
+        def execute(query):
+            if 'image_locations' in query:
+                return [('id_0', 'file:///loc_0'), ('id_2', 'file:///loc_2')]
+            return [('id_1', 'member_tenant_id', 1)]
+        self.fake_cloud.mysql_connector().execute.side_effect = execute
+
+        info = self.glance_image.read_info()
+
+        self.assertEqual(2, self.fake_cloud.mysql_connector().execute.
+                         call_count)
+        self.identity_mock.try_get_tenant_name_by_id.assert_has_calls(
+            [mock.call('tenant_id', default=mock.ANY),
+             mock.call('member_tenant_id', default='fake_tenant')],
+            any_order=True)
+        self.assertEqual(
+            2, self.identity_mock.try_get_tenant_name_by_id.call_count)
+        self.assertEqual('file:///loc_2',
+                         info['images']['id_2']['meta']['img_loc'])
+        self.assertIsNone(info['images']['id_1']['meta']['img_loc'])
+        self.assertEqual({'id_1': {'fake_tenant_name': True}},
+                         info['members'])
@@ -102,3 +102,16 @@ class GlanceImageFilterTestCase(test.TestCase):
 
         self.assertNotIn(t1_image_id, image_ids)
         self.assertNotIn(t2_image_id, image_ids)
+
+    def test_images_shared_with_filtered_tenant_are_kept(self):
+        shared = _image(tenant="t2", uuid='shared_id', is_public=False)
+        not_shared = _image(tenant="t2", uuid='not_shared_id',
+                            is_public=False)
+        glance_client = mock.Mock()
+        glance_client.image_members.list.return_value = [
+            mock.Mock(image_id='shared_id', member_id='t1')]
+
+        member_filter = filters.member_filter(glance_client, 't1')
+
+        self.assertEqual([shared], filter(member_filter, [shared, not_shared]))
+        glance_client.image_members.list.assert_called_once_with(member='t1')
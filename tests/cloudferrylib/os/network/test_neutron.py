@@ -20,6 +20,7 @@ import mock
 from neutronclient.v2_0 import client as neutron_client
 from oslotest import mockpatch
 
+from cloudferrylib.base import clients
 from cloudferrylib.os.network import neutron
 from cloudferrylib.utils import utils
 from tests import test
@@ -59,6 +60,7 @@ class NeutronTestCase(test.TestCase):
         self.network_mock = mock.Mock()
         self.network_mock.neutron_client = self.neutron_mock_client
         self.fake_cloud = mock.Mock()
+        self.fake_cloud.clients = clients.ClientRegistry()
         self.fake_cloud.mysql_connector = mock.Mock()
         self.fake_cloud.resources = dict(identity=self.identity_mock,
                                          network=self.network_mock)
@@ -648,6 +650,212 @@ class NeutronTestCase(test.TestCase):
 
         self.assertEqual(self.net_2_info, network)
 
+    def test_get_network_from_list_with_indexes(self):
+        subnet1 = copy.deepcopy(self.subnet_1_info)
+        subnet2 = copy.deepcopy(self.subnet_2_info)
+        subnet1['tenant_id'] = 'fake_tenant_id_1'
+        subnet2['tenant_id'] = 'fake_tenant_id_2'
+        subnet1['cidr'] = '192.168.0.0/16'
+        subnet2['cidr'] = '192.168.1.0/24'
+        subnets = neutron.SubnetTree()
+        subnets.add(subnet1)
+        subnets.add(subnet2)
+        networks = {net['id']: net for net in [self.net_1_info,
+                                               self.net_2_info]}
+
+        network = neutron.get_network_from_list(ip='192.168.1.13',
+                                                tenant_id='fake_tenant_id_2',
+                                                networks_list=networks,
+                                                subnets_list=subnets)
+
+        self.assertEqual(self.net_2_info, network)
+
+    def _mock_ports(self):
+        self.port_1 = {'id': 'fake_port_id_1',
+                       'network_id': 'fake_network_id_1',
+                       'mac_address': 'fake_mac_1',
+                       'fixed_ips': [{'ip_address': '10.0.0.5'}]}
+        self.port_2 = {'id': 'fake_port_id_2',
+                       'network_id': 'fake_network_id_2',
+                       'mac_address': 'fake_mac_2',
+                       'fixed_ips': [{'ip_address': '10.0.1.5'}]}
+        self.neutron_mock_client().list_ports.return_value = {
+            'ports': [self.port_1, self.port_2]}
+
+    def test_ports_are_listed_once(self):
+        self._mock_ports()
+        network = self.neutron_network_client
+
+        self.assertEqual('fake_port_id_2', network.check_existing_port(
+            'fake_network_id_2', 'fake_mac_2'))
+        self.assertIsNone(network.check_existing_port('fake_network_id_1',
+                                                      'fake_mac_2'))
+        self.assertEqual('fake_mac_1', network.get_mac_by_ip('10.0.0.5'))
+        self.assertEqual(1, self.neutron_mock_client().list_ports.call_count)
+
+    @mock.patch('cloudferrylib.os.identity.keystone.'
+                'AddAdminUserToNonAdminTenant')
+    def test_created_and_deleted_ports_are_indexed(self, _):
+        self._mock_ports()
+        network = self.neutron_network_client
+        port_3 = {'id': 'fake_port_id_3',
+                  'network_id': 'fake_network_id_1',
+                  'mac_address': 'fake_mac_3',
+                  'fixed_ips': [{'ip_address': '10.0.0.6'}]}
+        self.neutron_mock_client().create_port.return_value = {
+            'port': port_3}
+        network.check_existing_port('fake_network_id_1', 'fake_mac_1')
+
+        network.create_port('fake_network_id_1', 'fake_mac_3', '10.0.0.6',
+                            'fake_tenant_id_1', True)
+        network.delete_port('fake_port_id_1')
+
+        self.assertEqual('fake_port_id_3', network.check_existing_port(
+            'fake_network_id_1', 'fake_mac_3'))
+        self.assertIsNone(network.check_existing_port('fake_network_id_1',
+                                                      'fake_mac_1'))
+        self.assertEqual(1, self.neutron_mock_client().list_ports.call_count)
+
+    def test_get_network_by_ip(self):
+        net_1 = {'id': 'fake_network_id_1', 'name': 'net_1', 'shared': False}
+        net_2 = {'id': 'fake_network_id_2', 'name': 'net_2', 'shared': True}
+        self.neutron_mock_client().list_networks.return_value = {
+            'networks': [net_1, net_2]}
+        self.neutron_mock_client().list_subnets.return_value = {
+            'subnets': [{'id': 'fake_subnet_id_1',
+                         'network_id': 'fake_network_id_1',
+                         'tenant_id': 'fake_tenant_id_1',
+                         'cidr': '10.0.0.0/24'},
+                        {'id': 'fake_subnet_id_2',
+                         'network_id': 'fake_network_id_2',
+                         'tenant_id': 'fake_tenant_id_2',
+                         'cidr': '10.0.0.0/16'}]}
+        network = self.neutron_network_client
+
+        self.assertEqual(net_1, network.get_network(
+            {'ip': '10.0.0.5'}, 'fake_tenant_id_1', keep_ip=True))
+        self.assertEqual(net_2, network.get_network(
+            {'ip': '10.0.0.5'}, 'fake_tenant_id_3', keep_ip=True))
+        self.assertEqual(net_2, network.get_network(
+            {'ip': '10.0.5.5'}, 'fake_tenant_id_1', keep_ip=True))
+        self.assertEqual(
+            1, self.neutron_mock_client().list_subnets.call_count)
+
+    def test_get_security_group_ids(self):
+        self.neutron_mock_client().list_security_groups.return_value = {
+            'security_groups': [
+                {'id': 'sg_1', 'name': 'default', 'tenant_id': 't_1'},
+                {'id': 'sg_2', 'name': 'web', 'tenant_id': 't_1'},
+                {'id': 'sg_3', 'name': 'web', 'tenant_id': 't_2'}]}
+
+        self.assertEqual(
+            ['sg_2'],
+            self.neutron_network_client.get_security_group_ids(
+                't_1', ['web', 'web', 'db']))
+
+    @mock.patch('cloudferrylib.os.identity.keystone.'
+                'AddAdminUserToNonAdminTenant')
+    def test_create_ports_in_bulk(self, _):
+        self._mock_ports()
+        client = self.neutron_mock_client()
+        client.create_port.return_value = {'ports': [self.port_1,
+                                                     self.port_2]}
+
+        ports = self.neutron_network_client.create_ports(
+            'fake_tenant_id_1',
+            [{'net_id': 'fake_network_id_1', 'mac': 'fake_mac_1',
+              'ip': '10.0.0.5', 'keep_ip': True},
+             {'net_id': 'fake_network_id_2', 'mac': 'fake_mac_2',
+              'ip': '10.0.1.5', 'keep_ip': False}])
+
+        self.assertEqual([self.port_1, self.port_2], ports)
+        client.create_port.assert_called_once_with({'ports': [
+            {'network_id': 'fake_network_id_1',
+             'mac_address': 'fake_mac_1',
+             'tenant_id': 'fake_tenant_id_1',
+             'fixed_ips': [{'ip_address': '10.0.0.5'}]},
+            {'network_id': 'fake_network_id_2',
+             'mac_address': 'fake_mac_2',
+             'tenant_id': 'fake_tenant_id_1'}]})
+
+    @mock.patch('cloudferrylib.os.identity.keystone.'
+                'AddAdminUserToNonAdminTenant')
+    def test_create_ports_one_by_one_if_bulk_fails(self, _):
+        port = {'id': 'fake_port_id_1',
+                'network_id': 'fake_network_id_1',
+                'mac_address': 'fake_mac_1',
+                'fixed_ips': [{'ip_address': '10.0.0.5'}]}
+        client = self.neutron_mock_client()
+        client.create_port.side_effect = [
+            neutron.neutron_exc.IpAddressInUseClient(),
+            {'port': port},
+            neutron.neutron_exc.IpAddressInUseClient()]
+
+        ports = self.neutron_network_client.create_ports(
+            'fake_tenant_id_1',
+            [{'net_id': 'fake_network_id_1', 'mac': 'fake_mac_1',
+              'ip': '10.0.0.5', 'keep_ip': True},
+             {'net_id': 'fake_network_id_1', 'mac': 'fake_mac_3',
+              'ip': '10.0.0.6', 'keep_ip': True}])
+
+        self.assertEqual('fake_port_id_1', ports[0]['id'])
+        self.assertIsNone(ports[1])
+        self.assertEqual(3, client.create_port.call_count)
+
+    @mock.patch('cloudferrylib.os.identity.keystone.'
+                'AddAdminUserToNonAdminTenant')
+    def test_upload_floatingips_of_tenant_in_one_transaction(self, admin):
+        client = self.neutron_mock_client()
+        client.list_floatingips.return_value = {'floatingips': []}
+        client.create_floatingip.side_effect = [
+            {'floatingip': {'id': 'fip_1', 'floating_ip_address': '1.1.1.12',
+                            'floating_network_id': 'ext_net_id'}},
+            {'floatingip': {'id': 'fip_2', 'floating_ip_address': '1.1.1.10',
+                            'floating_network_id': 'ext_net_id'}}]
+        self.neutron_network_client.get_networks = mock.Mock(
+            return_value=[])
+        self.neutron_network_client.ext_net_map = {'src_ext_net_id':
+                                                   'ext_net_id'}
+        src_floats = [{'floating_ip_address': '1.1.1.11',
+                       'floating_network_id': 'src_ext_net_id',
+                       'tenant_name': 'fake_tenant_name_1'},
+                      {'floating_ip_address': '1.1.1.10',
+                       'floating_network_id': 'src_ext_net_id',
+                       'tenant_name': 'fake_tenant_name_1'}]
+
+        fip_ids = self.neutron_network_client.upload_floatingips([],
+                                                                 src_floats)
+
+        # IDs are returned in the order of source floating IPs
+        self.assertEqual(['fip_2', 'fip_1'], fip_ids)
+        self.assertEqual(1, admin.call_count)
+        mysql = self.fake_cloud.mysql_connector()
+        mysql.batch_execute.assert_called_once_with(mock.ANY)
+        sqls = mysql.batch_execute.call_args[0][0]
+        # fip_2 must release 1.1.1.10 before fip_1 gets it
+        self.assertIn('"1.1.1.11" WHERE id = "fip_2"', sqls[0])
+        self.assertIn('"1.1.1.10" WHERE id = "fip_1"', sqls[2])
+
+
+class OrderAddressChangesTestCase(test.TestCase):
+    def test_chain_is_reversed(self):
+        ordered, postponed = neutron.order_address_changes(
+            [('a', '1', '2'), ('b', '2', '3'), ('c', '3', '4')])
+
+        self.assertEqual(['c', 'b', 'a'], ordered)
+        self.assertEqual([], postponed)
+
+    def test_unchanged_address_is_ordered(self):
+        self.assertEqual(
+            (['a'], []), neutron.order_address_changes([('a', '1', '1')]))
+
+    def test_cycle_is_postponed(self):
+        ordered, postponed = neutron.order_address_changes(
+            [('a', '1', '2'), ('b', '2', '1'), ('c', '5', '6')])
+
+        self.assertEqual(['b', 'c'], ordered)
+        self.assertEqual(['a'], postponed)
+
 
 class NeutronRouterTestCase(test.TestCase):
     def test_router_class(self):
@@ -0,0 +1,124 @@
+# Copyright 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import mock
+
+from cloudferrylib.os.object_storage import swift_storage
+from cloudferrylib.utils import utils
+from tests import test
+
+
+FAKE_CONFIG = utils.ext_dict(
+    cloud=utils.ext_dict(user='user', password='password', tenant='tenant',
+                         auth_url='http://keystone', cacert='',
+                         insecure=False),
+    migrate=utils.ext_dict(objstorage_workers=1, swift_segment_size=1))
+
+
+class SwiftStorageTestCase(test.TestCase):
+    def setUp(self):
+        super(SwiftStorageTestCase, self).setUp()
+        patcher = mock.patch.object(swift_storage, 'swift_client')
+        self.swift_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.swift_client.Connection().get_auth.return_value = ('url',
+                                                                'token')
+        self.storage = swift_storage.SwiftStorage(FAKE_CONFIG, mock.Mock())
+        self.src_storage = mock.Mock()
+
+    def test_read_info_does_not_read_objects_data(self):
+        self.swift_client.get_account.return_value = ({}, [{'name': 'c1'}])
+        self.swift_client.get_container.return_value = (
+            {}, [{'name': 'o1', 'bytes': 10}])
+
+        info = self.storage.read_info()
+
+        self.assertEqual(
+            [{'name': 'c1', 'objects': [{'name': 'o1', 'bytes': 10}]}],
+            info['objstorage']['containers'])
+        self.assertFalse(self.swift_client.get_object.called)
+
+    def test_object_is_streamed(self):
+        self.src_storage.get_object.return_value = (
+            {'etag': '"md5"'}, iter(['abc', 'def']))
+        info = {'objstorage': {
+            'resource': self.src_storage,
+            'containers': [{'name': 'c1', 'objects': [
+                {'name': 'o1', 'bytes': 6, 'content_type': 'text/plain'}]}]}}
+
+        self.storage.deploy(info)
+
+        self.swift_client.put_container.assert_called_once_with(
+            'url', 'token', 'c1')
+        args, kwargs = self.swift_client.put_object.call_args
+        self.assertEqual(('url', 'token', 'c1', 'o1'), args[:4])
+        self.assertEqual('md5', kwargs['etag'])
+        self.assertEqual('abcdef', args[4].read())
+
+    def test_large_object_is_copied_in_segments(self):
+        mb = swift_storage.MB
+        size = 2 * mb + 10
+        self.src_storage.get_object.return_value = ({}, iter([]))
+        self.swift_client.put_object.side_effect = (
+            lambda url, token, container, name, *args, **kwargs: name[-1])
+
+        self.storage.copy_object(self.src_storage, 'c1', {
+            'name': 'o1', 'bytes': size, 'content_type': 'text/plain',
+            'last_modified': 'time'})
+
+        ranges = [c[1]['headers']['Range']
+                  for c in self.src_storage.get_object.call_args_list]
+        self.assertEqual(['bytes=0-%d' % (mb - 1),
+                          'bytes=%d-%d' % (mb, 2 * mb - 1),
+                          'bytes=%d-%d' % (2 * mb, size - 1)], ranges)
+        args, kwargs = self.swift_client.put_object.call_args
+        self.assertEqual('multipart-manifest=put', kwargs['query_string'])
+        manifest = json.loads(args[4])
+        self.assertEqual(
+            {'path': '/c1_segments/o1/slo/time/%d/%d/00000002' % (size, mb),
+             'etag': '2', 'size_bytes': 10},
+            manifest[2])
+
+    def test_dynamic_large_object_is_copied_in_segments(self):
+        mb = swift_storage.MB
+        self.src_storage.get_object.return_value = (
+            {'x-object-manifest': 'c1_segments/o1%2F'}, iter([]))
+        self.src_storage.get_container.return_value = (
+            {}, [{'bytes': mb}, {'bytes': mb}])
+        self.swift_client.put_object.return_value = 'etag'
+
+        self.storage.copy_object(self.src_storage, 'c1', {
+            'name': 'o1', 'bytes': 0, 'content_type': 'text/plain',
+            'last_modified': 'time'})
+
+        self.src_storage.get_container.assert_called_once_with(
+            'c1_segments', prefix='o1/', full_listing=True)
+        ranges = [c[1]['headers']['Range']
+                  for c in self.src_storage.get_object.call_args_list[1:]]
+        self.assertEqual(['bytes=0-%d' % (mb - 1),
+                          'bytes=%d-%d' % (mb, 2 * mb - 1)], ranges)
+        args, kwargs = self.swift_client.put_object.call_args
+        self.assertEqual('multipart-manifest=put', kwargs['query_string'])
+
+
+class ObjectReaderTestCase(test.TestCase):
+    def test_reads_of_any_size(self):
+        reader = swift_storage.ObjectReader(iter(['abcd', 'ef']))
+
+        self.assertEqual('ab', reader.read(2))
+        self.assertEqual('cd', reader.read(5))
+        self.assertEqual('ef', reader.read(5))
+        self.assertEqual('', reader.read(5))
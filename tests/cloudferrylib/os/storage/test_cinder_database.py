@@ -0,0 +1,107 @@
+# Copyright 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+
+import mock
+
+from cloudferrylib.base import clients
+from cloudferrylib.os.storage import cinder_database
+from cloudferrylib.utils import utils
+from tests import test
+
+
+class FakeQuery(list):
+    def __init__(self, column_names, rows):
+        super(FakeQuery, self).__init__(rows)
+        self.column_names = column_names
+
+    def keys(self):
+        return self.column_names
+
+
+class FakeTable(object):
+    """Executes paged SELECTs of cinder_database over rows of a table."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.selects = []
+
+    def execute(self, sql, **kwargs):
+        if sql.startswith('SHOW INDEX'):
+            return [{'Column_name': 'id'}]
+        self.selects.append(kwargs.get('last_key'))
+        limit = int(sql.rsplit('LIMIT', 1)[1])
+        rows = [r for r in self.rows
+                if kwargs.get('last_key') is None or
+                r[0] > kwargs['last_key']][:limit]
+        return FakeQuery(['id', 'deleted'], rows)
+
+
+class CinderDatabaseTestCase(test.TestCase):
+    def setUp(self):
+        super(CinderDatabaseTestCase, self).setUp()
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir)
+        config = utils.ext_dict(
+            cloud=utils.ext_dict({'host': '1.1.1.1'}),
+            mysql=utils.ext_dict({'db_host': 'src_db'}),
+            migrate=utils.ext_dict({
+                'cinder_db_chunk_size': 2,
+                'transfer_manifest_dir': self.state_dir}))
+        cloud = mock.Mock()
+        cloud.clients = clients.ClientRegistry()
+        cloud.resources = {'identity': mock.Mock()}
+        self.table = FakeTable([(1, 0), (2, 1), (3, 0), (4, 0), (5, 0)])
+        cloud.mysql_connector.return_value = self.table
+        self.storage = cinder_database.CinderStorage(config, cloud)
+        self.storage.list_of_tables = ['volume_types']
+        self.dst_storage = mock.Mock(mysql_host='dst_db')
+
+    def test_table_is_read_by_pages_of_primary_keys(self):
+        pages = list(self.storage.iter_table('volume_types', 2))
+
+        self.assertEqual([([{'id': 1, 'deleted': 0}], 2),
+                          ([{'id': 3, 'deleted': 0},
+                            {'id': 4, 'deleted': 0}], 4),
+                          ([{'id': 5, 'deleted': 0}], 5)], pages)
+        self.assertEqual([None, 2, 4], self.table.selects)
+
+    def test_tables_are_copied_page_by_page(self):
+        self.storage.copy_tables(self.dst_storage)
+
+        self.assertEqual(
+            [mock.call('volume_types', [{'id': 1, 'deleted': 0}]),
+             mock.call('volume_types', [{'id': 3, 'deleted': 0},
+                                        {'id': 4, 'deleted': 0}]),
+             mock.call('volume_types', [{'id': 5, 'deleted': 0}])],
+            self.dst_storage.deploy_data_to_table.call_args_list)
+
+    def test_interrupted_copy_is_resumed_after_last_written_page(self):
+        self.dst_storage.deploy_data_to_table.side_effect = [
+            None, RuntimeError()]
+        self.assertRaises(RuntimeError, self.storage.copy_tables,
+                          self.dst_storage)
+
+        self.table.selects = []
+        self.dst_storage.deploy_data_to_table.side_effect = None
+        self.dst_storage.deploy_data_to_table.reset_mock()
+        self.storage.copy_tables(self.dst_storage)
+
+        self.assertEqual([2, 4], self.table.selects)
+        self.assertEqual(2, self.dst_storage.deploy_data_to_table.call_count)
+        progress = cinder_database.TableCopyProgress(self.state_dir,
+                                                     'src_db', 'dst_db')
+        self.assertIsNone(progress.get('volume_types'))
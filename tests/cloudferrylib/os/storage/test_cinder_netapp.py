@@ -18,6 +18,7 @@ import copy
 
 import mock
 
+from cloudferrylib.base import clients
 from cloudferrylib.os.storage import cinder_database
 from cloudferrylib.os.storage import cinder_netapp
 from cloudferrylib.utils import utils
@@ -51,6 +52,7 @@ class CinderNetAppTestCase(test.TestCase):
         self.identity_mock = mock.Mock()
 
         self.fake_cloud = mock.Mock()
+        self.fake_cloud.clients = clients.ClientRegistry()
         self.fake_cloud.position = 'src'
         self.fake_cloud.resources = dict(identity=self.identity_mock)
 
@@ -18,6 +18,7 @@ import mock
 from cinderclient.v1 import client as cinder_client
 from oslotest import mockpatch
 
+from cloudferrylib.base import clients
 from cloudferrylib.os.storage import cinder_storage
 from cloudferrylib.utils import utils
 from tests import test
@@ -55,6 +56,7 @@ class CinderStorageTestCase(test.TestCase):
         self.compute_mock = mock.Mock()
 
         self.fake_cloud = mock.Mock()
+        self.fake_cloud.clients = clients.ClientRegistry()
         self.fake_cloud.position = 'src'
 
         self.fake_cloud.resources = dict(identity=self.identity_mock,
@@ -183,6 +185,18 @@ class CinderStorageTestCase(test.TestCase):
         self.assertEqual(vol1.id, res['volumes']['id1']['volume']['id'])
         self.cinder_client.get_volumes_list = temp
 
+    def test_read_info_of_many_volumes_at_once(self):
+        self.cinder_client.get_volumes_list = mock.Mock()
+        self.cinder_client.get_volumes_list.return_value = [
+            mock.Mock(id=vol_id, attachments=[], volume_type='None')
+            for vol_id in ('id1', 'id2', 'id3')]
+
+        res = self.cinder_client.read_info(ids={'id1', 'id3'})
+
+        self.assertEqual(['id1', 'id3'], sorted(res['volumes']))
+        self.cinder_client.get_volumes_list.assert_called_once_with(
+            search_opts={})
+
     def test_deploy(self):
         vol = {'volume': {'size': 'size1',
                           'display_name': 'display_name1',
@@ -194,15 +208,17 @@ class CinderStorageTestCase(test.TestCase):
         create_volume = mock.Mock()
         vol_return = mock.Mock(id="id2")
         create_volume.return_value = vol_return
-        wait_for_status = mock.Mock()
+        try_wait_for_statuses = mock.Mock()
         finish = mock.Mock()
         attach_vol_to_instance = mock.Mock()
         self.cinder_client.create_volume = create_volume
-        self.cinder_client.wait_for_status = wait_for_status
+        self.cinder_client.try_wait_for_statuses = try_wait_for_statuses
         self.cinder_client.finish = finish
         self.cinder_client.attach_volume_to_instance = attach_vol_to_instance
         res = self.cinder_client.deploy(info)
         self.assertIn(vol_return.id, res)
+        try_wait_for_statuses.assert_called_once_with(['id2'], 'available')
+        finish.assert_called_once_with(vol)
 
     def test_get_volume_path_iscsi(self):
         fake_mysql_return = ('fake_ip:fake_port,3 iqn.2010-10.org.openstack:'
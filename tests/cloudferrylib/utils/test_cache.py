@@ -11,62 +11,103 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from cloudferrylib.utils.cache import Memoized, Cached
+import collections
+
+import mock
+
+from cloudferrylib.utils import cache
 
 from tests import test
 
 
-class MemoizationTestCase(test.TestCase):
-    def test_treats_self_as_separate_objects(self):
-        class C(object):
-            def __init__(self, i):
-                self.i = i
+Obj = collections.namedtuple('Obj', 'id name')
+
+
+class IdentityMapTestCase(test.TestCase):
+    def setUp(self):
+        super(IdentityMapTestCase, self).setUp()
+        self.objects = [Obj('id1', 'name1'), Obj('id2', 'name2')]
+        self.load = mock.Mock(side_effect=lambda: list(self.objects))
+
+    def test_objects_are_loaded_once(self):
+        identity_map = cache.IdentityMap(self.load)
+
+        self.assertEqual(self.objects[0], identity_map.get('id1'))
+        self.assertEqual(self.objects[1], identity_map.find('name2'))
+        self.assertIsNone(identity_map.get('id3'))
+        self.assertIsNone(identity_map.find('name3'))
+
+        self.assertEqual(1, self.load.call_count)
+
+    def test_missing_object_is_fetched_once(self):
+        fetched = Obj('id3', 'name3')
+        fetch = mock.Mock(side_effect=lambda obj_id: (
+            fetched if obj_id == 'id3' else None))
+        identity_map = cache.IdentityMap(self.load, fetch=fetch)
+
+        for _ in range(2):
+            self.assertEqual(fetched, identity_map.get('id3'))
+            self.assertIsNone(identity_map.get('id4'))
+
+        self.assertEqual(fetched, identity_map.find('name3'))
+        self.assertEqual([mock.call('id3'), mock.call('id4')],
+                         fetch.call_args_list)
+        self.assertEqual(1, self.load.call_count)
+
+    def test_missing_name_is_fetched_again_after_reload(self):
+        fetch_by_name = mock.Mock(return_value=None)
+        identity_map = cache.IdentityMap(self.load,
+                                         fetch_by_name=fetch_by_name)
+
+        self.assertIsNone(identity_map.find('name3'))
+        self.assertIsNone(identity_map.find('name3'))
+        identity_map.invalidate()
+        self.assertIsNone(identity_map.find('name3'))
 
-            @Memoized
-            def get_i(self):
-                return self.i
+        self.assertEqual(2, fetch_by_name.call_count)
 
-        o1 = C(1)
-        o2 = C(2)
+    def test_added_and_removed_objects(self):
+        identity_map = cache.IdentityMap(self.load)
+        identity_map.list()
 
-        self.assertNotEqual(o1.get_i(), o2.get_i())
-        self.assertEqual(o1.get_i(), 1)
-        self.assertEqual(o2.get_i(), 2)
+        identity_map.add(Obj('id3', 'name3'))
+        identity_map.remove('id1')
 
-    def test_takes_value_from_cache(self):
-        class C(object):
-            def __init__(self, i):
-                self.i = i
+        self.assertEqual(Obj('id3', 'name3'), identity_map.find('name3'))
+        self.assertIsNone(identity_map.get('id1'))
+        self.assertIsNone(identity_map.find('name1'))
+        self.assertEqual(1, self.load.call_count)
 
-            @Memoized
-            def get_i(self):
-                return self.i
+    def test_renamed_object(self):
+        identity_map = cache.IdentityMap(self.load)
+        identity_map.list()
 
-            def set_i(self, i):
-                self.i = i
+        identity_map.add(Obj('id1', 'new_name'))
 
-        original = 1
-        o = C(original)
-        self.assertEqual(o.get_i(), original)
-        o.set_i(10)
-        self.assertEqual(o.get_i(), original)
+        self.assertIsNone(identity_map.find('name1'))
+        self.assertEqual(Obj('id1', 'new_name'),
+                         identity_map.find('new_name'))
 
+    def test_invalidated_map_is_reloaded(self):
+        identity_map = cache.IdentityMap(self.load)
+        identity_map.list()
+        self.objects.append(Obj('id3', 'name3'))
 
-class CacheTestCase(test.TestCase):
-    def test_resets_cache_when_modifier_called(self):
-        @Cached(getter='get_i', modifier='set_i')
-        class C(object):
-            def __init__(self, i):
-                self.i = i
+        identity_map.invalidate()
 
-            def get_i(self):
-                return self.i
+        self.assertEqual(Obj('id3', 'name3'), identity_map.get('id3'))
+        self.assertEqual(2, self.load.call_count)
 
-            def set_i(self, i):
-                self.i = i
+    @mock.patch.object(cache.time, 'time')
+    def test_expired_map_is_reloaded(self, now):
+        now.return_value = 100
+        identity_map = cache.IdentityMap(self.load, ttl=60)
+        identity_map.list()
 
-        o = C(1)
-        self.assertEqual(o.get_i(), 1)
+        now.return_value = 159
+        identity_map.list()
+        self.assertEqual(1, self.load.call_count)
 
-        o.set_i(100)
-        self.assertEqual(o.get_i(), 100)
+        now.return_value = 160
+        identity_map.list()
+        self.assertEqual(2, self.load.call_count)
@@ -0,0 +1,141 @@
+# Copyright 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from cloudferrylib.utils import cmd_cfg
+from cloudferrylib.utils import compression
+from tests import test
+
+
+class CodecTestCase(test.TestCase):
+    def test_pipes_compression(self):
+        codec = compression.get_codec('zstd')
+        src = codec.pipe_compress(cmd_cfg.dd_cmd_if('1M', '/src'), 3)
+        dst = codec.pipe_decompress(cmd_cfg.dd_cmd_of('1M', '/dst'))
+
+        self.assertEqual('dd bs=1M if=/src | zstd -3 -T0 -c', str(src))
+        self.assertEqual('zstd -d -c | dd bs=1M of=/dst', str(dst))
+
+    def test_no_compression_keeps_commands(self):
+        codec = compression.get_codec(compression.NONE)
+        cmd = cmd_cfg.dd_cmd_if('1M', '/src')
+
+        self.assertIs(cmd, codec.pipe_compress(cmd, 3))
+        self.assertIs(cmd, codec.pipe_decompress(cmd))
+
+    def test_level_is_clamped_to_codec_levels(self):
+        self.assertEqual('lz4 -1 -c',
+                         str(compression.get_codec('lz4').compress_cmd(None)))
+        self.assertEqual('xz -9 -T0 -c',
+                         str(compression.get_codec('xz').compress_cmd(12)))
+        self.assertEqual('zstd -12 -T0 -c',
+                         str(compression.get_codec('zstd').compress_cmd(12)))
+        self.assertEqual('gzip -1 -c',
+                         str(compression.get_codec('gzip').compress_cmd(0)))
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, compression.get_codec, 'rar')
+
+    def test_available_codecs(self):
+        run = mock.Mock(return_value='/usr/bin/gzip\n/usr/bin/zstd\n')
+
+        self.assertEqual(set(['dd', 'gzip', 'zstd']),
+                         compression.available_codecs(run))
+
+
+class SelectCodecTestCase(test.TestCase):
+    def setUp(self):
+        super(SelectCodecTestCase, self).setUp()
+        self.cfg = mock.Mock(file_compression=compression.AUTO,
+                             level_compression=1)
+        self.sample = lambda: cmd_cfg.dd_cmd_if('1M', '/src')
+        self.send_to_dst = mock.Mock()
+        self.clock = [0]
+
+        def sleep(seconds):
+            self.clock[0] += seconds
+        self.sleep = sleep
+        patcher = mock.patch.object(compression.time, 'time',
+                                    side_effect=lambda: self.clock[0])
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def run_on_src(self, compressed, speed):
+        """Source host compressing 1 MB sample to :compressed bytes with
+        :speed seconds per MB."""
+
+        def run(cmd):
+            cmd = str(cmd)
+            if cmd.startswith('which'):
+                return '/bin/gzip\n/bin/lz4'
+            codec = cmd.split(' | ')[1].split(' ')[0]
+            if codec == 'wc':
+                self.sleep(0.01)
+                return str(1024 * 1024)
+            self.sleep(0.01 + speed[codec])
+            return str(compressed[codec])
+        return run
+
+    def test_returns_configured_codec(self):
+        self.cfg.file_compression = 'xz'
+
+        codec = compression.select_codec(self.cfg, None, None, None, None)
+
+        self.assertEqual('xz', codec.name)
+
+    def test_compressible_data_on_slow_link(self):
+        self.send_to_dst.side_effect = lambda src, dst: self.sleep(1)
+        run = self.run_on_src({'gzip': 1024, 'lz4': 4096},
+                              {'gzip': 0.1, 'lz4': 0.01})
+
+        codec = compression.select_codec(self.cfg, self.sample, run, run,
+                                         self.send_to_dst)
+
+        self.assertEqual('lz4', codec.name)
+
+    def test_dense_data_is_not_compressed(self):
+        self.send_to_dst.side_effect = lambda src, dst: self.sleep(0.01)
+        run = self.run_on_src({'gzip': 1000000, 'lz4': 1040000},
+                              {'gzip': 0.1, 'lz4': 0.02})
+
+        codec = compression.select_codec(self.cfg, self.sample, run, run,
+                                         self.send_to_dst)
+
+        self.assertEqual(compression.NONE, codec.name)
+
+    def test_small_data_is_not_sampled(self):
+        run = mock.Mock()
+
+        codec = compression.select_codec(self.cfg, self.sample, run, run,
+                                         self.send_to_dst, size=1024)
+
+        self.assertEqual('gzip', codec.name)
+        self.assertFalse(run.called)
+
+    def test_codec_is_chosen_once_for_hosts(self):
+        self.send_to_dst.side_effect = lambda src, dst: self.sleep(1)
+        run = mock.Mock(side_effect=self.run_on_src(
+            {'gzip': 1024, 'lz4': 4096}, {'gzip': 0.1, 'lz4': 0.01}))
+        self.addCleanup(compression._selected.clear)
+
+        first = compression.select_codec(self.cfg, self.sample, run, run,
+                                         self.send_to_dst, hosts=('a', 'b'))
+        calls = run.call_count
+        second = compression.select_codec(self.cfg, self.sample, run, run,
+                                          self.send_to_dst, hosts=('a', 'b'))
+
+        self.assertEqual('lz4', first.name)
+        self.assertIs(first, second)
+        self.assertEqual(calls, run.call_count)
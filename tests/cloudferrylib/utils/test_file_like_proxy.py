@@ -0,0 +1,86 @@
+# Copyright 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import StringIO
+
+import mock
+
+from cloudferrylib.utils import file_like_proxy
+from tests import test
+
+
+class FakeResponse(StringIO.StringIO):
+    def __init__(self, data):
+        StringIO.StringIO.__init__(self, data)
+        self.length = len(data)
+
+
+class FileLikeProxyTestCase(test.TestCase):
+    def make_proxy(self, data, callback=None, speed_limit='-'):
+        resource = mock.Mock()
+        resource.get_ref_image.return_value = FakeResponse(data)
+        with mock.patch.object(file_like_proxy.progressbar, 'ProgressBar'):
+            return file_like_proxy.FileLikeProxy(
+                {'resource': resource, 'id': 'image_id', 'name': 'image',
+                 'size': len(data)}, callback, speed_limit)
+
+    def test_reads_of_any_size_return_source_data(self):
+        data = ''.join(chr(i % 256) for i in xrange(
+            2 * file_like_proxy.CHUNK_SIZE + 100))
+        proxy = self.make_proxy(data)
+
+        parts = []
+        for size in [1, 1000, file_like_proxy.CHUNK_SIZE * 3, 7]:
+            parts.append(proxy.read(size))
+        parts.append(proxy.read())
+
+        self.assertEqual(data, ''.join(parts))
+        self.assertEqual('', proxy.read(10))
+
+    def test_callback_reports_progress(self):
+        callback = mock.Mock()
+        proxy = self.make_proxy('x' * 1000, callback)
+
+        while proxy.read(100):
+            pass
+
+        transferred, length, image_id, name, speed, eta = (
+            callback.call_args[0])
+        self.assertEqual((1000, 1000, 'image_id', 'image'),
+                         (transferred, length, image_id, name))
+        self.assertGreater(speed, 0)
+        self.assertEqual(0, eta)
+
+    @mock.patch.object(file_like_proxy.time, 'sleep')
+    @mock.patch.object(file_like_proxy.time, 'time')
+    def test_token_bucket_limits_speed(self, now, sleep):
+        now.return_value = 100.0
+        bucket = file_like_proxy.TokenBucket(1000)
+
+        bucket.consume(100)
+        self.assertFalse(sleep.called)
+
+        bucket.consume(600)
+        sleep.assert_called_once_with(0.6)
+
+        now.return_value = 101.0
+        sleep.reset_mock()
+        bucket.consume(100)
+        self.assertFalse(sleep.called)
+
+    @mock.patch.object(file_like_proxy.time, 'sleep')
+    def test_unlimited_bucket_does_not_wait(self, sleep):
+        file_like_proxy.TokenBucket(0).consume(10 ** 9)
+
+        self.assertFalse(sleep.called)
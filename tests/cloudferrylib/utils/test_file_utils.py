@@ -15,6 +15,7 @@ import mock
 from cloudferrylib.utils import files
 from cloudferrylib.utils import remote_runner
 from cloudferrylib.utils.drivers import ssh_chunks
+from cloudferrylib.utils.drivers import ssh_file_to_file
 from tests import test
 
 
@@ -126,3 +127,336 @@ class VerifiedFileCopyTestCase(test.TestCase):
         except Exception:
             res = True
         self.assertTrue(res)
+
+
+class CopyFilesBetweenComputeHostsTestCase(test.TestCase):
+    def setUp(self):
+        super(CopyFilesBetweenComputeHostsTestCase, self).setUp()
+
+        cfg = mock.Mock()
+        cfg.migrate.ssh_chunk_size = 1
+        # mocks do not count calls made from several threads reliably
+        cfg.migrate.ssh_chunks_in_flight = 1
+        cfg.migrate.retry = 2
+        cfg.migrate.transfer_manifest_dir = None
+        cfg.migrate.file_compression = 'gzip'
+        cfg.migrate.level_compression = 7
+        cfg.migrate.sparse_file_transfer = False
+        self.transporter = ssh_chunks.CopyFilesBetweenComputeHosts(
+            mock.Mock(), mock.Mock(), cfg)
+        self.data = {'host_src': 'src_host', 'path_src': '/src/disk',
+                     'host_dst': 'dst_host', 'path_dst': '/dst/disk'}
+
+        for name in ['remote_runner', 'files', 'remote_compress',
+                     'verified_file_copy', 'remote_truncate',
+                     'remote_file_mtime']:
+            patcher = mock.patch.object(ssh_chunks, name)
+            self.addCleanup(patcher.stop)
+            setattr(self, name, patcher.start())
+        self.files.RemoteTempDir.return_value.__enter__.return_value = '/tmp'
+        self.remote_compress.side_effect = (
+            lambda runner, path, codec, level: path + codec.extension)
+
+        self.size = 5 * 1024 * 1024 + 1
+        self.joined = {}
+        self.removed = []
+        self.src_md5 = {}
+
+        def split(runner, src, part, i, block_size):
+            self.src_md5[i] = 'md5_%d' % i
+            return self.src_md5[i]
+
+        def join(runner, dst, part, i, block_size, codec):
+            self.joined[i] = part
+
+        patches = {
+            'remote_file_size': lambda runner, path: self.size,
+            'remote_split_file_md5': split,
+            'remote_decompress_join_file': join,
+            'remote_chunk_md5_sum': lambda runner, path, i, bs: 'md5_%d' % i,
+            'remote_rm_file': lambda runner, path: self.removed.append(path),
+        }
+        for name, func in patches.items():
+            patcher = mock.patch.object(ssh_chunks, name, side_effect=func)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+    def test_all_chunks_are_joined(self):
+        self.transporter.transfer(self.data)
+
+        self.assertEqual(range(6), sorted(self.joined))
+        self.assertEqual(6, self.verified_file_copy.call_count)
+        self.remote_truncate.assert_called_once_with(
+            mock.ANY, '/dst/disk', self.size)
+
+    @mock.patch.object(ssh_chunks.utils, 'thread_local_fabric_env')
+    def test_chunks_are_copied_simultaneously(self, thread_local_env):
+        self.transporter.cfg.migrate.ssh_chunks_in_flight = 3
+
+        self.transporter.transfer(self.data)
+
+        self.assertEqual(range(6), sorted(self.joined))
+        thread_local_env.assert_called_once_with()
+
+    @mock.patch.object(ssh_chunks.sparse, 'remote_data_extents')
+    def test_hole_chunks_are_not_copied(self, extents):
+        mb = 1024 * 1024
+        extents.return_value = [(0, 10), (3 * mb, mb + 1)]
+        self.transporter.cfg.migrate.sparse_file_transfer = True
+        zero_md5 = ssh_chunks.sparse.zero_md5(mb)
+
+        with mock.patch.object(ssh_chunks, 'remote_chunk_md5_sum') as md5:
+            md5.side_effect = lambda runner, path, i, bs: (
+                'md5_%d' % i if i in self.src_md5 else zero_md5)
+            with mock.patch.object(ssh_chunks.sparse, 'zero_md5',
+                                   return_value=zero_md5):
+                self.transporter.transfer(self.data)
+
+        self.assertEqual([0, 3, 4], sorted(self.joined))
+
+    def test_temporary_chunks_are_removed(self):
+        self.transporter.transfer(self.data)
+
+        for i in xrange(6):
+            self.assertIn('/tmp/disk.part%d.gz' % i, self.removed)
+        self.assertEqual(12, len(self.removed))
+
+    def test_corrupted_chunk_is_copied_again(self):
+        md5s = iter(['bad', 'md5_2'])
+        with mock.patch.object(ssh_chunks, 'remote_chunk_md5_sum') as md5:
+            md5.side_effect = lambda runner, path, i, bs: (
+                next(md5s) if i == 2 else 'md5_%d' % i)
+            self.transporter.transfer(self.data)
+
+        self.assertEqual(7, self.verified_file_copy.call_count)
+
+    def test_raises_error_if_chunk_stays_corrupted(self):
+        with mock.patch.object(ssh_chunks, 'remote_chunk_md5_sum') as md5:
+            md5.return_value = 'bad'
+            self.assertRaises(ssh_chunks.FileCopyFailure,
+                              self.transporter.transfer, self.data)
+
+        self.assertIn('/dst/disk', self.removed)
+
+    @mock.patch.object(ssh_chunks.transfer_manifest, 'TransferManifest')
+    def test_chunks_copied_before_are_skipped(self, manifest):
+        manifest.return_value.get.side_effect = (
+            lambda i: 'md5_%d' % i if i < 4 else None)
+
+        self.transporter.transfer(self.data)
+
+        self.assertEqual([4, 5], sorted(self.joined))
+        manifest.return_value.remove.assert_called_once_with()
+
+    @mock.patch.object(ssh_chunks.transfer_manifest, 'TransferManifest')
+    def test_chunks_corrupted_since_copied_are_copied_again(self, manifest):
+        manifest.return_value.get.return_value = 'outdated'
+
+        self.transporter.transfer(self.data)
+
+        self.assertEqual(range(6), sorted(self.joined))
+        self.assertEqual(6, manifest.return_value.discard.call_count)
+        manifest.return_value.put.assert_any_call(0, 'md5_0')
+
+
+class SSHFileToFileTestCase(test.TestCase):
+    def setUp(self):
+        super(SSHFileToFileTestCase, self).setUp()
+
+        cfg = mock.Mock()
+        cfg.migrate.delta_file_transfer = True
+        cfg.migrate.delta_block_size = 4
+        cfg.migrate.ssh_transfer_streams = 1
+        cfg.migrate.sparse_file_transfer = False
+        cfg.migrate.direct_compute_transfer = True
+        cfg.migrate.file_compression = 'dd'
+        self.src_cloud = mock.Mock()
+        self.dst_cloud = mock.Mock()
+        self.transporter = ssh_file_to_file.SSHFileToFile(
+            self.src_cloud, self.dst_cloud, cfg)
+        self.data = {'host_src': 'src_host', 'path_src': '/src/disk',
+                     'host_dst': 'dst_host', 'path_dst': '/dst/disk'}
+
+    def test_block_ranges(self):
+        self.assertEqual([(0, 2), (3, 1), (5, 3)],
+                         ssh_file_to_file.block_ranges([0, 1, 3, 5, 6, 7]))
+
+    @mock.patch.object(ssh_file_to_file.utils, 'forward_agent',
+                       mock.MagicMock())
+    def test_delta_transfer_copies_changed_blocks(self):
+        def src_execute(cmd, host_exec):
+            if 'blockdev' in str(cmd):
+                return '100'
+            return 'a  -\nb  -\nc  -\nd  -\ne  -'
+        self.src_cloud.ssh_util.execute.side_effect = src_execute
+        self.dst_cloud.ssh_util.execute.return_value = 'a  -\nx  -\nc  -'
+
+        self.transporter.transfer(self.data)
+
+        copy_cmds = [str(c[0][0])
+                     for c in self.src_cloud.ssh_util.execute.call_args_list
+                     if 'ssh' in str(c[0][0])]
+        self.assertEqual(2, len(copy_cmds))
+        self.assertIn('skip=4 count=4', copy_cmds[0])
+        self.assertIn('skip=12 count=8', copy_cmds[1])
+        self.dst_cloud.ssh_util.execute.assert_called_with(
+            mock.ANY, host_exec='dst_host')
+        dst_cmds = [str(c[0][0])
+                    for c in self.dst_cloud.ssh_util.execute.call_args_list]
+        self.assertIn('if [ ! -e /dst/disk ] || [ -f /dst/disk ]; then '
+                      'truncate -s 100 /dst/disk; fi', dst_cmds)
+        self.assertIn('dd bs=1M if=/dst/disk skip=12 count=8 | head -c 0 | '
+                      'md5sum', dst_cmds)
+
+    @mock.patch.object(ssh_file_to_file.utils, 'forward_agent',
+                       mock.MagicMock())
+    def test_delta_transfer_recopies_corrupted_blocks(self):
+        self.transporter.cfg.migrate.retry = 1
+
+        def src_execute(cmd, host_exec):
+            if 'blockdev' in str(cmd):
+                return '8'
+            return 'a  -\nb  -'
+        self.src_cloud.ssh_util.execute.side_effect = src_execute
+        self.dst_cloud.ssh_util.execute.return_value = 'x  -\nb  -'
+
+        self.assertRaises(ssh_chunks.FileCopyFailure,
+                          self.transporter.transfer, self.data)
+        copy_cmds = [str(c[0][0])
+                     for c in self.src_cloud.ssh_util.execute.call_args_list
+                     if 'ssh' in str(c[0][0])]
+        self.assertEqual(2, len(copy_cmds))
+
+    def test_block_md5s_reads_block_devices(self):
+        self.dst_cloud.ssh_util.execute.return_value = 'a  -\nb  -'
+
+        self.assertEqual(['a', 'b'],
+                         self.transporter.block_md5s(self.data, False, 100))
+        self.assertEqual(
+            'if [ -e /dst/disk ]; then dd bs=1M if=/dst/disk 2>/dev/null | '
+            'head -c 100 | split -b 4M --filter=md5sum; fi',
+            str(self.dst_cloud.ssh_util.execute.call_args[0][0]))
+
+    @mock.patch.object(ssh_file_to_file.utils, 'forward_agent',
+                       mock.MagicMock())
+    def test_delta_transfer_to_bigger_block_device(self):
+        mb = 1024 * 1024
+        self.data['path_src'] = '/dev/vg/src'
+        self.data['path_dst'] = '/dev/vg/dst'
+        devices = {'/dev/vg/src': 'a' * (8 * mb), '/dev/vg/dst': 'b' * mb}
+
+        def execute(path):
+            def run(cmd, host_exec):
+                cmd = str(cmd)
+                if cmd.startswith('if [ -b'):
+                    return str(len(devices[path]))
+                if 'ssh' in cmd:
+                    offset = int(cmd.split('skip=')[1].split(' ')[0]) * mb
+                    data = devices['/dev/vg/src'][offset:offset + 4 * mb]
+                    dst = devices['/dev/vg/dst']
+                    devices['/dev/vg/dst'] = (dst[:offset] + data +
+                                              dst[offset + len(data):])
+                    return ''
+                if 'truncate' in cmd:
+                    # test of regular file is false for devices
+                    return ''
+                if 'split' in cmd:
+                    size = int(cmd.split('head -c ')[1].split(' ')[0])
+                    data = devices[path][:size]
+                    return '\n'.join('%s  -' % hash(data[i:i + 4 * mb])
+                                     for i in xrange(0, len(data), 4 * mb))
+                if 'md5sum' in cmd:
+                    offset = int(cmd.split('skip=')[1].split(' ')[0]) * mb
+                    size = int(cmd.split('head -c ')[1].split(' ')[0])
+                    return '%s  -' % hash(
+                        devices[path][offset:offset + size])
+            return run
+        self.src_cloud.ssh_util.execute.side_effect = execute('/dev/vg/src')
+        self.dst_cloud.ssh_util.execute.side_effect = execute('/dev/vg/dst')
+        devices['/dev/vg/dst'] = 'b' * (10 * mb)
+
+        self.transporter.transfer(self.data)
+
+        self.assertEqual('a' * (8 * mb) + 'b' * (2 * mb),
+                         devices['/dev/vg/dst'])
+
+    @mock.patch.object(ssh_file_to_file.utils, 'forward_agent',
+                       mock.MagicMock())
+    def test_multi_stream_transfer_copies_all_ranges(self):
+        self.transporter.cfg.migrate.delta_file_transfer = False
+        self.transporter.cfg.migrate.resumable_file_transfer = False
+        self.transporter.cfg.migrate.ssh_transfer_streams = 3
+        copied = []
+
+        def execute(cmd, host_exec):
+            cmd = str(cmd)
+            if 'blockdev' in cmd:
+                return str(10 * 1024 * 1024 - 1)
+            if 'md5sum' in cmd:
+                return cmd.split(' ')[3] + '  -'
+            if 'ssh' in cmd:
+                copied.append(cmd.split(' ')[3])
+        self.src_cloud.ssh_util.execute.side_effect = execute
+        self.dst_cloud.ssh_util.execute.side_effect = execute
+
+        with mock.patch.object(ssh_file_to_file.utils,
+                               'thread_local_fabric_env') as local_env:
+            self.transporter.transfer(self.data)
+
+        self.assertEqual(['skip=0', 'skip=4', 'skip=8'], sorted(copied))
+        self.assertTrue(local_env.called)
+        dst_cmds = [str(c[0][0])
+                    for c in self.dst_cloud.ssh_util.execute.call_args_list]
+        self.assertIn('dd bs=1M if=/dst/disk skip=8 count=4 | '
+                      'head -c %d | md5sum' % (2 * 1024 * 1024 - 1),
+                      dst_cmds)
+        self.assertIn('if [ ! -e /dst/disk ] || [ -f /dst/disk ]; then '
+                      'truncate -s %d /dst/disk; fi' % (10 * 1024 * 1024 - 1),
+                      dst_cmds)
+
+    @mock.patch.object(ssh_file_to_file.utils, 'forward_agent',
+                       mock.MagicMock())
+    def test_multi_stream_transfer_fails_on_checksum_mismatch(self):
+        self.transporter.cfg.migrate.delta_file_transfer = False
+        self.transporter.cfg.migrate.resumable_file_transfer = False
+        self.transporter.cfg.migrate.ssh_transfer_streams = 2
+        self.src_cloud.ssh_util.execute.side_effect = (
+            lambda cmd, host_exec: '1048576' if 'blockdev' in str(cmd)
+            else 'src  -')
+        self.dst_cloud.ssh_util.execute.return_value = 'dst  -'
+
+        self.assertRaises(ssh_chunks.FileCopyFailure,
+                          self.transporter.transfer, self.data)
+
+    def test_file_size_of_block_device(self):
+        self.src_cloud.ssh_util.execute.return_value = '1073741824\n'
+
+        self.assertEqual(1073741824, self.transporter.file_size(self.data))
+        self.assertEqual(
+            'if [ -b /src/disk ]; then blockdev --getsize64 /src/disk; '
+            'else stat --printf=%s /src/disk; fi',
+            str(self.src_cloud.ssh_util.execute.call_args[0][0]))
+
+    @mock.patch.object(ssh_file_to_file.utils, 'forward_agent',
+                       mock.MagicMock())
+    @mock.patch.object(ssh_file_to_file.sparse, 'remote_data_extents')
+    def test_sparse_transfer_copies_allocated_extents(self, extents):
+        mb = 1024 * 1024
+        extents.return_value = [(0, 10), (5 * mb, 3 * mb)]
+        self.transporter.cfg.migrate.delta_file_transfer = False
+        self.transporter.cfg.migrate.resumable_file_transfer = False
+        self.transporter.cfg.migrate.sparse_file_transfer = True
+        self.src_cloud.ssh_util.execute.return_value = str(10 * mb)
+
+        self.transporter.transfer(self.data)
+
+        copy_cmds = [str(c[0][0])
+                     for c in self.src_cloud.ssh_util.execute.call_args_list
+                     if 'ssh' in str(c[0][0])]
+        self.assertEqual(2, len(copy_cmds))
+        self.assertIn('skip=0 count=1', copy_cmds[0])
+        self.assertIn('skip=5 count=3', copy_cmds[1])
+        self.assertIn('conv=notrunc,sparse', copy_cmds[1])
+        self.assertEqual(
+            'truncate -s 0 /dst/disk && truncate -s %d /dst/disk' % (10 * mb),
+            str(self.dst_cloud.ssh_util.execute.call_args[0][0]))
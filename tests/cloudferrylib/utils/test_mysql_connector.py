@@ -34,3 +34,51 @@ class GetDbTestCase(test.TestCase):
         config.migrate.mysqldump_host = None
 
         self.assertEqual(expected, mysql_connector.get_db_host(config))
+
+
+class MysqlConnectorEngineTestCase(test.TestCase):
+    config = {'db_connection': 'mysql+mysqlconnector',
+              'db_user': 'user',
+              'db_password': 'password',
+              'db_host': 'localhost',
+              'db_port': 3306,
+              'db_pool_size': 3}
+
+    def setUp(self):
+        super(MysqlConnectorEngineTestCase, self).setUp()
+        self.create_engine = mock.patch(
+            'sqlalchemy.create_engine').start()
+        self.addCleanup(mock.patch.stopall)
+        self.addCleanup(mysql_connector.dispose_engines)
+
+    def test_engine_is_shared_between_connectors_to_same_db(self):
+        first = mysql_connector.MysqlConnector(self.config, 'nova')
+        second = mysql_connector.MysqlConnector(self.config, 'nova')
+
+        self.assertIs(first.get_engine(), second.get_engine())
+        self.assertEqual(1, self.create_engine.call_count)
+
+    def test_engines_differ_for_different_databases(self):
+        mysql_connector.MysqlConnector(self.config, 'nova').get_engine()
+        mysql_connector.MysqlConnector(self.config, 'cinder').get_engine()
+
+        self.assertEqual(2, self.create_engine.call_count)
+
+    def test_pool_options_are_taken_from_config(self):
+        mysql_connector.MysqlConnector(self.config, 'nova').get_engine()
+
+        _, kwargs = self.create_engine.call_args
+        self.assertEqual(3, kwargs['pool_size'])
+        self.assertEqual(mysql_connector.DEFAULT_MAX_OVERFLOW,
+                         kwargs['max_overflow'])
+        self.assertTrue(kwargs['pool_pre_ping'])
+
+    def test_execute_updates_stats(self):
+        connector = mysql_connector.MysqlConnector(self.config, 'nova')
+
+        connector.execute('SELECT 1')
+        connector.batch_execute(['SELECT 1', 'SELECT 2'])
+
+        stats = connector.stats.as_dict()
+        self.assertEqual(2, stats['connections'])
+        self.assertEqual(3, stats['statements'])
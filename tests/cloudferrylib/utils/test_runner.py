@@ -14,6 +14,7 @@
 import mock
 
 from cloudferrylib.utils import remote_runner
+from cloudferrylib.utils import ssh_util
 
 from tests import test
 
@@ -26,6 +27,7 @@ class RemoteRunnerTestCase(test.TestCase):
         self.assertRaises(remote_runner.RemoteExecutionError, rr.run,
                           "non existing failing command")
 
+    @mock.patch('cloudferrylib.utils.remote_runner._connect', mock.Mock())
     @mock.patch('cloudferrylib.utils.remote_runner.forward_agent')
     @mock.patch('cloudferrylib.utils.remote_runner.sudo')
     @mock.patch('cloudferrylib.utils.remote_runner.settings')
@@ -41,6 +43,7 @@ class RemoteRunnerTestCase(test.TestCase):
         except Exception as e:
             self.fail("run_ignoring_errors must not raise exceptions: %s" % e)
 
+    @mock.patch('cloudferrylib.utils.remote_runner._connect', mock.Mock())
     @mock.patch('cloudferrylib.utils.remote_runner.forward_agent')
     @mock.patch('cloudferrylib.utils.remote_runner.sudo')
     @mock.patch('cloudferrylib.utils.remote_runner.run')
@@ -52,3 +55,54 @@ class RemoteRunnerTestCase(test.TestCase):
 
         assert not sudo.called
         assert run.called
+
+    @mock.patch.object(remote_runner.RemoteRunner, 'run')
+    def test_batch_returns_output_of_every_command(self, run):
+        rr = remote_runner.RemoteRunner('host', 'root', key='key')
+
+        def fake_run(script):
+            marker = script.split('echo ')[2].split(' ')[0]
+            return ('a\nb\n\n{m} 0\n\n{m} 0\nc\n\n{m} 0'
+                    .format(m=marker))
+        run.side_effect = fake_run
+
+        self.assertEqual(['a\nb', '', 'c'],
+                         rr.run_batch(['cmd1', 'cmd2', 'cmd3']))
+        self.assertIn('cmd1 ; rc=$?', run.call_args[0][0])
+        self.assertFalse(rr.ignore_errors)
+
+    @mock.patch.object(remote_runner.RemoteRunner, 'run')
+    def test_batch_raises_error_for_failed_command(self, run):
+        rr = remote_runner.RemoteRunner('host', 'root', key='key')
+
+        def fake_run(script):
+            marker = script.split('echo ')[2].split(' ')[0]
+            return '\n{m} 0\n\n{m} 1'.format(m=marker)
+        run.side_effect = fake_run
+
+        self.assertRaises(remote_runner.RemoteExecutionError, rr.run_batch,
+                          ['cmd1', 'cmd2'])
+
+        rr.ignore_errors = True
+        self.assertEqual(['', ''], rr.run_batch(['cmd1', 'cmd2']))
+
+
+class SshUtilTestCase(test.TestCase):
+    def setUp(self):
+        super(SshUtilTestCase, self).setUp()
+        self.config = mock.Mock(key_filename='key', ssh_control_persist=300)
+        self.ssh_util = ssh_util.SshUtil(mock.Mock(host='controller'),
+                                         self.config)
+
+    def test_internal_host_connections_are_shared(self):
+        self.assertEqual(
+            "ssh -oStrictHostKeyChecking=no -oControlMaster=auto "
+            "-oControlPath=/tmp/cloudferry-ssh-%r@%h:%p "
+            "-oControlPersist=300s compute 'ls'",
+            str(self.ssh_util.inthost_cmd('compute', 'ls')))
+
+    def test_connection_sharing_can_be_disabled(self):
+        self.config.ssh_control_persist = 0
+
+        self.assertEqual("ssh -oStrictHostKeyChecking=no compute 'ls'",
+                         str(self.ssh_util.inthost_cmd('compute', 'ls')))
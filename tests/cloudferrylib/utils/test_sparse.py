@@ -0,0 +1,53 @@
+# Copyright 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+
+import mock
+
+from cloudferrylib.utils import remote_runner
+from cloudferrylib.utils import sparse
+from tests import test
+
+
+QEMU_IMG_MAP = """[
+{ "start": 0, "length": 65536, "depth": 0, "zero": false, "data": true},
+{ "start": 65536, "length": 3080192, "depth": 0, "zero": true, "data": false},
+{ "start": 3145728, "length": 1048576, "depth": 0, "zero": false,
+  "data": true}]
+"""
+
+
+class SparseTestCase(test.TestCase):
+    def test_parse_qemu_img_map(self):
+        self.assertEqual([(0, 65536), (3145728, 1048576)],
+                         sparse.parse_qemu_img_map(QEMU_IMG_MAP))
+
+    def test_align_extents(self):
+        mb = sparse.MB
+        extents = [(5 * mb, 10), (0, 100), (mb - 1, 2), (5 * mb + 20, mb)]
+
+        self.assertEqual([(0, 2), (5, 2)],
+                         sparse.align_extents(extents, mb))
+
+    def test_extents_are_unknown_if_map_fails(self):
+        run = mock.Mock(side_effect=remote_runner.RemoteExecutionError)
+
+        self.assertIsNone(sparse.remote_data_extents(run, '/disk'))
+
+    def test_zero_md5(self):
+        size = sparse.MB + 10
+
+        self.assertEqual(hashlib.md5('\0' * size).hexdigest(),
+                         sparse.zero_md5(size))
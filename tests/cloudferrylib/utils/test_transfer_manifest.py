@@ -0,0 +1,68 @@
+# Copyright 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from cloudferrylib.utils import transfer_manifest
+from tests import test
+
+
+class TransferManifestTestCase(test.TestCase):
+    def setUp(self):
+        super(TransferManifestTestCase, self).setUp()
+        self.state_dir = os.path.join(tempfile.mkdtemp(), 'manifests')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.state_dir))
+
+    def manifest(self, **source):
+        source = source or {'size': 10, 'mtime': 1, 'chunk_size': 1}
+        return transfer_manifest.TransferManifest(
+            self.state_dir, 'src_host', '/src', 'dst_host', '/dst', **source)
+
+    def test_chunks_are_kept_between_instances(self):
+        self.manifest().put(3, 'md5_3')
+
+        self.assertEqual('md5_3', self.manifest().get(3))
+        self.assertIsNone(self.manifest().get(2))
+
+    def test_manifest_is_discarded_if_source_changed(self):
+        self.manifest().put(3, 'md5_3')
+
+        manifest = self.manifest(size=10, mtime=2, chunk_size=1)
+
+        self.assertIsNone(manifest.get(3))
+
+    def test_removed_manifest_is_not_loaded(self):
+        manifest = self.manifest()
+        manifest.put(3, 'md5_3')
+        manifest.remove()
+
+        self.assertIsNone(self.manifest().get(3))
+        self.assertEqual([], os.listdir(self.state_dir))
+
+    def test_discarded_chunk_is_forgotten(self):
+        manifest = self.manifest()
+        manifest.put(3, 'md5_3')
+        manifest.discard(3)
+
+        self.assertIsNone(self.manifest().get(3))
+
+    def test_manifest_is_not_stored_without_state_dir(self):
+        manifest = transfer_manifest.TransferManifest(
+            None, 'src_host', '/src', 'dst_host', '/dst', size=10)
+        manifest.put(3, 'md5_3')
+
+        self.assertEqual('md5_3', manifest.get(3))
+        self.assertFalse(os.path.exists(self.state_dir))
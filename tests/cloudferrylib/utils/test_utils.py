@@ -0,0 +1,117 @@
+# Copyright 2015 Mirantis Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import mock
+
+from fabric.api import env
+from fabric.api import settings
+
+from cloudferrylib.utils import utils
+from tests import test
+
+
+class ThreadLocalEnvTestCase(test.TestCase):
+    def setUp(self):
+        super(ThreadLocalEnvTestCase, self).setUp()
+        thread_local_env = utils.thread_local_fabric_env()
+        thread_local_env.__enter__()
+        self.addCleanup(thread_local_env.__exit__, None, None, None)
+
+    def run_in_thread(self, func):
+        thread = threading.Thread(target=func)
+        thread.start()
+        thread.join()
+
+    def test_fabric_env_is_restored_outside_of_block(self):
+        self.assertIsInstance(env, utils.ThreadLocalEnv)
+        with utils.thread_local_fabric_env():
+            self.assertIsInstance(env, utils.ThreadLocalEnv)
+        self.assertIsInstance(env, utils.ThreadLocalEnv)
+
+        self.doCleanups()
+
+        self.assertNotIsInstance(env, utils.ThreadLocalEnv)
+
+    def test_thread_settings_are_not_visible_to_other_threads(self):
+        seen = {}
+
+        def set_host():
+            with settings(host_string='thread_host'):
+                seen['inside'] = env.host_string
+                self.run_in_thread(
+                    lambda: seen.update(other=env.get('host_string')))
+
+        with settings(host_string='main_host'):
+            self.run_in_thread(set_host)
+            self.assertEqual('main_host', env.host_string)
+
+        self.assertEqual('thread_host', seen['inside'])
+        self.assertEqual('main_host', seen['other'])
+
+    def test_main_thread_settings_are_visible_to_threads(self):
+        seen = {}
+
+        with settings(cf_test_option='value'):
+            self.run_in_thread(
+                lambda: seen.update(value=env.get('cf_test_option')))
+
+        self.assertEqual('value', seen['value'])
+        self.assertNotIn('cf_test_option', env)
+
+
+class LibvirtBlockInfoTestCase(test.TestCase):
+    @mock.patch('cloudferrylib.utils.utils.sudo')
+    def test_block_info_of_all_domains_is_read_at_once(self, sudo):
+        sudo.return_value = (
+            "@@ instance-1\n"
+            "Target     Source\n"
+            "vda        /var/lib/nova/instances/1/disk\n"
+            "@@ instance-2\n"
+            "error: failed to get domain 'instance-2'\n"
+            "@@ instance-3\n"
+            "Target     Source\n"
+            "vda        /var/lib/nova/instances/3/disk\n")
+
+        block_info = utils.get_libvirt_block_info_batch(
+            ['instance-1', 'instance-2', 'instance-3'], 'init', 'compute',
+            'user', 'password')
+
+        sudo.assert_called_once_with(mock.ANY)
+        self.assertEqual(['Target', 'Source', 'vda',
+                          '/var/lib/nova/instances/3/disk'],
+                         block_info['instance-3'])
+        self.assertNotIn('/var/lib/nova/instances/1/disk',
+                         block_info['instance-2'])
+
+
+class ForwardAgentTestCase(test.TestCase):
+    def setUp(self):
+        super(ForwardAgentTestCase, self).setUp()
+        self.addCleanup(utils.forward_agent._forwarded_keys.clear)
+
+    @mock.patch.object(utils.forward_agent, '_start_agent')
+    @mock.patch.object(utils.forward_agent, '_agent_already_running')
+    def test_agent_is_checked_once_per_key(self, running, start):
+        running.return_value = False
+
+        for _ in range(3):
+            with utils.forward_agent('/key1'):
+                pass
+        with utils.forward_agent('/key2'):
+            pass
+
+        self.assertEqual(2, running.call_count)
+        self.assertEqual(2, start.call_count)
@@ -0,0 +1,35 @@
+from tests import test
+from condensation import algorithms
+import mock
+
+
+ACCURATE_FLAVORS = [(1, 4, 2), (2, 4, 2), (3, 2, 2), (4, 3, 1), (5, 1, 1)]
+FAST_FLAVORS = [(1, 2, 4, 2), (2, 3, 3, 1), (3, 5, 1, 1)]
+
+
+class AlgorithmsTest(test.TestCase):
+
+    def test_accurate(self):
+        self.assertEqual([(2, 4, 2), (1, 4, 2)],
+                         algorithms.accurate(ACCURATE_FLAVORS, 8, 5))
+
+    @mock.patch('condensation.algorithms.numpy', None)
+    def test_accurate_without_numpy(self):
+        self.assertEqual([(2, 4, 2), (1, 4, 2)],
+                         algorithms.accurate(ACCURATE_FLAVORS, 8, 5))
+
+    def test_accurate_nothing_fits(self):
+        self.assertEqual([], algorithms.accurate(ACCURATE_FLAVORS, 0, 5))
+
+    def test_fast(self):
+        self.assertEqual([0, 2, 4], algorithms.fast(FAST_FLAVORS, 10, 6))
+
+    @mock.patch('condensation.algorithms.numpy', None)
+    def test_fast_without_numpy(self):
+        self.assertEqual([0, 2, 4], algorithms.fast(FAST_FLAVORS, 10, 6))
+
+    def test_fast_single_flavor(self):
+        self.assertEqual([2], algorithms.fast([(1, 2, 1, 1)], 2, 2))
+
+    def test_greedy(self):
+        self.assertEqual([2, 0, 2], algorithms.greedy(FAST_FLAVORS, 10, 6))
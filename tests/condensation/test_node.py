@@ -7,7 +7,9 @@ from cfglib import CONF
 # patch settings
 CONF.condense = mock.Mock(
     core_reduction_coef=1,
-    ram_reduction_coef=1
+    ram_reduction_coef=1,
+    ram_granularity=1,
+    max_knapsack_size=0
 )
 
 
@@ -40,3 +42,19 @@ class NodeTest(test.TestCase):
     def test_calculate_flavors_required(self):
         n = node.Node(*range(1, 8))
         self.assertEqual(dict, type(n.calculate_flavors_required({})))
+
+    def test_calculate_flavors_required_greedy(self):
+        n = node.Node('node', 8, 16, 1, 1, 1, 1)
+        big = mock.Mock(fl_id='big', reduced_ram=8, reduced_core=4)
+        small = mock.Mock(fl_id='small', reduced_ram=2, reduced_core=1)
+        with mock.patch.object(CONF.condense, 'max_knapsack_size', 1):
+            result = n.calculate_flavors_required({big: 1, small: 10})
+        self.assertEqual({big: 1, small: 4}, result)
+
+    def test_calculate_flavors_required_ram_granularity(self):
+        n = node.Node('node', 8, 16, 1, 1, 1, 1)
+        flavor = mock.Mock(fl_id='fl', reduced_ram=3, reduced_core=1)
+        with mock.patch.object(CONF.condense, 'ram_granularity', 2):
+            result = n.calculate_flavors_required({flavor: 10},
+                                                  accurate=True)
+        self.assertEqual({flavor: 4}, result)